@@ -2,6 +2,9 @@ import requests
 import json
 import re
 
+# Seconds to wait for the assistant, a hung service must not hang the request that asked it.
+REQUEST_TIMEOUT = 30
+
 def get_general_response(message):
     """
     Sends a POST request to the specified endpoint with the provided message.
@@ -22,7 +25,8 @@ def get_general_response(message):
         }
 
         assistant_host = "http://{sensitive-ip}:8002"  # Replace with your actual assistant host
-        response = requests.post(f"{assistant_host}/chat/general/", json=payload, headers=headers)
+        response = requests.post(f"{assistant_host}/chat/general/", json=payload, headers=headers,
+                                 timeout=REQUEST_TIMEOUT)
 
         response.raise_for_status()  # Raise an exception for HTTP errors
 
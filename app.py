@@ -6,6 +6,15 @@ import secrets
 
 import routers
 from routers.auth import secret_hex
+from tracer.routetrace import FromDatabase, FromDatabaseAsync
+from tracer.routetrace.topology import TopologyIndex
+from tracer.routetrace.arp_index import EndpointIndex
+from tracer.routetrace.device_ids import DeviceIdResolver
+from tracer.routetrace.ssh_pool import SSH_POOL
+from tracer.routetrace.CiscoDeviceConnection import TELNET_POOL
+from tracer.routetrace.CheckPointFireWallConnection import FIREWALL_POOL
+from tracer.routetrace.prefetch import SessionPrefetcher
+from tracer.routetrace.device_fingerprints import FINGERPRINTS
 
 app = FastAPI()
 
@@ -25,6 +34,34 @@ app.include_router(routers.auth_router)
 app.include_router(routers.route_router)
 app.include_router(routers.user_router)
 app.include_router(routers.command_router)
+app.include_router(routers.metrics_router)
+
+
+@app.on_event("startup")
+def open_datalake_pool():
+    app.state.datalake_pool = FromDatabase.create_connection_pool()
+    app.state.async_datalake = FromDatabaseAsync.create_connection_instance(cache=app.state.datalake_pool.cache)
+    app.state.topology = TopologyIndex(app.state.datalake_pool)
+    app.state.topology.start()
+    app.state.endpoint_index = EndpointIndex(app.state.datalake_pool)
+    app.state.endpoint_index.start()
+    app.state.device_ids = DeviceIdResolver(app.state.datalake_pool)
+    app.state.device_ids.start()
+    app.state.prefetcher = SessionPrefetcher()
+
+
+@app.on_event("shutdown")
+async def close_datalake_pool():
+    app.state.topology.stop()
+    app.state.endpoint_index.stop()
+    app.state.device_ids.stop()
+    app.state.prefetcher.close()
+    app.state.datalake_pool.close()
+    SSH_POOL.close()
+    TELNET_POOL.close()
+    FIREWALL_POOL.close()
+    FINGERPRINTS.close()
+    await app.state.async_datalake.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,128 @@
+"""
+Event driven reads of SSH exec channels, shared by the tracer sessions and the network package.
+"""
+import select
+import threading
+import time
+
+
+class CommandTimeoutError(Exception):
+    def __init__(self, message="The device didn't finish sending the command output in time."):
+        self.message = message
+        super().__init__(self.message)
+
+
+RECV_SIZE = 65536
+COMMAND_TIMEOUT = 60
+
+
+class CommandCounters:
+    """
+    Process wide counters of the commands run over SSH channels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.bytes_received = 0
+        self.stderr_bytes = 0
+        self.timeouts = 0
+        self.command_time = 0.0
+
+    def add(self, received, stderr_received, elapsed, timed_out=False):
+        with self._lock:
+            self.commands += 1
+            self.bytes_received += received
+            self.stderr_bytes += stderr_received
+            self.timeouts += timed_out
+            self.command_time += elapsed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'commands': self.commands,
+                'bytes_received': self.bytes_received,
+                'stderr_bytes': self.stderr_bytes,
+                'timeouts': self.timeouts,
+                'command_time': round(self.command_time, 3),
+            }
+
+
+COMMAND_COUNTERS = CommandCounters()
+
+
+class ChannelReader:
+    """
+    Reads the output of several exec channels at once, waking up on whichever channel has data instead
+    of polling, until each device stream is closed or its command times out. stderr is drained alongside
+    so it can't stall a channel window.
+    """
+
+    # select only wakes up on stdout, stderr is drained at least this often.
+    STDERR_DRAIN_INTERVAL = 1.0
+
+    def __init__(self):
+        self._pending = {}  # channel -> [chunks, stdout bytes, stderr bytes, started, deadline]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, channel, timeout=COMMAND_TIMEOUT):
+        started = time.monotonic()
+        self._pending[channel] = [[], 0, 0, started, started + timeout]
+
+    def _finish(self, channel, timed_out=False):
+        chunks, received, stderr_received, started, _ = self._pending.pop(channel)
+        COMMAND_COUNTERS.add(received, stderr_received, time.monotonic() - started, timed_out=timed_out)
+        output = None if timed_out else b''.join(chunks).decode('utf-8', errors='replace')
+        return channel, output, received
+
+    def read(self):
+        """
+        Blocks until at least one channel finished.
+        :return list of (channel, output, stdout bytes), output is None for the commands that timed out
+        """
+        finished = []
+        while not finished and self._pending:
+            now = time.monotonic()
+            for channel, state in list(self._pending.items()):
+                while channel.recv_stderr_ready():
+                    state[2] += len(channel.recv_stderr(RECV_SIZE))
+                if now >= state[4]:
+                    finished.append(self._finish(channel, timed_out=True))
+            if finished or not self._pending:
+                break
+
+            wait = min(state[4] for state in self._pending.values()) - now
+            readable, _, _ = select.select(list(self._pending), [], [], min(wait, self.STDERR_DRAIN_INTERVAL))
+            for channel in readable:
+                data = channel.recv(RECV_SIZE)
+                if not data:
+                    finished.append(self._finish(channel))
+                    continue
+                state = self._pending[channel]
+                state[0].append(data)
+                state[1] += len(data)
+
+        return finished
+
+    def close(self):
+        """
+        Abandons the commands still running.
+        """
+        for channel in list(self._pending):
+            self._pending.pop(channel)
+            channel.close()
+
+
+def read_channel(channel, timeout=COMMAND_TIMEOUT):
+    """
+    Reads the whole output of one command as it arrives.
+    :return (stdout as text, stdout bytes)
+    """
+    reader = ChannelReader()
+    reader.add(channel, timeout)
+    _, output, received = reader.read()[0]
+    if output is None:
+        raise CommandTimeoutError(f"No end of output after {timeout}s, got {received} bytes.")
+    return output, received
@@ -1,6 +1,7 @@
-import time
 import paramiko
 
+from channel_reader import read_channel, COMMAND_TIMEOUT
+
 AuthenticationException = paramiko.AuthenticationException
 
 
@@ -24,21 +25,22 @@ class SessionSSH:
 
         self.ssh_client.connect(self.hostname, self.port, self.username, self.password)
 
-    def execute_command(self, command):
+    def execute_command(self, command, timeout=COMMAND_TIMEOUT):
         if not self.ssh_client or not self.ssh_client.get_transport().is_active():
             self.connect()
 
+        channel = None
         try:
             channel = self.ssh_client.get_transport().open_session()
             channel.exec_command(command)
 
-            while not channel.exit_status_ready():
-                time.sleep(0.2)
-
-            return channel.recv(64500).decode('utf-8')
+            return read_channel(channel, timeout)[0]
 
         except Exception as e:
             print(f"Error executing command: {str(e)}")
+        finally:
+            if channel is not None:
+                channel.close()
 
         return None
 
@@ -2,4 +2,5 @@
 from .auth import router as auth_router
 from .route import router as route_router
 from .user import router as user_router
+from .metrics import router as metrics_router
 from .command_routes.layer_two import router as command_router
@@ -1,7 +1,7 @@
 # routers/auth.py
 from fastapi import APIRouter, HTTPException
-from AI_parser.parser import parse_data
 import tracer.routetrace.FromDevices as FromDevices
+from tracer.routetrace import parser_registry
 from network.commands.layer_two import get_vlans
 from network.paramiko_connection_CiscoDevices import SessionSSH
 
@@ -10,4 +10,4 @@ router = APIRouter()
 @router.get('/vlans/{ip}')
 def get_vlans_of_default_gateway(ip: str):
     device = SessionSSH(hostname=ip, username='', password='', immediately_connect=True)
-    return parse_data(device.execute_command('show vlan'), 'number, name and status of the vlans')
+    return parser_registry.get_vlans_from_show_vlan(get_vlans(device))
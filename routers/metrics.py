@@ -0,0 +1,50 @@
+# routers/metrics.py
+from fastapi import APIRouter, HTTPException, Request
+
+from authentication.token_generator import verify_token, TokenErrors
+from routers.auth import secret_hex
+from tracer.routetrace.query_metrics import QUERY_METRICS
+from tracer.routetrace.trino_connect import DATALAKE_RETRY_POLICY
+from tracer.routetrace.ssh_pool import SSH_POOL
+from tracer.routetrace.CheckPointFireWallConnection import FIREWALL_POOL
+from tracer.routetrace.CiscoDeviceConnection import COMMAND_COUNTERS, TELNET_POOL
+from tracer.routetrace.command_cache import COMMAND_CACHE
+from tracer.routetrace.device_fingerprints import FINGERPRINTS
+from tracer.routetrace.device_scheduler import DEVICE_SCHEDULER
+from tracer.routetrace.parser_registry import PARSERS
+
+router = APIRouter()
+
+
+@router.get('/metrics/datalake')
+def get_datalake_metrics(request: Request):
+    """
+    Per lookup query histograms and the state of the datalake pool, cache, retries and in-memory indexes.
+    """
+    token = request.headers['token']
+    user = verify_token(secret_hex, token)
+    if user == TokenErrors.Expired:
+        raise HTTPException(401, detail='Expired token.')
+    if user == TokenErrors.Invalid:
+        raise HTTPException(401, detail='Invalid token.')
+
+    state = request.app.state
+    pool = state.datalake_pool
+    return {
+        'queries': QUERY_METRICS.snapshot(),
+        'pool': pool.stats(),
+        'cache': pool.cache.stats() if pool.cache else None,
+        'retries': DATALAKE_RETRY_POLICY.stats(),
+        'topology': state.topology.stats(),
+        'endpoint_index': state.endpoint_index.stats(),
+        'device_ids': state.device_ids.stats(),
+        'ssh_pool': SSH_POOL.stats(),
+        'telnet_pool': TELNET_POOL.stats(),
+        'firewall_pool': FIREWALL_POOL.stats(),
+        'ssh_commands': COMMAND_COUNTERS.stats(),
+        'command_cache': COMMAND_CACHE.stats(),
+        'device_fingerprints': FINGERPRINTS.stats(),
+        'device_scheduler': DEVICE_SCHEDULER.stats(),
+        'prefetch': state.prefetcher.stats(),
+        'parsers': PARSERS.stats(),
+    }
@@ -10,7 +10,8 @@ from database.models import RouteTypes
 from models import RouteInit, RouteDelete
 from database import database as db
 from routers.auth import secret_hex
-from tracer.routetrace import FromDatabase
+from tracer.routetrace import FromDatabaseAsync
+from tracer.routetrace.query_cache import UncachedDatalake
 from tracer.routetrace.tracer import Tracer
 import json
 
@@ -22,12 +23,14 @@ router = APIRouter()
 # Get Default Gateway
 @router.get('/get-default-gateway/')
 async def get_default_gateway(request: Request,
-                              ip: str = Query(...)):
+                              ip: str = Query(...),
+                              is_refresh: bool = Query(False)):
     """
     Get the default gateway of an IP address.
 
     Args:
     - ip (str): The IP address.
+    - is_refresh (bool): Skip cached datalake results.
 
     Returns:
     - The default gateway of the IP address.
@@ -40,21 +43,30 @@ async def get_default_gateway(request: Request,
     if user == TokenErrors.Invalid:
         raise HTTPException(401, detail='Invalid token.')
 
-    datalake = FromDatabase.create_connection_instance()
-    default_gateway = await asyncio.to_thread(FromDatabase.get_default_gateway, datalake, ip)
+    async_datalake = request.app.state.async_datalake
+    endpoint_index = request.app.state.endpoint_index
+    if is_refresh:
+        async_datalake = UncachedDatalake(async_datalake)
+        endpoint_index = None
+
+    default_gateway = endpoint_index.get_default_gateway(ip) if endpoint_index else None
+    if not default_gateway:
+        default_gateway = await FromDatabaseAsync.get_default_gateway(async_datalake, ip)
     return default_gateway[0]
 
 # Get MAC Trace
 @router.get('/get-mac-trace/')
 async def get_mac_trace(request: Request,
                         ip: str = Query(...),
-                        dg: str = Query(None)):
+                        dg: str = Query(None),
+                        is_refresh: bool = Query(False)):
     """
     Get the MAC trace from an IP address to its default gateway.
 
     Args:
     - ip (str): The IP address.
     - dg (str): The default gateway.
+    - is_refresh (bool): Skip cached datalake results.
 
     Returns:
     - The MAC trace from the IP address to its default gateway.
@@ -67,15 +79,29 @@ async def get_mac_trace(request: Request,
     if user == TokenErrors.Invalid:
         raise HTTPException(401, detail='Invalid token.')
 
-    datalake = FromDatabase.create_connection_instance()
+    datalake = request.app.state.datalake_pool
+    async_datalake = request.app.state.async_datalake
+    topology = request.app.state.topology
+    endpoint_index = request.app.state.endpoint_index
+    device_ids = request.app.state.device_ids
+    if is_refresh:
+        datalake = UncachedDatalake(datalake)
+        async_datalake = UncachedDatalake(async_datalake)
+        topology = None
+        endpoint_index = None
+        device_ids = None
     tufin = SecureTrackAPI()
 
     if not dg:
-        dg = await asyncio.to_thread(FromDatabase.get_default_gateway, datalake, ip)
+        dg = endpoint_index.get_default_gateway(ip) if endpoint_index else None
+        if not dg:
+            dg = await FromDatabaseAsync.get_default_gateway(async_datalake, ip)
         if dg:
             dg = dg[0]
 
-    tracer = Tracer(print, user["username"], user["password"], datalake, tufin)
+    tracer = Tracer(print, user["username"], user["password"], datalake, tufin, refresh=is_refresh,
+                    topology=topology, endpoint_index=endpoint_index, device_ids=device_ids,
+                    prefetcher=request.app.state.prefetcher)
 
     mac_trace, vrf = await asyncio.to_thread(tracer.find_lan_route_to_endpoint, ip, dg)
 
@@ -95,7 +121,8 @@ async def get_route_trace(request: Request,
                           source_ip: str = Query(...),
                           destination_ip: str = Query(...),
                           source_dg: str = Query(...),
-                          destination_dg: str = Query(...)):
+                          destination_dg: str = Query(...),
+                          is_refresh: bool = Query(False)):
     """
     Get the route trace from a source IP to a destination IP.
 
@@ -106,6 +133,7 @@ async def get_route_trace(request: Request,
     - source_dg_id (str): The ID of the source data group.
     - destination_dg_name (str): The name of the destination data group.
     - destination_dg_id (str): The ID of the destination data group.
+    - is_refresh (bool): Skip cached datalake results.
 
     Returns:
     - The route trace from the source IP to the destination IP.
@@ -118,18 +146,35 @@ async def get_route_trace(request: Request,
     if user == TokenErrors.Invalid:
         raise HTTPException(401, detail='Invalid token.')
 
-    datalake = FromDatabase.create_connection_instance()
+    datalake = request.app.state.datalake_pool
+    async_datalake = request.app.state.async_datalake
+    topology = request.app.state.topology
+    endpoint_index = request.app.state.endpoint_index
+    device_ids = request.app.state.device_ids
+    if is_refresh:
+        datalake = UncachedDatalake(datalake)
+        async_datalake = UncachedDatalake(async_datalake)
+        topology = None
+        endpoint_index = None
+        device_ids = None
     tufin = SecureTrackAPI()
-    tracer = Tracer(print, user["username"], user["password"], datalake, tufin)
-
-    device_id, vrf, mac, interface_or_vlan = await asyncio.to_thread(
-        FromDatabase.default_gateway_step,
-        datalake,
-        source_dg,
-        source_ip
-    )
-
-    source_name = await asyncio.to_thread(FromDatabase.get_device_name_by_ip, datalake, source_dg)
+    tracer = Tracer(print, user["username"], user["password"], datalake, tufin, refresh=is_refresh,
+                    topology=topology, endpoint_index=endpoint_index, device_ids=device_ids,
+                    prefetcher=request.app.state.prefetcher)
+
+    # The first hop is known already, log in to it while the gateway step is looked up.
+    tracer.prefetch(source_dg)
+
+    gateway_step = endpoint_index.default_gateway_step(source_dg, source_ip) if endpoint_index else None
+    if not gateway_step:
+        gateway_step = await FromDatabaseAsync.default_gateway_step(
+            async_datalake,
+            source_dg,
+            source_ip
+        )
+    device_id, vrf, mac, interface_or_vlan = gateway_step
+
+    source_name = await FromDatabaseAsync.get_device_name_by_ip(async_datalake, source_dg)
 
     route_trace = await asyncio.to_thread(tracer.find_wan_route_dg_to_dg,
                                           source_ip,
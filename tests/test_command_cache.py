@@ -0,0 +1,131 @@
+import threading
+
+from tracer.routetrace import command_cache
+from tracer.routetrace.command_cache import CommandCache, bypass_command_cache, is_cacheable, ttl_of
+
+KEY = CommandCache.key('10.0.0.1', 'admin', 'sh  ip cef   10.2.0.0')
+
+
+class SlowCommand:
+    """
+    Command execution that blocks until released, counting how many times it really ran.
+    """
+
+    def __init__(self, output='output'):
+        self.output = output
+        self.runs = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.runs += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.output, Exception):
+            raise self.output
+        return self.output
+
+
+def run_in_threads(cache, execute, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_execute(KEY, execute)))
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_commands_are_normalized_and_only_show_commands_cached():
+    assert KEY == ('10.0.0.1', 'admin', 'sh ip cef 10.2.0.0')
+    assert is_cacheable('show ip route 10.0.0.0') and is_cacheable('sh vrf')
+    assert not is_cacheable('configure terminal') and not is_cacheable('shutdown')
+    assert ttl_of('sh arp vrf AH') == 30
+    assert ttl_of('show cdp n Gi1/0/1 d') == 600
+    assert ttl_of('sh clock') == command_cache.DEFAULT_COMMAND_TTL
+
+
+def test_concurrent_identical_commands_run_once():
+    cache = CommandCache()
+    execute = SlowCommand()
+
+    threads, results = run_in_threads(cache, execute, 5)
+    execute.started.wait(5)
+    while cache.stats()['coalesced'] < 4:
+        threading.Event().wait(0.01)
+    execute.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert execute.runs == 1
+    assert results == ['output'] * 5
+    assert cache.get_or_execute(KEY, execute) == 'output'
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['hits'], stats['in_flight']) == (1, 4, 1, 0)
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached():
+    cache = CommandCache()
+    execute = SlowCommand(output=TimeoutError('device stopped answering'))
+    errors = []
+
+    def run():
+        try:
+            cache.get_or_execute(KEY, execute)
+        except TimeoutError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    execute.started.wait(5)
+    while cache.stats()['coalesced'] < 2:
+        threading.Event().wait(0.01)
+    execute.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert execute.runs == 1
+    assert len(errors) == 3
+    assert cache.get(KEY) == (False, None)
+
+
+def test_none_output_is_not_cached():
+    cache = CommandCache()
+    cache.get_or_execute(KEY, lambda: None)
+
+    assert cache.get(KEY) == (False, None)
+
+
+def test_output_expires_after_the_ttl_of_its_command(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(command_cache.time, 'monotonic', lambda: now[0])
+    cache = CommandCache()
+    cache.put(KEY, 'output')
+
+    now[0] += 59
+    assert cache.get(KEY) == (True, 'output')
+    now[0] += 1
+    assert cache.get(KEY) == (False, None)
+
+
+def test_bypass_runs_the_command_and_refreshes_the_cache():
+    cache = CommandCache()
+    cache.put(KEY, 'stale')
+
+    with bypass_command_cache():
+        assert cache.get_or_execute(KEY, lambda: 'fresh') == 'fresh'
+
+    assert cache.get_or_execute(KEY, lambda: 'unused') == 'fresh'
+    assert cache.stats()['bypassed'] == 1
+
+
+def test_least_recently_used_output_is_dropped():
+    cache = CommandCache(max_entries=2)
+    keys = [CommandCache.key('10.0.0.1', 'admin', f'sh int Gi1/0/{port}') for port in range(3)]
+    cache.put(keys[0], 'a')
+    cache.put(keys[1], 'b')
+    cache.get(keys[0])
+    cache.put(keys[2], 'c')
+
+    assert cache.get(keys[1]) == (False, None)
+    assert cache.get(keys[0]) == (True, 'a')
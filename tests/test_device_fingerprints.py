@@ -0,0 +1,41 @@
+import json
+
+from tracer.routetrace.device_fingerprints import FingerprintStore
+
+
+def test_credential_sets_are_kept_per_user():
+    store = FingerprintStore(path=None)
+    store.record_credentials('10.0.0.1', 'alice', 'fallback')
+
+    assert store.credentials('10.0.0.1', 'alice') == 'fallback'
+    assert store.credentials('10.0.0.1', 'bob') is None
+
+    store.record_credentials('10.0.0.1', 'bob', 'primary')
+    assert store.credentials('10.0.0.1', 'alice') == 'fallback'
+    assert store.stats()['fallback_credentials'] == 1
+
+
+def test_credential_set_shared_by_every_user_in_an_old_file_is_dropped(tmp_path):
+    path = tmp_path / 'device_fingerprints.json'
+    path.write_text(json.dumps({'10.0.0.1': {'platform': 'ios', 'credentials': 'fallback',
+                                             'dialects': {'transport': 'ssh'}, 'updated': 9e12}}))
+    store = FingerprintStore(path=str(path), save_delay=0)
+
+    assert store.credentials('10.0.0.1', 'alice') is None
+    assert store.platform('10.0.0.1') == 'ios'
+
+    store.record_credentials('10.0.0.1', 'alice', 'primary')
+    assert json.loads(path.read_text())['10.0.0.1']['credentials'] == {'alice': 'primary'}
+
+
+def test_fingerprints_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'device_fingerprints.json')
+    store = FingerprintStore(path=path, save_delay=60)
+    store.record_platform('10.0.0.2', 'checkpoint')
+    store.record_dialect('10.0.0.2', 'mpls_next_hop', 'ldp_bindings')
+    assert store.stats()['unsaved_changes'] == 2
+    store.close()
+
+    reloaded = FingerprintStore(path=path)
+    assert reloaded.platform('10.0.0.2') == 'checkpoint'
+    assert reloaded.dialect('10.0.0.2', 'mpls_next_hop') == 'ldp_bindings'
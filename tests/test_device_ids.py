@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+
+import pytest
+
+from tracer.routetrace.device_ids import DeviceIdResolver, canonical_device_id, canonical_interface
+
+
+@pytest.mark.parametrize('interface, canonical', [
+    ('Gi1/0/1', 'gigabitethernet1/0/1'),
+    ('Gi 1/0/1', 'gigabitethernet1/0/1'),
+    ('GigabitEthernet1/0/1', 'gigabitethernet1/0/1'),
+    ('Gi1/0/1.100', 'gigabitethernet1/0/1.100'),
+    ('Te1/1/1', 'tengigabitethernet1/1/1'),
+    ('Tw1/0/1', 'twogigabitethernet1/0/1'),
+    ('Twe1/0/1', 'twentyfivegige1/0/1'),
+    ('Fa0/1', 'fastethernet0/1'),
+    ('Fo1/1/1', 'fortygigabitethernet1/1/1'),
+    ('Hu0/0/0/1', 'hundredgige0/0/0/1'),
+    ('Eth1/1', 'ethernet1/1'),
+    ('Po10', 'port-channel10'),
+    ('Vl100', 'vlan100'),
+    ('Lo0', 'loopback0'),
+    ('Tu5', 'tunnel5'),
+    ('BE100', 'bundle-ether100'),
+    ('Bundle-Ether100', 'bundle-ether100'),
+    ('Mgmt0', 'management0'),
+    ('Xy1/0', 'xy1/0'),
+    ('Null0', 'null0'),
+])
+def test_canonical_interface(interface, canonical):
+    assert canonical_interface(interface) == canonical
+
+
+def test_canonical_interface_of_nothing():
+    assert canonical_interface('') is None
+    assert canonical_interface(None) is None
+
+
+@pytest.mark.parametrize('device_id, canonical', [
+    ('SW1.services.corp', 'sw1'),
+    ('sw1', 'sw1'),
+    (' PE1.site.services.corp ', 'pe1.site'),
+    ('core1.corp', 'core1.corp'),
+])
+def test_canonical_device_id(device_id, canonical):
+    assert canonical_device_id(device_id) == canonical
+
+
+class FakeDatalake:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    @contextmanager
+    def exec_query_stream(self, query, params=None):
+        self.queries.append(query)
+        yield iter(self.rows)
+
+
+def test_resolver_maps_spellings_back_to_the_raw_values():
+    datalake = FakeDatalake([
+        ('SW1.services.corp', 'GigabitEthernet1/0/1'),
+        ('sw1', 'Gi1/0/1'),
+        ('sw1', 'Gi1/0/2'),
+        (None, 'Gi1/0/3'),
+    ])
+    resolver = DeviceIdResolver(datalake, tables={'crawler-interface-config': ('device_id', 'interface')})
+    resolver.refresh()
+
+    assert resolver.device_ids('crawler-interface-config', 'SW1') == ['SW1.services.corp', 'sw1']
+    assert resolver.interfaces('crawler-interface-config', 'sw1.services.corp', 'gi 1/0/1') == [
+        'Gi1/0/1', 'GigabitEthernet1/0/1']
+    assert resolver.interfaces('crawler-interface-config', 'sw1', 'Gi1/0/9') is None
+    assert resolver.device_ids('crawler-cdp-lldp', 'sw1') is None
+    assert (resolver.hits, resolver.misses) == (2, 2)
+    assert datalake.queries == ['select distinct device_id, interface from network."crawler-interface-config" '
+                                'where 1 = 1']
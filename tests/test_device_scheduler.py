@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from tracer.routetrace.device_scheduler import DeviceScheduler, device_owner
+
+
+class FakePool:
+    def __init__(self, idle):
+        self.idle = dict(idle)
+
+    def idle_count(self, device):
+        return self.idle.get(device, 0)
+
+    def evict_idle(self, device, count):
+        closed = min(count, self.idle.get(device, 0))
+        self.idle[device] = self.idle.get(device, 0) - closed
+        return closed
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def queue_session(scheduler, device, owner, granted):
+    """
+    Queues a session of owner on device in a thread, it records the owner once granted and releases right away.
+    """
+    def run():
+        with device_owner(owner):
+            with scheduler.slot(device):
+                granted.append(owner)
+
+    waiting = scheduler.stats()['waiting']
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_until(lambda: scheduler.stats()['waiting'] == waiting + 1)
+    return thread
+
+
+def test_slots_per_device_are_capped():
+    scheduler = DeviceScheduler(max_per_device=2, timeout=5)
+    scheduler.acquire('pe1')
+    scheduler.acquire('pe1')
+    scheduler.acquire('pe2')
+
+    with pytest.raises(DeviceScheduler.SchedulerTimeoutError):
+        scheduler.acquire('pe1', timeout=0.05)
+
+    stats = scheduler.stats()
+    assert (stats['active'], stats['waiting'], stats['timeouts']) == (3, 0, 1)
+    assert stats['devices']['pe1']['active'] == 2
+
+
+def test_total_slots_are_capped():
+    scheduler = DeviceScheduler(max_per_device=3, max_total=2)
+    scheduler.acquire('pe1')
+    scheduler.acquire('pe2')
+
+    with pytest.raises(DeviceScheduler.SchedulerTimeoutError):
+        scheduler.acquire('pe3', timeout=0.05)
+
+
+def test_released_slot_goes_to_the_waiting_session():
+    scheduler = DeviceScheduler(max_per_device=1)
+    scheduler.acquire('pe1')
+    granted = []
+    thread = queue_session(scheduler, 'pe1', 'alice', granted)
+
+    scheduler.release('pe1')
+    thread.join(5)
+
+    assert granted == ['alice']
+    stats = scheduler.stats()
+    assert (stats['active'], stats['queued'], stats['granted']) == (0, 1, 2)
+
+
+def test_least_recently_served_owner_goes_first():
+    scheduler = DeviceScheduler(max_per_device=1)
+    with device_owner('alice'):
+        scheduler.acquire('pe1')
+
+    granted = []
+    threads = [queue_session(scheduler, 'pe1', owner, granted) for owner in ('alice', 'alice', 'bob', 'carol')]
+    scheduler.release('pe1')
+    for thread in threads:
+        thread.join(5)
+
+    assert granted == ['bob', 'carol', 'alice', 'alice']
+
+
+def test_sessions_of_the_same_owner_are_fifo():
+    scheduler = DeviceScheduler(max_per_device=1)
+    scheduler.acquire('pe1')
+
+    granted = []
+    threads = [queue_session(scheduler, 'pe1', owner, granted) for owner in ('first', 'second')]
+    scheduler.release('pe1')
+    for thread in threads:
+        thread.join(5)
+
+    assert granted == ['first', 'second']
+
+
+def test_trim_closes_idle_transports_over_the_cap():
+    scheduler = DeviceScheduler(max_per_device=3)
+    ssh_pool = FakePool({'pe1': 2})
+    telnet_pool = FakePool({'pe1': 1, 'pe2': 3})
+    scheduler.register_pool(ssh_pool)
+    scheduler.register_pool(telnet_pool)
+    scheduler.acquire('pe1')
+    scheduler.acquire('pe1')
+
+    assert scheduler.trim('pe1') == 2
+    assert ssh_pool.idle['pe1'] + telnet_pool.idle['pe1'] == 1
+    assert scheduler.trim('pe2') == 0
+    assert scheduler.stats()['evicted'] == 2
+
+
+def test_release_trims_the_device():
+    scheduler = DeviceScheduler(max_per_device=2)
+    pool = FakePool({'pe1': 1})
+    scheduler.register_pool(pool)
+    scheduler.acquire('pe1')
+
+    pool.idle['pe1'] = 3  # The session checked its transport back in.
+    scheduler.release('pe1')
+
+    assert pool.idle['pe1'] == 2
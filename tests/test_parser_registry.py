@@ -0,0 +1,147 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from tracer.routetrace import parser_registry
+from tracer.routetrace.command_result_parser import SDABorderSuspicion
+from tracer.routetrace.parser_registry import ParserRegistry, is_ip, is_mac, is_interface, is_text, is_parseable
+
+SHOW_VLAN = """
+VLAN Name                             Status    Ports
+---- -------------------------------- --------- -------------------------------
+1    default                          active    Gi1/0/1, Gi1/0/2
+10   users                            active    Gi1/0/3
+1002 fddi-default                     act/unsup
+
+VLAN Type  SAID       MTU   Parent RingNo BridgeNo Stp  BrdgMode Trans1 Trans2
+---- ----- ---------- ----- ------ ------ -------- ---- -------- ------ ------
+1    enet  100001     1500  -      -      -        -    -        0      0
+"""
+
+
+class FakeAI:
+    def __init__(self, answer=None, error=None):
+        self.answer = answer
+        self.error = error
+        self.calls = []
+
+    def __call__(self, *args):
+        self.calls.append(args)
+        if self.error:
+            raise self.error
+        return self.answer
+
+
+def register(local, ai=None, validate=is_ip):
+    registry = ParserRegistry()
+    return registry, registry.register(local, validate, ai, kind='next_hop')
+
+
+def test_validators():
+    assert is_ip('10.1.2.3') and is_ip(' 10.1.2.3\n')
+    assert not is_ip('10.1.2') and not is_ip(None) and not is_ip('Gi1/0/1')
+    assert is_mac('AABB.CCDD.EEFF') and not is_mac('10.1.2.3')
+    assert is_interface('GigabitEthernet1/0/1') and is_interface('Te1/1/1.100')
+    assert not is_interface('') and not is_interface(None)
+    assert is_text('core-sw1') and not is_text('  ') and not is_text(('core-sw1',))
+
+
+def test_rejected_or_empty_output_is_not_parseable():
+    assert is_parseable('Gateway of last resort is 10.0.0.1')
+    assert not is_parseable('')
+    assert not is_parseable(None)
+    assert not is_parseable("         ^\n% Invalid input detected at '^' marker.")
+
+
+def test_valid_local_result_never_asks_ai():
+    ai = FakeAI('10.9.9.9')
+    registry, parse = register(lambda output: '10.0.0.1', ai)
+
+    assert parse('output') == '10.0.0.1'
+    assert ai.calls == []
+    assert registry.stats()['next_hop']['local_answers'] == 1
+
+
+def test_invalid_local_result_falls_back_to_ai():
+    ai = FakeAI('10.9.9.9')
+    registry, parse = register(lambda output: 'Gi1/0/1', ai)
+
+    assert parse('output') == '10.9.9.9'
+    assert ai.calls == [('output',)]
+    stats = registry.stats()['next_hop']
+    assert (stats['fallbacks'], stats['ai_answers'], stats['fallback_rate']) == (1, 1, 1.0)
+
+
+def test_local_error_falls_back_to_ai():
+    registry, parse = register(lambda output: [][0], FakeAI('10.9.9.9'))
+
+    assert parse('output') == '10.9.9.9'
+    assert registry.stats()['next_hop']['local_errors'] == 1
+
+
+def test_failed_ai_gives_the_local_result_back():
+    registry, parse = register(lambda output: 'no route', FakeAI(error=Exception('unreachable')))
+
+    assert parse('output') == 'no route'
+    assert registry.stats()['next_hop']['ai_failures'] == 1
+
+
+def test_invalid_ai_answer_reraises_the_local_error():
+    registry, parse = register(lambda output: [][0], FakeAI('not an ip'))
+
+    with pytest.raises(IndexError):
+        parse('output')
+
+
+def test_unparseable_output_is_not_sent_to_ai():
+    ai = FakeAI('10.9.9.9')
+    registry, parse = register(lambda output: 'Gi1/0/1', ai)
+
+    assert parse('% Invalid input detected') == 'Gi1/0/1'
+    assert ai.calls == []
+    assert registry.stats()['next_hop']['unparseable'] == 1
+
+
+@pytest.mark.parametrize('not_found', [None, (None, None), []])
+def test_not_found_answer_never_asks_ai(not_found):
+    ai = FakeAI('10.9.9.9')
+    registry, parse = register(lambda output: not_found, ai)
+
+    assert parse('output') == not_found
+    assert ai.calls == []
+    assert registry.stats()['next_hop']['not_found'] == 1
+
+
+def test_hop_lookups_have_no_ai_fallback():
+    for kind in ('next_hop_ip_and_protocol_from_cef', 'next_hop_ip_and_protocol_from_route',
+                 'next_hop_ip_from_mpls_ldp', 'lib_entry_from_mpls_ldp_bindings', 'next_hop_ip_from_firewall',
+                 'fe_ip_from_lisp_eid_table'):
+        assert parser_registry.PARSERS._parsers[kind][2] is None
+
+
+def test_control_flow_exceptions_propagate_without_ai():
+    def local(output):
+        raise SDABorderSuspicion
+
+    ai = FakeAI('10.9.9.9')
+    registry, parse = register(local, ai)
+
+    with pytest.raises(SDABorderSuspicion):
+        parse('output')
+    assert ai.calls == []
+
+
+def test_parser_without_ai_returns_the_local_result_as_is():
+    registry, parse = register(lambda output: None)
+
+    assert parse('output') is None
+    assert registry.stats()['next_hop']['fallbacks'] == 0
+
+
+def test_show_vlan_is_parsed_locally():
+    assert parser_registry.get_vlans_from_show_vlan(SHOW_VLAN) == [
+        ('1', 'default', 'active'),
+        ('10', 'users', 'active'),
+        ('1002', 'fddi-default', 'act/unsup'),
+    ]
+    assert parser_registry.PARSERS.stats()['vlans_from_show_vlan']['fallbacks'] == 0
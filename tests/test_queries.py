@@ -0,0 +1,82 @@
+import pytest
+
+from tracer.routetrace import queries
+
+
+def test_conditions_are_bound_not_interpolated():
+    where, params = queries.where_clause([('ip', '=', "10.0.0.1' or 1=1 --"), ('vrf', 'LIKE', 'AH%')])
+
+    assert where == 'ip = ? and vrf like ?'
+    assert params == ["10.0.0.1' or 1=1 --", 'AH%']
+
+
+def test_in_condition_binds_every_value():
+    where, params = queries.where_clause([('device_id', 'in', ('sw1', 'sw2', 'sw3'))])
+
+    assert where == 'device_id in (?, ?, ?)'
+    assert params == ['sw1', 'sw2', 'sw3']
+
+
+def test_empty_in_condition_matches_nothing():
+    assert queries.where_clause([('device_id', 'in', [])]) == ('1 = 0', [])
+
+
+def test_no_conditions_match_everything():
+    assert queries.where_clause([]) == ('1 = 1', [])
+
+
+def test_unsupported_operator_is_rejected():
+    with pytest.raises(ValueError):
+        queries.where_clause([('ip', '; drop table', '10.0.0.1')])
+
+
+def test_latest_row_orders_by_newest_and_limits():
+    sql, params = queries.latest_row('crawler-arp-table', ['mac', 'interface'], [('ip', '=', '10.0.0.1')])
+
+    assert sql == ('select mac, interface from network."crawler-arp-table" '
+                   'where ip = ? order by timestamp desc limit 1')
+    assert params == ['10.0.0.1']
+
+
+def test_distinct_rows():
+    sql, params = queries.distinct_rows('crawler-devices', ['id', 'ip'])
+
+    assert sql == 'select distinct id, ip from network."crawler-devices" where 1 = 1'
+    assert params == []
+
+
+def test_latest_rows_per_key_ranks_within_each_key():
+    sql, params = queries.latest_rows_per_key('crawler-mac-table', ['device_id', 'mac', 'interface'],
+                                              ['device_id', 'mac'], [('mac', 'in', ['aa', 'bb'])])
+
+    assert sql == ('select device_id, mac, interface from ('
+                   'select device_id, mac, interface, row_number() over '
+                   '(partition by device_id, mac order by timestamp desc) as row_rank '
+                   'from network."crawler-mac-table" where mac in (?, ?)'
+                   ') where row_rank = 1')
+    assert params == ['aa', 'bb']
+
+
+def test_first_ranked_row_keeps_the_params_in_candidate_order():
+    sql, params = queries.first_ranked_row([
+        ('crawler-arp-table', ['mac'], [('ip', '=', '10.0.0.1')]),
+        ('crawler-mac-table', ['mac'], [('ip', '=', '10.0.0.2'), ('vlan', '=', 10)]),
+    ])
+
+    assert sql.count(' union all ') == 1
+    assert sql.index('0 as priority') < sql.index('1 as priority')
+    assert sql.startswith('select c0 from (')
+    assert sql.endswith(') order by priority, row_timestamp desc limit 1')
+    assert sql.count('?') == len(params)
+    assert params == ['10.0.0.1', '10.0.0.2', 10]
+
+
+@pytest.mark.parametrize('value, literal', [
+    (None, 'NULL'),
+    (True, 'true'),
+    (42, '42'),
+    (1.5, '1.5'),
+    ("it's", "'it''s'"),
+])
+def test_sql_literal(value, literal):
+    assert queries.sql_literal(value) == literal
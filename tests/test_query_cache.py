@@ -0,0 +1,94 @@
+import pytest
+
+from tracer.routetrace import query_cache
+from tracer.routetrace.query_cache import QueryCache, normalize_query, tables_of_query, estimate_size
+
+ARP_QUERY = 'SELECT mac FROM network."crawler-arp-table" WHERE ip = ?'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(query_cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_queries_differing_only_in_whitespace_share_a_key():
+    written = """
+        SELECT mac
+        FROM network."crawler-arp-table"
+        WHERE ip = ?
+    """
+
+    assert normalize_query(written) == normalize_query(ARP_QUERY) == ARP_QUERY
+
+
+def test_ttl_is_the_shortest_among_the_tables_of_the_query():
+    cache = QueryCache(table_ttls={'crawler-arp-table': 300, 'crawler-devices': 3600}, default_ttl=60)
+
+    assert tables_of_query(ARP_QUERY) == {'crawler-arp-table'}
+    assert cache.ttl_of(ARP_QUERY) == 300
+    assert cache.ttl_of(ARP_QUERY + ' AND device IN (SELECT id FROM network."crawler-devices")') == 300
+    assert cache.ttl_of('SELECT * FROM network."unknown-table"') == 60
+    assert cache.ttl_of('SELECT 1') == 60
+
+
+def test_entry_expires_after_its_ttl(clock):
+    cache = QueryCache()
+    cache.put('key', [('aa:bb',)], ttl=10)
+
+    clock.now += 9
+    assert cache.get('key') == (True, [('aa:bb',)])
+
+    clock.now += 1
+    assert cache.get('key') == (False, None)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations'], stats['entries'], stats['bytes']) == (1, 1, 1, 0, 0)
+
+
+def test_zero_ttl_is_not_cached():
+    cache = QueryCache()
+    cache.put('key', [1], ttl=0)
+
+    assert cache.get('key') == (False, None)
+
+
+def test_least_recently_used_entry_is_evicted_over_the_budget():
+    entry_size = estimate_size('a') + estimate_size([1])
+    cache = QueryCache(max_bytes=entry_size * 2)
+    cache.put('a', [1], ttl=60)
+    cache.put('b', [1], ttl=60)
+    cache.get('a')
+
+    cache.put('c', [1], ttl=60)
+
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, [1])
+    assert cache.get('c') == (True, [1])
+    assert cache.stats()['evictions'] == 1
+
+
+def test_result_larger_than_the_budget_is_not_cached():
+    cache = QueryCache(max_bytes=100)
+    cache.put('key', list(range(1000)), ttl=60)
+
+    assert cache.stats()['entries'] == 0
+
+
+def test_replacing_an_entry_keeps_the_byte_count():
+    cache = QueryCache()
+    cache.put('key', [1], ttl=60)
+    size = cache.stats()['bytes']
+
+    cache.put('key', [2], ttl=60)
+
+    assert cache.stats()['bytes'] == size
+    assert cache.get('key') == (True, [2])
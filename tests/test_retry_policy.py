@@ -0,0 +1,209 @@
+import asyncio
+
+import pytest
+
+from tracer.routetrace import retry_policy
+from tracer.routetrace.retry_policy import (RetryPolicy, CircuitBreaker, CircuitOpenError, DeadlineExceeded,
+                                            trace_deadline, remaining_time)
+
+
+class Clock:
+    """
+    Fake monotonic clock, time.sleep advances it instead of waiting.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry_policy.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(retry_policy.time, 'sleep', clock.sleep)
+    return clock
+
+
+def failing(times, error=ConnectionError, result='rows'):
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= times:
+            raise error()
+        return result
+
+    func.calls = calls
+    return func
+
+
+def test_delay_doubles_up_to_the_max():
+    policy = RetryPolicy(base_delay=0.5, max_delay=3, jitter=0)
+
+    assert [policy.delay(retry) for retry in range(5)] == [0.5, 1, 2, 3, 3]
+
+
+def test_jitter_only_shortens_the_delay():
+    policy = RetryPolicy(base_delay=1, jitter=0.5)
+
+    assert all(0.5 <= policy.delay(0) <= 1 for _ in range(100))
+
+
+def test_transient_errors_are_retried_with_backoff(clock):
+    policy = RetryPolicy(retry_on=(ConnectionError,), base_delay=0.5, jitter=0)
+    func = failing(2)
+    retries = []
+
+    assert policy.call(func, on_retry=lambda error, retry: retries.append(retry)) == 'rows'
+    assert clock.sleeps == [0.5, 1]
+    assert retries == [1, 2]
+    assert policy.stats()['retries'] == 2
+
+
+def test_gives_up_after_max_attempts(clock):
+    policy = RetryPolicy(retry_on=(ConnectionError,), max_attempts=3, jitter=0)
+    func = failing(5)
+
+    with pytest.raises(ConnectionError):
+        policy.call(func)
+    assert len(func.calls) == 3
+    assert policy.stats()['failures'] == 1
+
+
+def test_non_transient_errors_are_not_retried(clock):
+    policy = RetryPolicy(retry_on=(ConnectionError,))
+    func = failing(1, error=ValueError)
+
+    with pytest.raises(ValueError):
+        policy.call(func)
+    assert len(func.calls) == 1
+
+
+def test_deadline_stops_retries_that_wouldnt_fit(clock):
+    policy = RetryPolicy(retry_on=(ConnectionError,), base_delay=1, jitter=0, max_attempts=10)
+    func = failing(10)
+
+    with trace_deadline(2.5):
+        with pytest.raises(DeadlineExceeded):
+            policy.call(func)
+    assert clock.sleeps == [1]
+    assert policy.stats()['deadline_exceeded'] == 1
+
+
+def test_spent_deadline_fails_before_calling(clock):
+    policy = RetryPolicy()
+    func = failing(0)
+
+    with trace_deadline(1):
+        clock.now += 1
+        with pytest.raises(DeadlineExceeded):
+            policy.call(func)
+    assert func.calls == []
+
+
+def test_nested_deadline_can_only_shorten_the_budget(clock):
+    with trace_deadline(10):
+        with trace_deadline(60):
+            assert remaining_time() == 10
+        with trace_deadline(5):
+            assert remaining_time() == 5
+    assert remaining_time() is None
+
+
+def test_breaker_opens_after_consecutive_failures_then_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # One trial call at a time.
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    assert breaker.times_opened == 1
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.times_opened == 2
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_fails_fast_and_stops_retries(clock):
+    policy = RetryPolicy(retry_on=(ConnectionError,), jitter=0,
+                         breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+    func = failing(10)
+
+    with pytest.raises(ConnectionError):
+        policy.call(func)
+    assert len(func.calls) == 2
+
+    with pytest.raises(CircuitOpenError):
+        policy.call(func)
+    assert len(func.calls) == 2
+    assert policy.stats()['rejected'] == 1
+    assert policy.stats()['breaker_state'] == CircuitBreaker.OPEN
+
+
+def test_non_transient_error_counts_as_a_healthy_backend(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+    policy = RetryPolicy(retry_on=(ConnectionError,), max_attempts=1, breaker=breaker)
+
+    with pytest.raises(ConnectionError):
+        policy.call(failing(1))
+    with pytest.raises(ValueError):
+        policy.call(failing(1, error=ValueError))
+
+    assert breaker.failures == 0
+
+
+def test_call_async_retries_without_blocking(monkeypatch):
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    monkeypatch.setattr(retry_policy.asyncio, 'sleep', sleep)
+    policy = RetryPolicy(retry_on=(ConnectionError,), base_delay=0.5, jitter=0)
+    calls = []
+
+    async def func():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError()
+        return 'rows'
+
+    assert asyncio.run(policy.call_async(func)) == 'rows'
+    assert delays == [0.5, 1]
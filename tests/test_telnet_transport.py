@@ -0,0 +1,177 @@
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('paramiko')
+
+from channel_reader import CommandTimeoutError
+from tracer.routetrace.CiscoDeviceConnection import Session, TelnetTransport
+
+PROMPT = b'core-sw1#'
+MORE = b' --More-- '
+ERASE = b'\x08' * 10 + b' ' * 10 + b'\x08' * 10
+
+
+class FakeDevice:
+    """
+    Telnet CLI of a device on localhost: username and password prompts, then scripted command outputs.
+    Every output is a list of chunks, b'--More--' between two chunks pages the output until a space
+    comes back, a float pauses before the next chunk, and None never brings the prompt back.
+    """
+
+    def __init__(self, outputs, password=b'secret'):
+        self.outputs = outputs
+        self.password = password
+        self.commands = []
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _line(conn):
+        line = b''
+        while not line.endswith(b'\n'):
+            data = conn.recv(1)
+            if not data:
+                return None
+            line += data
+        return line.strip(b'\r\n')
+
+    def _serve(self):
+        conn, _ = self.server.accept()
+        with conn:
+            conn.sendall(b'\r\nUser Access Verification\r\n\r\nUsername: ')
+            if self._line(conn) is None:
+                return
+            conn.sendall(b'Password: ')
+            if self._line(conn) != self.password:
+                conn.sendall(b'\r\n% Login invalid\r\n\r\nUsername: ')
+                self._line(conn)
+                return
+            conn.sendall(b'\r\n' + PROMPT)
+
+            while True:
+                command = self._line(conn)
+                if command is None:
+                    return
+                self.commands.append(command)
+                conn.sendall(command + b'\r\n')
+                for chunk in self.outputs.get(command, [b'']):
+                    if chunk is None:
+                        self._line(conn)
+                        return
+                    if isinstance(chunk, float):
+                        time.sleep(chunk)
+                    elif chunk == b'--More--':
+                        conn.sendall(MORE)
+                        if conn.recv(1) != b' ':
+                            return
+                        conn.sendall(ERASE)
+                    else:
+                        conn.sendall(chunk)
+                conn.sendall(PROMPT)
+
+    def close(self):
+        self.server.close()
+
+
+@pytest.fixture
+def device(request):
+    device = FakeDevice(request.param)
+    yield device
+    device.close()
+
+
+def connect(device):
+    transport = TelnetTransport('127.0.0.1', device.port, connect_timeout=5)
+    transport.login('admin', 'secret')
+    return transport
+
+
+@pytest.mark.parametrize('device', [{}], indirect=True)
+def test_login_learns_the_prompt_and_turns_paging_off(device):
+    transport = connect(device)
+
+    assert transport.prompt.pattern.startswith(b'core\\-sw1\\#')
+    assert device.commands == [b'', b'terminal length 0']
+    transport.close()
+
+
+def test_login_with_wrong_password_raises():
+    device = FakeDevice({}, password=b'other')
+    transport = TelnetTransport('127.0.0.1', device.port, connect_timeout=5)
+
+    with pytest.raises(TelnetTransport.LoginError):
+        transport.login('admin', 'secret')
+    transport.close()
+    device.close()
+
+
+@pytest.mark.parametrize('device', [{
+    b'show vlan': [b'10   users    active\r\n', b'--More--', b'20   voice    active\r\n', b'--More--',
+                   b'30   mgmt     active\r\n'],
+}], indirect=True)
+def test_more_prompts_are_answered_and_erased(device):
+    transport = connect(device)
+
+    output, received = transport.execute_command('show vlan', timeout=5)
+
+    assert output == '10   users    active\n20   voice    active\n30   mgmt     active\n'
+    assert received > len(output)
+    transport.close()
+
+
+@pytest.mark.parametrize('device', [{
+    b'show run | i hostname': [b'hostname backup-sw2#\r\nbackup-sw2#\r\n', 0.3, b'hostname core-sw1\r\n'],
+}], indirect=True)
+def test_output_lines_looking_like_a_prompt_dont_end_the_command(device):
+    transport = connect(device)
+
+    output, _ = transport.execute_command('show run | i hostname', timeout=5)
+
+    assert output == 'hostname backup-sw2#\nbackup-sw2#\nhostname core-sw1\n'
+    transport.close()
+
+
+@pytest.mark.parametrize('device', [{b'show tech': [b'partial output\r\n', None]}], indirect=True)
+def test_command_without_prompt_times_out(device):
+    transport = connect(device)
+
+    start = time.monotonic()
+    with pytest.raises(CommandTimeoutError):
+        transport.execute_command('show tech', timeout=0.5)
+    assert time.monotonic() - start < 3
+    transport.close()
+
+
+def refuse_ssh():
+    raise ConnectionRefusedError()
+
+
+def refusing_ssh_session(telnet):
+    session = Session('192.0.2.1', 'admin', 'secret', immediately_connect=False, pool=None, telnet_pool=None,
+                      fingerprints=None, scheduler=None, command_cache=None, telnet=telnet)
+    session.open_ssh_client = refuse_ssh
+    session.open_telnet_client = lambda: 'telnet transport'
+    return session
+
+
+def test_refused_ssh_doesnt_fall_back_to_telnet_by_default():
+    session = refusing_ssh_session(telnet=False)
+
+    with pytest.raises(ConnectionRefusedError):
+        session.connect()
+    assert session.telnet_client is None
+
+
+def test_refused_ssh_falls_back_to_telnet_when_allowed():
+    session = refusing_ssh_session(telnet=True)
+
+    session.connect()
+    assert session.telnet_client == 'telnet transport'
@@ -0,0 +1,60 @@
+import pytest
+
+trino = pytest.importorskip('trino')
+requests = pytest.importorskip('requests')
+
+from tracer.routetrace.result_stream import ResultStream
+from tracer.routetrace.trino_pool import TrinoConnectionPool
+
+
+class FailingCursor:
+    """
+    Cursor whose second page fails with error.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+    def fetchmany(self, size):
+        raise self.error
+
+
+class FakeDatalake:
+    def __init__(self, error):
+        self.cursor = FailingCursor(error)
+        self.closed = False
+
+    def exec_query_stream(self, query, params=None, batch_size=1000, on_close=None):
+        return ResultStream(self.cursor, ['ip'], [('10.0.0.1',)], batch_size=batch_size, on_close=on_close)
+
+    def ping(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def read_failing_stream(error):
+    datalake = FakeDatalake(error)
+    pool = TrinoConnectionPool(min_size=1, max_size=1, factory=lambda: datalake)
+
+    with pytest.raises(type(error)):
+        list(pool.exec_query_stream('select ip from network."crawler-arp-table"'))
+
+    return pool, datalake
+
+
+def test_query_error_on_a_later_page_keeps_the_connection():
+    pool, datalake = read_failing_stream(ValueError('division by zero'))
+
+    assert not datalake.closed
+    assert pool.stats()['discarded'] == 0
+    assert pool.stats()['idle'] == 1
+
+
+def test_connection_error_on_a_later_page_discards_the_connection():
+    pool, datalake = read_failing_stream(requests.exceptions.ConnectionError('connection reset'))
+
+    assert datalake.closed
+    assert pool.stats()['discarded'] == 1
+    assert pool.stats()['size'] == 0
@@ -1,29 +1,100 @@
 from netmiko import ConnectHandler
 
+from tracer.routetrace.device_scheduler import DEVICE_SCHEDULER
+from tracer.routetrace.ssh_pool import SSHTransportPool
+
+# Seconds send_command waits for the clish prompt after a command.
+READ_TIMEOUT = 20
+
 
 class CheckpointFirewall:
-    def __init__(self, ip, username, password, immediately_connect=True):
+    def __init__(self, ip, username, password, immediately_connect=True, read_timeout=READ_TIMEOUT):
         self.device = {
             'device_type': 'checkpoint_gaia',
             'ip': ip,
             'username': username,
             'password': password
         }
+        self.read_timeout = read_timeout
 
         self.net_connect = None
+        self.in_clish = False
         if immediately_connect:
             self.connect()
 
+    def __repr__(self):
+        return f"CheckpointFirewall object for: {self.device['ip']}"
+
     def connect(self):
         self.net_connect = ConnectHandler(**self.device)
+        self.in_clish = False
+
+    def enter_clish(self):
+        """
+        Switches the session to clish and learns its prompt, so commands return as soon as the prompt is back.
+        """
+        if not self.net_connect:
+            print('Not connected to the firewall, run connect method first.')
+            return
+        self.net_connect.send_command_timing('clish')
+        self.net_connect.set_base_prompt(pri_prompt_terminator='>', alt_prompt_terminator='#')
+        self.net_connect.send_command('set clienv rows 0', read_timeout=self.read_timeout)
+        self.in_clish = True
 
-    def execute_command(self, command):
+    def execute_command(self, command, read_timeout=None):
+        """
+        Outside clish commands run with send_command_timing, the prompt isn't known.
+        :param read_timeout: seconds to wait for the prompt, read_timeout of the session by default
+        """
         if self.net_connect:
-            output = self.net_connect.send_command_timing(command)
+            if not self.in_clish:
+                return self.net_connect.send_command_timing(command)
+            output = self.net_connect.send_command(command, read_timeout=read_timeout or self.read_timeout)
             return output
         else:
             print('Not connected to the firewall, run connect method first.')
 
+    def is_alive(self):
+        return self.net_connect is not None and self.net_connect.is_alive()
+
+    def set_keepalive(self, interval):
+        channel = getattr(self.net_connect, 'remote_conn', None)
+        transport = channel.get_transport() if hasattr(channel, 'get_transport') else None
+        if transport is not None:
+            transport.set_keepalive(interval)
+
     def disconnect(self):
         if self.net_connect:
             self.net_connect.disconnect()
+            self.net_connect = None
+            self.in_clish = False
+
+
+class FirewallSessionPool(SSHTransportPool):
+    """
+    Pool of logged in firewall sessions already in clish, keyed like SSHTransportPool. A firewall hop
+    borrows one for its show route and gives it back, instead of logging in and entering clish again.
+    """
+
+    def __init__(self, max_per_host=2, idle_timeout=300, keepalive_interval=30, checkout_timeout=60):
+        super().__init__(max_per_host, idle_timeout, keepalive_interval, checkout_timeout)
+
+    def __repr__(self):
+        return f"FirewallSessionPool object with {sum(self._open.values())} open sessions"
+
+    @staticmethod
+    def _is_alive(firewall):
+        return firewall.is_alive()
+
+    def _keep_alive(self, firewall):
+        firewall.set_keepalive(self.keepalive_interval)
+
+    def _close(self, firewall):
+        try:
+            firewall.disconnect()
+        except Exception as e:
+            print(f"Error closing firewall session: {e}")
+
+
+FIREWALL_POOL = FirewallSessionPool()
+DEVICE_SCHEDULER.register_pool(FIREWALL_POOL)
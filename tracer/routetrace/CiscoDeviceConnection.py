@@ -1,14 +1,163 @@
+import os
+import re
+import socket
 import time
 import paramiko
 import telnetlib
 
+from channel_reader import CommandTimeoutError, COMMAND_TIMEOUT, COMMAND_COUNTERS, ChannelReader, read_channel
+from tracer.routetrace.ssh_pool import SSH_POOL, SSHTransportPool
+from tracer.routetrace.command_cache import COMMAND_CACHE, CommandCache, is_cacheable
+from tracer.routetrace.device_fingerprints import FINGERPRINTS
+from tracer.routetrace.device_scheduler import DEVICE_SCHEDULER
+
+
 class DeviceConnectionError(Exception):
     def __init__(self, message="Seems like there is no connection to the device."):
         self.message = message
         super().__init__(self.message)
 
+
+# Exec channels execute_many keeps open at once on one transport, devices cap the channels of a connection.
+MAX_CHANNELS = 4
+# Telnet sends the credentials in cleartext, sessions only fall back to it when this is turned on with the
+# DEVICE_TELNET_FALLBACK environment variable (or telnet=True), never because SSH is closed or filtered.
+TELNET_FALLBACK = os.environ.get('DEVICE_TELNET_FALLBACK', '').lower() in ('1', 'true', 'yes')
+
+
+class TelnetTransport:
+    """
+    Telnet CLI of a legacy device, read up to its prompt instead of sleeping and reading what arrived.
+    Paging (--More--) is answered with a space, so long outputs come back whole, and a command that
+    doesn't bring the prompt back within its timeout raises CommandTimeoutError.
+    """
+
+    LOGIN_PATTERN = re.compile(rb'(?i)(username|login)\s*:\s*$')
+    PASSWORD_PATTERN = re.compile(rb'(?i)password\s*:\s*$')
+    PROMPT_PATTERN = re.compile(rb'[\w.\-()/:@]+[>#]\s*$')
+    MORE_PATTERN = re.compile(rb' ?-+ ?\(?[Mm]ore\)? ?-+ ?')
+    # Backspaces and blanks the device sends to erase the paging marker.
+    ERASE_PATTERN = re.compile(rb'\x08+ *\x08*')
+    LOGIN_FAILED_PATTERN = re.compile(rb'(?i)(login invalid|authentication failed|access denied|bad password)')
+
+    class LoginError(Exception):
+        def __init__(self, message="The device refused the telnet login."):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(self, hostname, port=23, connect_timeout=10):
+        self.hostname = hostname
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.prompt = None
+        self.client = telnetlib.Telnet(hostname, port, connect_timeout)
+
+    def __repr__(self):
+        return f"TelnetTransport object for: {self.hostname}"
+
+    def _expect(self, patterns, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return -1, None, b''
+        return self.client.expect(patterns, remaining)
+
+    def login(self, username, password, timeout=None):
+        """
+        Answers the username and password prompts, learns the exact prompt of the device and turns paging off.
+        """
+        deadline = time.monotonic() + (timeout or self.connect_timeout)
+        index, _, _ = self._expect([self.LOGIN_PATTERN, self.PASSWORD_PATTERN, self.PROMPT_PATTERN], deadline)
+        if index == 0:
+            self.client.write(username.encode('ascii') + b'\n')
+            index, _, _ = self._expect([self.PASSWORD_PATTERN], deadline)
+            index = 1 if index == 0 else -1
+        if index == 1:
+            self.client.write(password.encode('ascii') + b'\n')
+            index, _, text = self._expect([self.PROMPT_PATTERN, self.LOGIN_PATTERN, self.LOGIN_FAILED_PATTERN], deadline)
+            if index != 0:
+                raise self.LoginError()
+        elif index != 2:
+            raise self.LoginError("No login prompt from the device.")
+
+        # The learned prompt can't be confused with output lines ending in > or #.
+        self.client.write(b'\n')
+        index, match, _ = self._expect([self.PROMPT_PATTERN], deadline)
+        if index != 0:
+            raise self.LoginError("No prompt from the device after the login.")
+        self.prompt = re.compile(re.escape(match.group(0).strip()) + rb'\s*$')
+        self.execute_command('terminal length 0', timeout or self.connect_timeout)
+
+    def execute_command(self, command, timeout=COMMAND_TIMEOUT):
+        """
+        :return (output without the echoed command and the prompt, bytes received)
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        self.client.read_very_eager()  # Leftovers of an abandoned command.
+        self.client.write(command.encode('ascii') + b'\n')
+
+        chunks = []
+        received = 0
+        while True:
+            index, _, text = self._expect([self.prompt, self.MORE_PATTERN], deadline)
+            received += len(text)
+            if index == -1:
+                COMMAND_COUNTERS.add(received, 0, time.monotonic() - start, timed_out=True)
+                raise CommandTimeoutError(f"No prompt after {timeout}s, got {received} bytes.")
+            if index == 1:
+                chunks.append(self.MORE_PATTERN.sub(b'', text))
+                self.client.write(b' ')
+                continue
+            chunks.append(self.prompt.sub(b'', text))
+            break
+
+        COMMAND_COUNTERS.add(received, 0, time.monotonic() - start)
+        lines = self.ERASE_PATTERN.sub(b'', b''.join(chunks)).decode('utf-8', errors='replace').replace('\r', '').split('\n')
+        if lines and lines[0].strip() == command.strip():
+            lines = lines[1:]
+        return '\n'.join(lines).rstrip('\n') + '\n', received
+
+    def is_active(self):
+        return self.client.get_socket() is not None and not self.client.eof
+
+    def set_keepalive(self, interval):
+        sock = self.client.get_socket()
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def close(self):
+        self.client.close()
+
+
+class TelnetSessionPool(SSHTransportPool):
+    """
+    Pool of logged in telnet sessions, keyed like SSHTransportPool on the telnet port.
+    """
+
+    def __repr__(self):
+        return f"TelnetSessionPool object with {sum(self._open.values())} open sessions"
+
+    @staticmethod
+    def _is_alive(transport):
+        return transport.is_active()
+
+    def _keep_alive(self, transport):
+        transport.set_keepalive(self.keepalive_interval)
+
+    def _close(self, transport):
+        try:
+            transport.close()
+        except Exception as e:
+            print(f"Error closing telnet session: {e}")
+
+
+TELNET_POOL = TelnetSessionPool()
+DEVICE_SCHEDULER.register_pool(SSH_POOL)
+DEVICE_SCHEDULER.register_pool(TELNET_POOL)
+
+
 class Session:
-    def __init__(self, hostname, username, password, fallback_username='{login-sensitive}', fallback_password='{password-sensitive}', port=22, telnet_port=23, immediately_connect=True):
+    def __init__(self, hostname, username, password, fallback_username='{login-sensitive}', fallback_password='{password-sensitive}', port=22, telnet_port=23, immediately_connect=True, pool=SSH_POOL, command_timeout=COMMAND_TIMEOUT, command_cache=COMMAND_CACHE, fingerprints=FINGERPRINTS, scheduler=DEVICE_SCHEDULER, telnet_pool=TELNET_POOL, telnet=TELNET_FALLBACK):
         self.hostname = hostname
         self.username = username
         self.password = password
@@ -16,8 +165,18 @@ class Session:
         self.fallback_password = fallback_password
         self.port = port
         self.telnet_port = telnet_port
+        self.pool = pool
+        self.telnet_pool = telnet_pool
+        self.telnet = telnet
+        self.command_timeout = command_timeout
+        self.command_cache = command_cache
+        self.fingerprints = fingerprints
+        self.scheduler = scheduler
+        self.holds_slot = False
+        self.bytes_received = 0
 
         self.ssh_client = None
+        self.broken = False
         self.telnet_client = None
         if immediately_connect:
             self.connect()
@@ -25,57 +184,259 @@ class Session:
     def __repr__(self):
         return f"Session object for: {self.hostname}"
 
-    def connect(self):
-        # Attempt to connect using SSH
-        try:
-            self.ssh_client = paramiko.SSHClient()
-            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.ssh_client.connect(self.hostname, self.port, self.username, self.password)
-            return True
-        except (TimeoutError, paramiko.AuthenticationException, paramiko.SSHException):
-            # Attempt to connect with fallback credentials if primary credentials fail
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.ssh_client or self.telnet_client:
+            self.close_connection()
+
+    def _credential_sets(self):
+        """
+        :return [(name, username, password)], the credential set that logged this user in to the device last
+        time first. Keyed by the session's own username, a pooled transport is only ever logged in as the user
+        of its pool key or as the fallback account that user's login needed.
+        """
+        credential_sets = [('primary', self.username, self.password),
+                           ('fallback', self.fallback_username, self.fallback_password)]
+        known = self.fingerprints.credentials(self.hostname, self.username) if self.fingerprints else None
+        if known == 'fallback':
+            credential_sets.reverse()
+        return credential_sets
+
+    def _learn_login(self, credentials, transport, attempt):
+        if attempt and credentials == 'fallback':
+            print(f"Primary credentials failed. Connected using fallback credentials for {self.hostname}.")
+        elif attempt:
+            print(f"Fallback credentials failed. Connected using primary credentials for {self.hostname}.")
+        if self.fingerprints:
+            self.fingerprints.record_credentials(self.hostname, self.username, credentials)
+            self.fingerprints.record_dialect(self.hostname, 'transport', transport)
+
+    def open_ssh_client(self):
+        """
+        Logs in with the credential set that worked last time for the user on the device first, then the other one.
+        """
+        for attempt, (credentials, username, password) in enumerate(self._credential_sets()):
             try:
-                self.ssh_client = paramiko.SSHClient()
-                self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                self.ssh_client.connect(self.hostname, self.port, self.fallback_username, self.fallback_password)
-                print(f"Primary credentials failed. Connected using fallback credentials for {self.hostname}.")
-                return True
+                ssh_client = paramiko.SSHClient()
+                ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh_client.connect(self.hostname, self.port, username, password)
             except (TimeoutError, paramiko.AuthenticationException, paramiko.SSHException):
+                continue
+            self._learn_login(credentials, 'ssh', attempt)
+            return ssh_client
+        raise DeviceConnectionError
+
+    def open_telnet_client(self):
+        for attempt, (credentials, username, password) in enumerate(self._credential_sets()):
+            try:
+                telnet_client = TelnetTransport(self.hostname, self.telnet_port)
+            except OSError:
                 raise DeviceConnectionError
+            try:
+                telnet_client.login(username, password)
+            except (TelnetTransport.LoginError, CommandTimeoutError, EOFError, OSError):
+                telnet_client.close()
+                continue
+            self._learn_login(credentials, 'telnet', attempt)
+            return telnet_client
+        raise DeviceConnectionError
+
+    def connect(self):
+        """
+        Takes an authenticated transport to the device out of the pool, handshaking only when none is idle.
+        A session already holding a transport gives it back first. The session waits for a slot of the
+        device in the scheduler, and keeps it until close_connection. Only when telnet is allowed, devices
+        refusing SSH, or known to only speak telnet, get a telnet session.
+        """
+        if self.ssh_client or self.telnet_client:
+            self._return_transport()
+
+        if self.scheduler is not None and not self.holds_slot:
+            self.scheduler.acquire(self.hostname)
+            self.holds_slot = True
+        try:
+            known = self.fingerprints.dialect(self.hostname, 'transport') if self.fingerprints else None
+            if self.telnet and known == 'telnet':
+                self.telnet_client = self._checkout(self.telnet_pool, self.telnet_port, self.open_telnet_client)
+            else:
+                try:
+                    self.ssh_client = self._checkout(self.pool, self.port, self.open_ssh_client)
+                except (ConnectionRefusedError, paramiko.ssh_exception.NoValidConnectionsError):
+                    if not self.telnet:
+                        raise
+                    self.telnet_client = self._checkout(self.telnet_pool, self.telnet_port, self.open_telnet_client)
+        except Exception:
+            self._release_slot()
+            raise
+        if self.scheduler is not None:
+            self.scheduler.trim(self.hostname)
+        self.broken = False
+        return True
+
+    def _checkout(self, pool, port, open_client):
+        if pool is None:
+            return open_client()
+        return pool.checkout(SSHTransportPool.key(self.hostname, port, self.username, self.password), open_client)
 
-    def execute_command(self, command):
+    def _release_slot(self):
+        if self.holds_slot:
+            self.holds_slot = False
+            self.scheduler.release(self.hostname)
+
+    def _cache_key(self, command):
+        if self.command_cache is None or not is_cacheable(command):
+            return None
+        return CommandCache.key(self.hostname, self.username, command)
+
+    def execute_command(self, command, timeout=None):
+        """
+        Show commands are answered from the command cache when another trace ran them recently.
+        :param timeout: seconds the device gets to send the whole output, command_timeout by default
+        """
+        key = self._cache_key(command)
+        if key is None:
+            return self._execute_command(command, timeout)
+        return self.command_cache.get_or_execute(key, lambda: self._execute_command(command, timeout))
+
+    def _execute_command(self, command, timeout=None):
         if self.ssh_client:
             if not self.ssh_client.get_transport():
                 self.connect()
             if not self.ssh_client.get_transport().is_active():
                 self.connect()
 
+            channel = None
             try:
                 channel = self.ssh_client.get_transport().open_session()
                 channel.exec_command(command)
 
-                while not channel.exit_status_ready():
-                    time.sleep(0.2)
-
-                return channel.recv(64500).decode('utf-8')
+                output, received = read_channel(channel, timeout or self.command_timeout)
+                self.bytes_received += received
+                return output
 
+            except CommandTimeoutError as e:
+                print(f"Error executing command: {command}, {str(e)}")
             except Exception as e:
+                self.broken = True
                 print(f"Error executing command: {str(e)}")
+            finally:
+                # The transport outlives the session in the pool, its channels must not pile up.
+                if channel is not None:
+                    channel.close()
 
         elif self.telnet_client:
+            if not self.telnet_client.is_active():
+                self.connect()
             try:
-                self.telnet_client.write(command.encode('ascii') + b"\n")
-                time.sleep(0.5)  # Wait for the command to complete
-                return self.telnet_client.read_eager().decode('utf-8')
+                output, received = self.telnet_client.execute_command(command, timeout or self.command_timeout)
+                self.bytes_received += received
+                return output
+            except CommandTimeoutError as e:
+                # The CLI is still busy with the command, the session can't go back to the pool as is.
+                self.broken = True
+                print(f"Error executing command: {command}, {str(e)}")
             except Exception as e:
+                self.broken = True
                 print(f"Error executing command: {str(e)}")
 
         return None
 
+    def execute_many(self, commands, timeout=None, max_channels=MAX_CHANNELS):
+        """
+        Runs independent commands on concurrent exec channels of the one transport, so they cost one
+        round trip instead of one each. Generator of (command, output) in the order the commands finish,
+        output is None for commands that failed or timed out. Closing the generator early abandons the
+        commands still running. Without SSH, or when the device refuses a second channel, the remaining
+        commands run one after the other. Cached outputs are yielded first, without opening a channel.
+        :param max_channels: channels open at the same time
+        """
+        if not self.ssh_client:
+            for command in commands:
+                yield command, self.execute_command(command, timeout)
+            return
+
+        pending = []
+        for command in commands:
+            key = self._cache_key(command)
+            hit, output = self.command_cache.cached(key) if key else (False, None)
+            if hit:
+                yield command, output
+            else:
+                pending.append(command)
+        if not pending:
+            return
+
+        if not self.ssh_client.get_transport() or not self.ssh_client.get_transport().is_active():
+            self.connect()
+        transport = self.ssh_client.get_transport()
+
+        running = {}  # channel -> command
+        reader = ChannelReader()
+        try:
+            while pending or running:
+                while pending and len(running) < max_channels:
+                    try:
+                        channel = transport.open_session()
+                    except Exception as e:
+                        if running:
+                            break
+                        print(f"Can't open a concurrent channel to {self.hostname}: {e}")
+                        for command in pending:
+                            yield command, self.execute_command(command, timeout)
+                        return
+                    command = pending.pop(0)
+                    try:
+                        channel.exec_command(command)
+                    except Exception as e:
+                        channel.close()
+                        self.broken = True
+                        print(f"Error executing command: {str(e)}")
+                        yield command, None
+                        continue
+                    running[channel] = command
+                    reader.add(channel, timeout or self.command_timeout)
+
+                if not running:
+                    continue
+
+                for channel, output, received in reader.read():
+                    command = running.pop(channel)
+                    channel.close()
+                    self.bytes_received += received
+                    if output is None:
+                        print(f"Error executing command: {command}, no end of output in time.")
+                    elif self._cache_key(command):
+                        self.command_cache.put(self._cache_key(command), output)
+                    yield command, output
+        finally:
+            reader.close()
+            for channel in running:
+                channel.close()
+
     def close_connection(self):
+        """
+        Returns the transport to the pool, or closes it when the session isn't pooled or broke, and frees
+        the scheduler slot of the session.
+        """
+        try:
+            self._return_transport()
+        finally:
+            self._release_slot()
+
+    def _return_transport(self):
         if self.ssh_client:
-            self.ssh_client.close()
+            if self.pool is None:
+                self.ssh_client.close()
+            else:
+                self.pool.checkin(self.ssh_client, broken=self.broken)
+            self.ssh_client = None
         elif self.telnet_client:
-            self.telnet_client.close()
+            if self.telnet_pool is None:
+                self.telnet_client.close()
+            else:
+                self.telnet_pool.checkin(self.telnet_client, broken=self.broken)
+            self.telnet_client = None
         else:
             print('Neither SSH nor Telnet connection is active.')
\ No newline at end of file
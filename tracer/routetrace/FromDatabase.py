@@ -1,8 +1,10 @@
 from pprint import pprint
 
 from tracer.routetrace import command_result_parser
-from tracer.routetrace.trino_connect import TrinoDatalake, HttpError
-from time import sleep
+from tracer.routetrace import queries
+from tracer.routetrace.trino_connect import TrinoDatalake
+from tracer.routetrace.trino_pool import TrinoConnectionPool
+from tracer.routetrace.query_cache import QueryCache
 
 
 class DataBaseError(Exception):
@@ -12,18 +14,12 @@ class DataBaseError(Exception):
 
 
 def error_handler(func):
+    # Transient trino errors are retried inside TrinoDatalake.execute_query, by its retry policy.
     def wrapper(*args, **kwargs):
         try:
             result = func(*args, **kwargs)
         except IndexError:
             raise DataBaseError
-        except HttpError:
-            try:
-                sleep(8)
-                result = func(*args, **kwargs)
-            except HttpError or IndexError:
-                sleep(12)
-                result = func(*args, **kwargs)
         return result
 
     return wrapper
@@ -33,27 +29,56 @@ def create_connection_instance():
     return TrinoDatalake()
 
 
+def create_connection_pool(min_size=1, max_size=8, cache=True):
+    return TrinoConnectionPool(min_size=min_size, max_size=max_size, cache=QueryCache() if cache else None)
+
+
 def get_default_gateway(datalake, endpoint_ip):
     try:
-        return get_default_gateway_regular(datalake, endpoint_ip)
+        return get_default_gateway_ranked(datalake, endpoint_ip)
     except DataBaseError:
-        try:
-            return get_default_gateway_extended(datalake, endpoint_ip)
-        except DataBaseError:
-            try:
-                return get_default_gateway_by_segment(datalake, endpoint_ip)
-            except DataBaseError:
-                return None
+        return None
+
+
+def change_last_ip_part(ip, last_part):
+    return '.'.join(ip.split(".")[:3]) + f'.{last_part}'
+
+
+def default_gateway_ranked_query(endpoint_ip):
+    """
+    Ranks the same sources the fallback chain
+    get_default_gateway_regular -> get_default_gateway_extended -> get_default_gateway_by_segment uses.
+    """
+    return queries.first_ranked_row([
+        ('crawler-arp-table', ['device_ip', 'device_id'],
+         [('ip', '=', endpoint_ip), ('vrf', '!=', 'default')]),
+        ('crawler-arp-table', ['device_ip', 'device_id'],
+         [('ip', '=', endpoint_ip)]),
+        ('crawler-device-interface-inventory', ['ipv4', 'device_id'],
+         [('int_ip', '=', change_last_ip_part(endpoint_ip, '254'))]),
+        ('crawler-device-interface-inventory', ['ipv4', 'device_id'],
+         [('int_ip', '=', change_last_ip_part(endpoint_ip, '1'))]),
+    ])
+
+
+@error_handler
+def get_default_gateway_ranked(datalake, endpoint_ip):
+    """
+    Resolves the default gateway with a single query, see default_gateway_ranked_query.
+    """
+    default_gateway = datalake.exec_query(*default_gateway_ranked_query(endpoint_ip))
+
+    default_gateway_ip = default_gateway[0][0][0]
+    hostname = default_gateway[0][0][1]
+
+    return default_gateway_ip, hostname
 
 
 @error_handler
 def get_default_gateway_regular(datalake, endpoint_ip):
-    default_gateway = datalake.exec_query(f"""
-                                select device_ip, device_id
-                                from network."crawler-arp-table"
-                                where ip='{endpoint_ip}' and vrf != 'default'
-                                order by timestamp desc
-                                    """)
+    default_gateway = datalake.exec_query(*queries.latest_row(
+        'crawler-arp-table', ['device_ip', 'device_id'],
+        [('ip', '=', endpoint_ip), ('vrf', '!=', 'default')]))
 
     default_gateway_ip = default_gateway[0][0][0]
     hostname = default_gateway[0][0][1]
@@ -63,12 +88,9 @@ def get_default_gateway_regular(datalake, endpoint_ip):
 
 @error_handler
 def get_default_gateway_extended(datalake, endpoint_ip):
-    default_gateway = datalake.exec_query(f"""
-                                select device_ip, device_id
-                                from network."crawler-arp-table"
-                                where ip='{endpoint_ip}'
-                                order by timestamp desc
-                                    """)
+    default_gateway = datalake.exec_query(*queries.latest_row(
+        'crawler-arp-table', ['device_ip', 'device_id'],
+        [('ip', '=', endpoint_ip)]))
 
     default_gateway_ip = default_gateway[0][0][0]
     hostname = default_gateway[0][0][1]
@@ -78,12 +100,10 @@ def get_default_gateway_extended(datalake, endpoint_ip):
 
 @error_handler
 def get_default_gateway_access_only(datalake, endpoint_ip):
-    default_gateway_ip = datalake.exec_query(f"""
-                                select gateway_device_ip
-                                from network."v_site_arps_from_up_access_interfaces"
-                                where endpoint_ip='{endpoint_ip}'
-                                order by arp_timestamp
-                                    """)
+    default_gateway_ip = datalake.exec_query(*queries.latest_row(
+        'v_site_arps_from_up_access_interfaces', ['gateway_device_ip'],
+        [('endpoint_ip', '=', endpoint_ip)],
+        order_column='arp_timestamp'))
 
     default_gateway_ip = default_gateway_ip[0][0][0]
 
@@ -92,26 +112,24 @@ def get_default_gateway_access_only(datalake, endpoint_ip):
 
 @error_handler
 def get_next_hop_int_by_mac_table(datalake, from_ip, mac):
-    next_hop_interface = datalake.exec_query(f"""
-                                select interface
-                                from network."crawler-mac-table"
-                                where device_ip='{from_ip}' and mac='{mac}'
-                                order by timestamp desc
-                                    """)
+    next_hop_interface = datalake.exec_query(*queries.latest_row(
+        'crawler-mac-table', ['interface'],
+        [('device_ip', '=', from_ip), ('mac', '=', mac)]))
 
     next_hop_interface = next_hop_interface[0][0][0]
 
     return next_hop_interface
 
 
+def default_gateway_step_query(dg_ip, endpoint_ip):
+    return queries.latest_row(
+        'crawler-arp-table', ['device_id', 'vrf', 'mac', 'interface'],
+        [('device_ip', '=', dg_ip), ('ip', '=', endpoint_ip)])
+
+
 @error_handler
 def default_gateway_step(datalake, dg_ip, endpoint_ip):
-    result = datalake.exec_query(f"""
-                                    select device_id, vrf, mac, interface
-                                    from network."crawler-arp-table"
-                                    where device_ip='{dg_ip}' and ip='{endpoint_ip}'
-                                    order by timestamp
-                                        """)[0][0]
+    result = datalake.exec_query(*default_gateway_step_query(dg_ip, endpoint_ip))[0][0]
 
     device_id = result[0]
     vrf = result[1]
@@ -121,16 +139,38 @@ def default_gateway_step(datalake, dg_ip, endpoint_ip):
     return device_id, vrf, mac, interface_or_vlan
 
 
+def device_id_condition(resolver, table_name, column, id_):
+    """
+    Exact match on the raw ids the resolver knows for id_, or the like scan when it doesn't know it.
+    """
+    device_ids = resolver.device_ids(table_name, id_) if resolver else None
+    if device_ids:
+        return column, 'in', device_ids
+    return column, 'like', f'%{remove_services(id_)}%'
+
+
+def interface_condition(resolver, table_name, column, id_, interface, like_pattern=None):
+    """
+    Exact match on every spelling of the interface the resolver knows, else like_pattern, or the
+    interface as given when there is no pattern.
+    """
+    interfaces = resolver.interfaces(table_name, id_, interface) if resolver else None
+    if interfaces:
+        return column, 'in', interfaces
+    if like_pattern is None:
+        return column, '=', interface
+    return column, 'like', like_pattern
+
+
 @error_handler
-def get_next_hop_ip_cdp(datalake, id_, next_hop_interface):
+def get_next_hop_ip_cdp(datalake, id_, next_hop_interface, resolver=None):
     id_ = remove_services(id_)
 
-    result = datalake.exec_query(f"""
-                                        select remote_ipv4, remote_device_id
-                                        from network."crawler-cdp-lldp"
-                                        where local_device_id='{id_}' and local_int like '%{next_hop_interface}%'
-                                        order by timestamp
-                                            """)
+    result = datalake.exec_query(*queries.latest_row(
+        'crawler-cdp-lldp', ['remote_ipv4', 'remote_device_id'],
+        [('local_device_id', '=', id_),
+         interface_condition(resolver, 'crawler-cdp-lldp', 'local_int', id_, next_hop_interface,
+                             f'%{next_hop_interface}%')]))
 
     result = result[0][0]
 
@@ -156,27 +196,19 @@ def remove_services(next_hop_id):
 
 
 @error_handler
-def get_nihul_ip(datalake, next_hop_id):
-    next_hop_id = remove_services(next_hop_id)
-
-    ip = datalake.exec_query(f"""
-                                select ipv4
-                                from network."v_spectrum_network_devices"
-                                where device_id like '%{next_hop_id}%'
-                                order by timestamp
-                                    """)[0][0][0]
+def get_nihul_ip(datalake, next_hop_id, resolver=None):
+    ip = datalake.exec_query(*queries.latest_row(
+        'v_spectrum_network_devices', ['ipv4'],
+        [device_id_condition(resolver, 'v_spectrum_network_devices', 'device_id', next_hop_id)]))[0][0][0]
 
     return ip
 
 
 @error_handler
 def get_device_id_by_nihul_ip(datalake, ip):
-    id_ = datalake.exec_query(f"""
-                                select device_id
-                                from network."spectrum-devices"
-                                where ipv4='{ip}'
-                                order by timestamp
-                                    """)
+    id_ = datalake.exec_query(*queries.latest_row(
+        'spectrum-devices', ['device_id'],
+        [('ipv4', '=', ip)]))
 
     id_ = id_[0][0][0]
 
@@ -185,12 +217,9 @@ def get_device_id_by_nihul_ip(datalake, ip):
 
 @error_handler
 def get_device_id(datalake, ip):
-    id_ = datalake.exec_query(f"""
-                                select device_id
-                                from network."static-device-tags"
-                                where ipv4='{ip}'
-                                order by timestamp
-                                    """)
+    id_ = datalake.exec_query(*queries.latest_row(
+        'static-device-tags', ['device_id'],
+        [('ipv4', '=', ip)]))
 
     id_ = id_[0][0][0]
 
@@ -198,17 +227,14 @@ def get_device_id(datalake, ip):
 
 
 @error_handler
-def is_destination(datalake, id_, next_hop_interface):
-    id_ = remove_services(id_)
+def is_destination(datalake, id_, next_hop_interface, resolver=None):
+    interface_number = ''.join(ch for ch in next_hop_interface if ch.isdigit() or ch == '/' or ch == '.')
 
-    next_hop_interface = ''.join(ch for ch in next_hop_interface if ch.isdigit() or ch == '/' or ch == '.')
-
-    conf = datalake.exec_query(f"""
-                                select config_running
-                                from network."crawler-interface-config"
-                                where interface like '%{next_hop_interface}%' and device_id like '%{id_}%'
-                                order by timestamp
-                                    """)
+    conf = datalake.exec_query(*queries.latest_row(
+        'crawler-interface-config', ['config_running'],
+        [interface_condition(resolver, 'crawler-interface-config', 'interface', id_, next_hop_interface,
+                             f'%{interface_number}%'),
+         device_id_condition(resolver, 'crawler-interface-config', 'device_id', id_)]))
 
     conf = conf[0][0][0]
 
@@ -218,18 +244,14 @@ def is_destination(datalake, id_, next_hop_interface):
 
 
 @error_handler
-def first_int_in_port_channel(datalake, id_, interface):
+def first_int_in_port_channel(datalake, id_, interface, resolver=None):
     if not interface.lower().startswith('po'):
         return interface
 
-    id_ = remove_services(id_)
-
-    physical_interface = datalake.exec_query(f"""
-                                select phyinterface
-                                from network."crawler-device-portchannels"
-                                where pointerface='{interface}' and device_id like '%{id_}%'
-                                order by timestamp
-                                    """)
+    physical_interface = datalake.exec_query(*queries.latest_row(
+        'crawler-device-portchannels', ['phyinterface'],
+        [interface_condition(resolver, 'crawler-device-portchannels', 'pointerface', id_, interface),
+         device_id_condition(resolver, 'crawler-device-portchannels', 'device_id', id_)]))
 
     physical_interface = physical_interface[0][0][0]
 
@@ -238,12 +260,10 @@ def first_int_in_port_channel(datalake, id_, interface):
 
 @error_handler
 def get_next_hop_int_by_arp_access_mac(datalake, from_ip, mac):
-    next_hop_device_id = datalake.exec_query(f"""
-                                    select connected_device_id
-                                    from network."v_site_arps_from_up_access_interfaces"
-                                    where gateway_device_ip='{from_ip}' and endpoint_mac='{mac}'
-                                    order by arp_timestamp
-                                        """)
+    next_hop_device_id = datalake.exec_query(*queries.latest_row(
+        'v_site_arps_from_up_access_interfaces', ['connected_device_id'],
+        [('gateway_device_ip', '=', from_ip), ('endpoint_mac', '=', mac)],
+        order_column='arp_timestamp'))
 
     next_hop_device_id = next_hop_device_id[0][0][0]
 
@@ -252,12 +272,10 @@ def get_next_hop_int_by_arp_access_mac(datalake, from_ip, mac):
 
 @error_handler
 def get_next_hop_int_by_arp_access_ip(datalake, from_ip, endpoint_ip):
-    res = datalake.exec_query(f"""
-                                select gateway_device_id, endpoint_mac
-                                from network."v_site_arps_from_up_access_interfaces"
-                                where gateway_device_ip='{from_ip}' and endpoint_ip='{endpoint_ip}'
-                                order by arp_timestamp
-                                    """)
+    res = datalake.exec_query(*queries.latest_row(
+        'v_site_arps_from_up_access_interfaces', ['gateway_device_id', 'endpoint_mac'],
+        [('gateway_device_ip', '=', from_ip), ('endpoint_ip', '=', endpoint_ip)],
+        order_column='arp_timestamp'))
 
     res = res[0][0]
     gateway_device_id = res[0]
@@ -266,14 +284,15 @@ def get_next_hop_int_by_arp_access_ip(datalake, from_ip, endpoint_ip):
     return gateway_device_id, endpoint_mac
 
 
+def next_hop_id_mac_by_arp_ip_query(from_ip, endpoint_ip):
+    return queries.latest_row(
+        'crawler-arp-table', ['device_id', 'mac', 'interface', 'vrf'],
+        [('device_ip', '=', from_ip), ('ip', '=', endpoint_ip)])
+
+
 @error_handler
 def get_next_hop_id_mac_by_arp_ip(datalake, from_ip, endpoint_ip):
-    res = datalake.exec_query(f"""
-                                select device_id, mac, interface, vrf
-                                from network."crawler-arp-table"
-                                where device_ip='{from_ip}' and ip='{endpoint_ip}'
-                                order by timestamp desc
-                                    """)
+    res = datalake.exec_query(*next_hop_id_mac_by_arp_ip_query(from_ip, endpoint_ip))
 
     res = res[0][0]
     gateway_device_id = res[0]
@@ -286,12 +305,9 @@ def get_next_hop_id_mac_by_arp_ip(datalake, from_ip, endpoint_ip):
 
 @error_handler
 def get_route_information(datalake, ip, vrf, destination_network):
-    res = datalake.exec_query(f"""
-                                select nexthop, vrf, network
-                                from network."crawler-route-table"
-                                where device_ip='{ip}' and vrf='{vrf}'
-                                order by timestamp
-                                    """)
+    res = datalake.exec_query(*queries.latest_row(
+        'crawler-route-table', ['nexthop', 'vrf', 'network'],
+        [('device_ip', '=', ip), ('vrf', '=', vrf)]))
 
     res = res[0][0]
     nexthop_ip = res[0]
@@ -301,26 +317,24 @@ def get_route_information(datalake, ip, vrf, destination_network):
 
 @error_handler
 def get_neighbor_ip_by_id(datalake, ip, interface):
-    remote_device_ip = datalake.exec_query(f"""
-                                select remote_device_ip, local_device_int
-                                from network."v_network_device_interfaces_neighbors"
-                                where local_device_ip='{ip}'
-                                order by timestamp
-                                    """)
+    remote_device_ip = datalake.exec_query(*queries.latest_row(
+        'v_network_device_interfaces_neighbors', ['remote_device_ip', 'local_device_int'],
+        [('local_device_ip', '=', ip)]))
 
     remote_device_ip = remote_device_ip[0][0]
 
     return remote_device_ip
 
 
+def nihul_ip_by_int_ip_query(nexthop_int_ip):
+    return queries.latest_row(
+        'crawler-device-interface-inventory', ['ipv4', 'device_id'],
+        [('int_ip', '=', nexthop_int_ip)])
+
+
 @error_handler
 def get_nihul_ip_by_int_ip(datalake, nexthop_int_ip):
-    nexthop = datalake.exec_query(f"""
-                                    select ipv4, device_id
-                                    from network."crawler-device-interface-inventory"
-                                    where int_ip='{nexthop_int_ip}'
-                                    order by timestamp DESC
-                                        """)
+    nexthop = datalake.exec_query(*nihul_ip_by_int_ip_query(nexthop_int_ip))
 
     nexthop = nexthop[0][0]
     nexthop_ip = nexthop[0]
@@ -330,9 +344,6 @@ def get_nihul_ip_by_int_ip(datalake, nexthop_int_ip):
 
 
 def get_default_gateway_by_segment(datalake, segment: str):
-    def change_last_ip_part(seg, last_part):
-        return '.'.join(seg.split(".")[:3]) + f'.{last_part}'
-
     try:
         ip, hostname = get_nihul_ip_by_int_ip(datalake, change_last_ip_part(segment, '254'))
     except DataBaseError:
@@ -346,12 +357,9 @@ def get_first_int_if_portchannel(datalake, id_, interface):
     if not interface.lower().startswith('po'):
         return interface
 
-    phyinterface = datalake.exec_query(f"""
-                                    select phyinterface
-                                    from network."crawler-device-portchannels"
-                                    where device_id='{id_}' and pointerface='{interface}'
-                                    order by timestamp
-                                        """)[0]
+    phyinterface = datalake.exec_query(*queries.latest_row(
+        'crawler-device-portchannels', ['phyinterface'],
+        [('device_id', '=', id_), ('pointerface', '=', interface)]))[0]
 
     if not phyinterface:
         return None
@@ -363,15 +371,18 @@ def get_first_int_if_portchannel(datalake, id_, interface):
 
 @error_handler
 def get_ip_by_device_name(datalake, name):
-    ip = datalake.exec_query(f"""
-                                    select ipv4
-                                    from network."crawler-devices"
-                                    where device_id='{name}'
-                                    order by timestamp
-                                        """)[0][0][0]
+    ip = datalake.exec_query(*queries.latest_row(
+        'crawler-devices', ['ipv4'],
+        [('device_id', '=', name)]))[0][0][0]
 
     return ip
 
+def device_name_by_ip_query(ip):
+    return queries.latest_row(
+        'crawler-devices', ['device_id'],
+        [('ipv4', '=', ip)])
+
+
 @error_handler
 def get_device_name_by_ip(datalake, ip):
     """
@@ -385,12 +396,85 @@ def get_device_name_by_ip(datalake, ip):
         str: The device name associated with the given IP address.
     """
 
-    device_name = datalake.exec_query(f"""
-                                    select device_id
-                                    from network."crawler-devices"
-                                    where ipv4='{ip}'
-                                    order by timestamp desc
-                                    limit 1
-                                """)[0][0][0]
+    device_name = datalake.exec_query(*device_name_by_ip_query(ip))[0][0][0]
 
     return device_name
+
+
+BATCH_SIZE = 500
+
+
+def _chunks(keys, size=BATCH_SIZE):
+    keys = list(dict.fromkeys(keys))
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
+
+
+@error_handler
+def get_nihul_ips_by_int_ips(datalake, nexthop_int_ips):
+    """
+    Batch variant of get_nihul_ip_by_int_ip, one query per BATCH_SIZE interface IPs.
+
+    Returns:
+        dict: int_ip -> (ipv4, device_id) of the newest inventory row. Unknown IPs are left out.
+    """
+    result = {}
+    for chunk in _chunks(nexthop_int_ips):
+        rows = datalake.exec_query(*queries.latest_rows_per_key(
+            'crawler-device-interface-inventory', ['int_ip', 'ipv4', 'device_id'], ['int_ip'],
+            [('int_ip', 'in', chunk)]))[0]
+
+        for int_ip, ipv4, device_id in rows:
+            result[int_ip] = (ipv4, device_id)
+
+    return result
+
+
+@error_handler
+def get_next_hops_id_mac_by_arp_ips(datalake, device_endpoint_ips):
+    """
+    Batch variant of get_next_hop_id_mac_by_arp_ip.
+
+    Args:
+        device_endpoint_ips (list): (device_ip, endpoint_ip) pairs.
+
+    Returns:
+        dict: (device_ip, endpoint_ip) -> (device_id, mac, interface, vrf) of the newest ARP row.
+    """
+    result = {}
+    for chunk in _chunks(device_endpoint_ips):
+        wanted = set(chunk)
+        rows = datalake.exec_query(*queries.latest_rows_per_key(
+            'crawler-arp-table', ['device_ip', 'ip', 'device_id', 'mac', 'interface', 'vrf'], ['device_ip', 'ip'],
+            [('device_ip', 'in', sorted({pair[0] for pair in chunk})), ('ip', 'in', sorted({pair[1] for pair in chunk}))]))[0]
+
+        for device_ip, ip, device_id, mac, interface, vrf in rows:
+            if (device_ip, ip) in wanted:
+                result[(device_ip, ip)] = (device_id, mac, interface, vrf)
+
+    return result
+
+
+@error_handler
+def get_interface_configs(datalake, device_interfaces):
+    """
+    Fetches the running config of many interfaces at once, matching device_id and interface exactly.
+
+    Args:
+        device_interfaces (list): (device_id, interface) pairs.
+
+    Returns:
+        dict: (device_id, interface) -> config_running of the newest row.
+    """
+    result = {}
+    for chunk in _chunks(device_interfaces):
+        wanted = set(chunk)
+        rows = datalake.exec_query(*queries.latest_rows_per_key(
+            'crawler-interface-config', ['device_id', 'interface', 'config_running'], ['device_id', 'interface'],
+            [('device_id', 'in', sorted({pair[0] for pair in chunk})), ('interface', 'in', sorted({pair[1] for pair in chunk}))]))[0]
+
+        for device_id, interface, config_running in rows:
+            if (device_id, interface) in wanted:
+                result[(device_id, interface)] = config_running
+
+    return result
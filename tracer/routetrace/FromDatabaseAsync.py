@@ -0,0 +1,85 @@
+"""
+Awaitable counterparts of the FromDatabase lookups the API endpoints call directly, for use with
+AsyncTrinoDatalake. They run the same queries and return the same values as their FromDatabase twins.
+"""
+from functools import wraps
+
+from tracer.routetrace import FromDatabase
+from tracer.routetrace.FromDatabase import DataBaseError
+from tracer.routetrace.async_trino import AsyncTrinoDatalake
+
+
+def error_handler(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            result = await func(*args, **kwargs)
+        except IndexError:
+            raise DataBaseError
+        return result
+
+    return wrapper
+
+
+def create_connection_instance(cache=None):
+    return AsyncTrinoDatalake(cache=cache)
+
+
+async def get_default_gateway(datalake, endpoint_ip):
+    try:
+        return await get_default_gateway_ranked(datalake, endpoint_ip)
+    except DataBaseError:
+        return None
+
+
+@error_handler
+async def get_default_gateway_ranked(datalake, endpoint_ip):
+    default_gateway = await datalake.exec_query(*FromDatabase.default_gateway_ranked_query(endpoint_ip))
+
+    default_gateway_ip = default_gateway[0][0][0]
+    hostname = default_gateway[0][0][1]
+
+    return default_gateway_ip, hostname
+
+
+@error_handler
+async def default_gateway_step(datalake, dg_ip, endpoint_ip):
+    result = (await datalake.exec_query(*FromDatabase.default_gateway_step_query(dg_ip, endpoint_ip)))[0][0]
+
+    device_id = result[0]
+    vrf = result[1]
+    mac = result[2]
+    interface_or_vlan = result[3]
+
+    return device_id, vrf, mac, interface_or_vlan
+
+
+@error_handler
+async def get_next_hop_id_mac_by_arp_ip(datalake, from_ip, endpoint_ip):
+    res = await datalake.exec_query(*FromDatabase.next_hop_id_mac_by_arp_ip_query(from_ip, endpoint_ip))
+
+    res = res[0][0]
+    gateway_device_id = res[0]
+    endpoint_mac = res[1]
+    interface = res[2]
+    vrf = res[3]
+
+    return gateway_device_id, endpoint_mac, interface, vrf
+
+
+@error_handler
+async def get_nihul_ip_by_int_ip(datalake, nexthop_int_ip):
+    nexthop = await datalake.exec_query(*FromDatabase.nihul_ip_by_int_ip_query(nexthop_int_ip))
+
+    nexthop = nexthop[0][0]
+    nexthop_ip = nexthop[0]
+    hostname = nexthop[1]
+
+    return nexthop_ip, hostname
+
+
+@error_handler
+async def get_device_name_by_ip(datalake, ip):
+    device_name = (await datalake.exec_query(*FromDatabase.device_name_by_ip_query(ip)))[0][0][0]
+
+    return device_name
@@ -1,7 +1,9 @@
 from tracer.routetrace import command_result_parser
 from tracer.routetrace.CiscoDeviceConnection import Session as SessionSSH
-from tracer.routetrace.CheckPointFireWallConnection import CheckpointFirewall
-from tracer.routetrace.command_result_parser import Suspicion8200, SDABorderSuspicion
+from tracer.routetrace.CheckPointFireWallConnection import CheckpointFirewall, FirewallSessionPool, FIREWALL_POOL
+from tracer.routetrace.command_result_parser import Suspicion8200, SDABorderSuspicion, TrafficEngSuspicion
+from tracer.routetrace.device_fingerprints import FINGERPRINTS
+from tracer.routetrace.device_scheduler import DEVICE_SCHEDULER
 
 dev_user = '{sensitive}'
 dev_pass = '{sensitive}'
@@ -19,10 +21,61 @@ class WrongDeviceTypeSuspicion(Exception):
         super().__init__(self.message)
 
 
+# Variants of the MPLS next hop lookup, in the order they are tried on unknown devices:
+# (dialect name, platform it identifies, command)
+MPLS_VARIANTS = (
+    ('ldp_forwarding', 'xr', 'sh mpls ldp forwarding local-label {}'),
+    ('forwarding_labels', 'xr', 'sh mpls forwarding labels {}'),
+    ('ldp_bindings', 'xe', 'sh mpls ldp bindings local-label {}'),
+)
+
+
+def learn(device, family=None, variant=None, platform=None):
+    """
+    Records what a command told about the device in its fingerprint.
+    """
+    fingerprints = getattr(device, 'fingerprints', None)
+    if fingerprints is None:
+        return
+    if family:
+        fingerprints.record_dialect(device.hostname, family, variant)
+    if platform:
+        fingerprints.record_platform(device.hostname, platform)
+
+
+def planned(device, family):
+    """
+    :return the variant of family that answered last time on the device, or None
+    """
+    fingerprints = getattr(device, 'fingerprints', None)
+    return fingerprints.dialect(device.hostname, family) if fingerprints else None
+
+
+def plan_order(variants, known):
+    """
+    :return variants with the known one first
+    """
+    return sorted(variants, key=lambda variant: variant[0] != known)
+
+
 def create_device(ip, connect=True):
     return SessionSSH(hostname=ip, username=dev_user, password=dev_pass, immediately_connect=connect)
 
 
+def warm_up(ip, username, password):
+    """
+    Logs in to the device and gives the session back to its pool, so the next session to ip with the same
+    credentials finds it logged in. Known Checkpoint firewalls get a clish session instead.
+    """
+    if FINGERPRINTS.platform(ip) == 'checkpoint':
+        key = FirewallSessionPool.key(ip, 22, fw_username, fw_password)
+        with DEVICE_SCHEDULER.slot(ip):
+            FIREWALL_POOL.checkin(FIREWALL_POOL.checkout(key, lambda: create_firewall(ip)))
+    else:
+        with SessionSSH(hostname=ip, username=username, password=password):
+            pass
+
+
 def default_gateway_step(default_gateway, source_ip):
     vlan = command_result_parser.get_vlan_from_ip_int_brief(
         default_gateway.execute_command(f'sh ip int br | i {".".join(source_ip.split(".")[:3])}'))
@@ -108,32 +161,124 @@ def get_route_information_route(device, vrf, destination_network):
     return nexthop_ip
 
 
+def speculative_outputs(device, commands):
+    """
+    Runs all the commands at once and yields their outputs in the order of commands, as soon as each
+    one and the ones before it have finished. Closing the generator abandons the commands still running.
+    """
+    outputs = {}
+    results = device.execute_many(commands)
+    try:
+        for command in commands:
+            while command not in outputs:
+                finished, output = next(results, (command, None))
+                outputs[finished] = output
+            yield outputs[command]
+    finally:
+        results.close()
+
+
+def parse_mpls_variant(variant, output):
+    """
+    :return (nexthop_ip, next_label), for ldp_bindings (None, lib entry) to look up in CEF
+    """
+    if variant == 'ldp_forwarding':
+        return command_result_parser.get_next_hop_ip_from_mpls_ldp(output)
+    if variant == 'forwarding_labels':
+        return command_result_parser.get_next_hop_ip_from_mpls_forwarding(output)
+    return None, command_result_parser.get_lib_entry_from_mpls_ldp_bindings(output)
+
+
 def get_mpls_next_hop_ip(device, mpls_label):
-    nexthop_ip, next_label = command_result_parser.get_next_hop_ip_from_mpls_ldp(
-        device.execute_command(f'sh mpls ldp forwarding local-label {mpls_label}'))
+    """
+    The variant that answered last time on the device runs first and alone. The others run speculatively
+    alongside each other, they're only parsed when the ones before them come up empty.
+    """
+    known = planned(device, 'mpls_next_hop')
+    variants = plan_order(MPLS_VARIANTS, known)
+    if known:
+        nexthop_ip, next_label = _mpls_next_hop_by(
+            device, variants[0], device.execute_command(variants[0][2].format(mpls_label)))
+        if nexthop_ip:
+            return nexthop_ip, next_label
+        variants = variants[1:]
+
+    nexthop_ip, next_label = None, None
+    outputs = speculative_outputs(device, [command.format(mpls_label) for _, _, command in variants])
+    try:
+        for variant in variants:
+            nexthop_ip, next_label = _mpls_next_hop_by(device, variant, next(outputs))
+            if nexthop_ip:
+                break
+    finally:
+        outputs.close()
+
+    return nexthop_ip, next_label
 
-    if not nexthop_ip:
-        nexthop_ip, next_label = command_result_parser.get_next_hop_ip_from_mpls_forwarding(
-            device.execute_command(f'sh mpls forwarding labels {mpls_label}'))
 
-    if not nexthop_ip:  # If XE
-        lib_entry = command_result_parser.get_lib_entry_from_mpls_ldp_bindings(
-            device.execute_command(f'sh mpls ldp bindings local-label {mpls_label}'))
+def _mpls_next_hop_by(device, variant, output):
+    name, platform, _ = variant
+    if output is None:
+        return None, None
+
+    nexthop_ip, next_label = parse_mpls_variant(name, output)
+    if name == 'ldp_bindings':  # If XE
         nexthop_ip, next_label = command_result_parser.get_next_hop_ip_and_protocol_from_cef(
-            device.execute_command(f'sh ip cef {lib_entry}'))
+            device.execute_command(f'sh ip cef {next_label}'))
 
+    if nexthop_ip:
+        learn(device, 'mpls_next_hop', name, platform)
     return nexthop_ip, next_label
 
 
+def get_route_information(device, vrf, source_ip, destination_network):
+    """
+    Next hop of destination_network in vrf. CEF always answers first, it is what tells per destination
+    whether the route lives on an SDA border (LISP) or a traffic engineered tunnel, only then those
+    lookups run. Only the syntax variants of a command family (MPLS_VARIANTS) are planned per device.
+    :return (nexthop_ip, mpls_label)
+    """
+    try:
+        return get_route_information_cef(device, vrf, destination_network)
+    except SDABorderSuspicion:
+        device.connect()
+        return get_fe_ip_from_lisp_eid_table(device, destination_network), None
+    except TrafficEngSuspicion:
+        return get_route_information_traffic_eng(device, vrf, source_ip, destination_network)
+
+
+def create_firewall(ip):
+    firewall = CheckpointFirewall(ip, fw_username, fw_password, immediately_connect=False)
+    firewall.connect()
+    firewall.enter_clish()
+    return firewall
+
+
+def firewall_route(ip, destination_network):
+    """
+    :return output of show route destination, on a clish session borrowed from FIREWALL_POOL
+    within a scheduler slot of the firewall
+    """
+    key = FirewallSessionPool.key(ip, 22, fw_username, fw_password)
+    with DEVICE_SCHEDULER.slot(ip):
+        firewall = FIREWALL_POOL.checkout(key, lambda: create_firewall(ip))
+        DEVICE_SCHEDULER.trim(ip)
+        broken = True
+        try:
+            command_result = firewall.execute_command(f'show route destination {destination_network}')
+            broken = command_result is None
+            return command_result
+        finally:
+            FIREWALL_POOL.checkin(firewall, broken=broken)
+
+
 def get_route_and_new_vrf_from_firewall(device, destination_network):
-    device.close_connection()
-    device = CheckpointFirewall(device.hostname, fw_username, fw_password, immediately_connect=False)
-    device.connect()
-    device.execute_command('clish')
-    command_result = device.execute_command(f'show route destination {destination_network}')
-    device.disconnect()
+    if device.ssh_client or device.telnet_client:
+        device.close_connection()
+    command_result = firewall_route(device.hostname, destination_network)
 
     nexthop_ip = command_result_parser.get_next_hop_ip_from_firewall(command_result)
+    FINGERPRINTS.record_platform(device.hostname, 'checkpoint')
 
     return nexthop_ip
 
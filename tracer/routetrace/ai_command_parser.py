@@ -18,6 +18,9 @@ def get_next_hop_int_from_mac_table(mac_table):
 def get_switchport_mode(run_int):
     return parse_data(run_int, 'switchport mode from run int')[0]
 
+def get_vlans_from_show_vlan(show_vlan):
+    return parse_data(show_vlan, 'number, name and status of the vlans')
+
 def get_vrf_from_run_int_vlan(run_int_vlan):
     return parse_data(run_int_vlan, 'vrf from run int vlan')[0]
 
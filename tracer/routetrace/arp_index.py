@@ -0,0 +1,253 @@
+import sys
+import threading
+import time
+
+from tracer.routetrace import queries
+
+ARP_COLUMNS = ['device_ip', 'ip', 'device_id', 'mac', 'interface', 'vrf', 'timestamp']
+INVENTORY_COLUMNS = ['int_ip', 'ipv4', 'device_id', 'timestamp']
+
+# Interface addresses get_default_gateway_by_segment tries, in order.
+GATEWAY_LAST_PARTS = ('254', '1')
+
+
+def segment_of(ip):
+    return '.'.join(ip.split('.')[:3])
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ArpEntry:
+    __slots__ = ('device_ip', 'device_id', 'mac', 'interface', 'vrf', 'timestamp')
+
+    def __init__(self, device_ip, device_id, mac, interface, vrf, timestamp):
+        self.device_ip = _intern(device_ip)
+        self.device_id = _intern(device_id)
+        self.mac = mac
+        self.interface = _intern(interface)
+        self.vrf = _intern(vrf)
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"ArpEntry object for: {self.device_ip} {self.mac}"
+
+
+class _Endpoints:
+    """
+    One build of the index. It is never changed once swapped in, a refresh builds the next one.
+    """
+
+    def __init__(self, endpoints=None, segments=None):
+        self.endpoints = endpoints if endpoints is not None else {}  # endpoint ip -> {device_ip: ArpEntry}
+        self.segments = segments if segments is not None else {}  # segment -> {last ip part: (ipv4, device_id, timestamp)}
+
+
+class EndpointIndex:
+    """
+    In-process index of the ARP table: endpoint ip -> the gateways that learned it, and /24 segment ->
+    gateway interface addresses. After the first full load it only pulls rows newer than the highest
+    timestamp it has seen, and does a full reload every full_reload_interval to drop aged out entries.
+    Lookups mirror the FromDatabase functions of the same name and return None on a miss.
+    Like TopologyIndex, refreshes build a new _Endpoints and swap it in with one assignment, so lookups
+    run without a lock and never see a half merged refresh.
+    """
+
+    def __init__(self, datalake, refresh_interval=60, full_reload_interval=6 * 3600):
+        """
+        :param datalake: datalake the rows are loaded from
+        :param refresh_interval: seconds between two incremental refreshes
+        :param full_reload_interval: seconds between two full reloads
+        """
+        self.datalake = datalake
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+
+        self._lock = threading.Lock()  # serializes refreshes
+        self._index = _Endpoints()
+        self.arp_watermark = None
+        self.inventory_watermark = None
+        self.loaded_at = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.refreshes = 0
+        self.rows_merged = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"EndpointIndex object with {len(self._index.endpoints)} endpoints"
+
+    def _pull(self, table_name, columns, key_columns, conditions):
+        with self.datalake.exec_query_stream(
+                *queries.latest_rows_per_key(table_name, columns, key_columns, conditions)) as stream:
+            yield from stream
+
+    @staticmethod
+    def _copied(outer, key, copied):
+        # Copy on write of the inner dicts, the ones of the current index are shared with readers.
+        if key not in copied:
+            outer[key] = dict(outer.get(key) or {})
+            copied.add(key)
+        return outer[key]
+
+    def _merge_arp(self, endpoints, rows, watermark):
+        copied = set()
+        for device_ip, ip, device_id, mac, interface, vrf, timestamp in rows:
+            gateways = self._copied(endpoints, ip, copied)
+            current = gateways.get(device_ip)
+            if current is None or current.timestamp is None or (timestamp and timestamp >= current.timestamp):
+                gateways[device_ip] = ArpEntry(device_ip, device_id, mac, interface, vrf, timestamp)
+            if timestamp and (watermark is None or timestamp > watermark):
+                watermark = timestamp
+        return watermark
+
+    def _merge_inventory(self, segments, rows, watermark):
+        copied = set()
+        for int_ip, ipv4, device_id, timestamp in rows:
+            last_part = int_ip.split('.')[-1]
+            gateways = self._copied(segments, segment_of(int_ip), copied)
+            current = gateways.get(last_part)
+            if current is None or current[2] is None or (timestamp and timestamp >= current[2]):
+                gateways[last_part] = (_intern(ipv4), _intern(device_id), timestamp)
+            if timestamp and (watermark is None or timestamp > watermark):
+                watermark = timestamp
+        return watermark
+
+    def _inventory_rows(self, conditions):
+        for last_part in GATEWAY_LAST_PARTS:
+            yield from self._pull('crawler-device-interface-inventory', INVENTORY_COLUMNS, ['int_ip'],
+                                  [('int_ip', 'like', f'%.{last_part}')] + conditions)
+
+    def reload(self):
+        """
+        Loads both tables from scratch and swaps them in.
+        """
+        endpoints = {}
+        segments = {}
+
+        arp_watermark = self._merge_arp(
+            endpoints, self._pull('crawler-arp-table', ARP_COLUMNS, ['device_ip', 'ip'], []), None)
+        inventory_watermark = self._merge_inventory(segments, self._inventory_rows([]), None)
+
+        with self._lock:
+            self._index = _Endpoints(endpoints, segments)
+            self.arp_watermark = arp_watermark
+            self.inventory_watermark = inventory_watermark
+            self.loaded_at = time.monotonic()
+        self.refreshes += 1
+
+    def refresh(self):
+        """
+        Merges only the rows newer than the watermarks into the index, or reloads it when it's due.
+        """
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.full_reload_interval:
+            self.reload()
+            return
+
+        arp_rows = []
+        if self.arp_watermark is not None:
+            arp_rows = list(self._pull('crawler-arp-table', ARP_COLUMNS, ['device_ip', 'ip'],
+                                       [('timestamp', '>', self.arp_watermark)]))
+        inventory_rows = []
+        if self.inventory_watermark is not None:
+            inventory_rows = list(self._inventory_rows([('timestamp', '>', self.inventory_watermark)]))
+
+        with self._lock:
+            current = self._index
+            endpoints = dict(current.endpoints)
+            segments = dict(current.segments)
+            arp_watermark = self._merge_arp(endpoints, arp_rows, self.arp_watermark)
+            inventory_watermark = self._merge_inventory(segments, inventory_rows, self.inventory_watermark)
+            self._index = _Endpoints(endpoints, segments)
+            self.arp_watermark = arp_watermark
+            self.inventory_watermark = inventory_watermark
+        self.refreshes += 1
+        self.rows_merged += len(arp_rows) + len(inventory_rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Endpoint index refresh failed: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='endpoint-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _count(self, found):
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    def _newest(self, entries):
+        entries = list(entries)
+        dated = [entry for entry in entries if entry.timestamp is not None]
+        if dated:
+            return max(dated, key=lambda entry: entry.timestamp)
+        return entries[0] if entries else None
+
+    def get_default_gateway(self, endpoint_ip):
+        """
+        Same ranking as FromDatabase.get_default_gateway_ranked.
+        :return (gateway device ip, device_id) or None
+        """
+        gateways = list(self._index.endpoints.get(endpoint_ip, {}).values())
+
+        entry = self._newest(entry for entry in gateways if entry.vrf != 'default') or self._newest(gateways)
+        if entry:
+            return self._count((entry.device_ip, entry.device_id))
+
+        return self._count(self.get_default_gateway_by_segment(endpoint_ip))
+
+    def get_default_gateway_by_segment(self, segment):
+        gateways = self._index.segments.get(segment_of(segment), {})
+        for last_part in GATEWAY_LAST_PARTS:
+            if last_part in gateways:
+                ipv4, device_id, _ = gateways[last_part]
+                return ipv4, device_id
+        return None
+
+    def get_next_hop_id_mac_by_arp_ip(self, from_ip, endpoint_ip):
+        """
+        :return (device_id, mac, interface, vrf) or None
+        """
+        entry = self._index.endpoints.get(endpoint_ip, {}).get(from_ip)
+        if entry is None:
+            return self._count(None)
+        return self._count((entry.device_id, entry.mac, entry.interface, entry.vrf))
+
+    def default_gateway_step(self, dg_ip, endpoint_ip):
+        """
+        :return (device_id, vrf, mac, interface_or_vlan) or None
+        """
+        entry = self._index.endpoints.get(endpoint_ip, {}).get(dg_ip)
+        if entry is None:
+            return self._count(None)
+        return self._count((entry.device_id, entry.vrf, entry.mac, entry.interface))
+
+    def stats(self):
+        index = self._index
+        return {
+            'endpoints': len(index.endpoints),
+            'segments': len(index.segments),
+            'arp_watermark': self.arp_watermark,
+            'inventory_watermark': self.inventory_watermark,
+            'refreshes': self.refreshes,
+            'rows_merged': self.rows_merged,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,160 @@
+import hashlib
+import time
+from urllib.parse import quote
+
+import httpx
+
+from tracer.routetrace.queries import sql_literal
+from tracer.routetrace.query_cache import normalize_query, estimate_size
+from tracer.routetrace.query_metrics import measure_query
+from tracer.routetrace.retry_policy import RetryPolicy
+from tracer.routetrace.trino_connect import (DATALAKE_RETRY_POLICY, TRINO_HOST, TRINO_PORT, TRINO_USER,
+                                             TRINO_PASSWORD, TRINO_CATALOG, TRINO_SCHEMA)
+
+
+class AsyncTrinoDatalake:
+    """
+    asyncio implementation of the TrinoDatalake interface, speaking trino's HTTP protocol directly
+    over one pooled httpx.AsyncClient. exec_query is a coroutine returning the same (rows, columns)
+    as TrinoDatalake.exec_query, so concurrent lookups share the event loop instead of holding threads.
+    """
+
+    class TrinoQueryError(Exception):
+        def __init__(self, error):
+            self.error = error
+            self.message = error.get('message', str(error))
+            super().__init__(self.message)
+
+    class TrinoHttpError(Exception):
+        def __init__(self, status_code, message=''):
+            self.status_code = status_code
+            self.message = f"Trino answered with HTTP {status_code}. {message}".strip()
+            super().__init__(self.message)
+
+    # Statuses trino's coordinator returns while overloaded or restarting, safe to retry.
+    RETRY_STATUSES = (502, 503, 504)
+    TRANSIENT_ERRORS = (httpx.TransportError, TrinoHttpError)
+    # Submitting a query isn't idempotent, it is only retried when the request never left the client.
+    SUBMIT_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    # Seconds given to cancelling an abandoned query.
+    CANCEL_TIMEOUT = 5
+
+    def __init__(self, host=TRINO_HOST, port=TRINO_PORT, username=TRINO_USER, password=TRINO_PASSWORD,
+                 catalog=TRINO_CATALOG, schema=TRINO_SCHEMA, http_scheme='https', cache=None,
+                 retry_policy=None, max_connections=32, timeout=60):
+        self.url = f'{http_scheme}://{host}:{port}/v1/statement'
+        self.headers = {
+            'X-Trino-User': username,
+            'X-Trino-Catalog': catalog,
+            'X-Trino-Schema': schema,
+            'X-Trino-Source': 'route-trace-api',
+        }
+        self.cache = cache
+        # Shares the circuit breaker of the blocking client, both talk to the same coordinator.
+        self.retry_policy = retry_policy or RetryPolicy(retry_on=self.TRANSIENT_ERRORS,
+                                                        breaker=DATALAKE_RETRY_POLICY.breaker)
+        self.submit_retry_policy = RetryPolicy(retry_on=self.SUBMIT_RETRY_ERRORS, breaker=self.retry_policy.breaker)
+
+        self.client = httpx.AsyncClient(
+            auth=(username, password),
+            verify=False,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def __repr__(self):
+        return f"AsyncTrinoDatalake object for: {self.url}"
+
+    async def _request(self, method, url, **kwargs):
+        response = await self.client.request(method, url, **kwargs)
+        if response.status_code in self.RETRY_STATUSES:
+            raise self.TrinoHttpError(response.status_code)
+        if response.status_code != 200:
+            raise self.TrinoQueryError({'message': f"HTTP {response.status_code}: {response.text}"})
+        return response.json()
+
+    async def _cancel(self, next_uri):
+        """
+        Cancels a query that is still running on the coordinator, failures are only printed.
+        """
+        try:
+            await self.client.delete(next_uri, headers=self.headers, timeout=self.CANCEL_TIMEOUT)
+        except Exception as e:
+            print(f"Error cancelling trino query: {e}")
+
+    async def execute_query(self, query, params=None, debug=False):
+        """
+        Submits the query and follows nextUri until trino has sent every page of the result.
+        Parameters go through a prepared statement header, like the blocking client does.
+        A query abandoned before its last page (error, timeout, deadline, cancelled task) is cancelled
+        on the coordinator.
+        :return (rows, columns)
+        """
+        if debug:
+            start = time.time()
+            print(query, params)
+
+        headers = dict(self.headers)
+        statement = query
+        if params:
+            name = 'st_' + hashlib.sha1(query.encode()).hexdigest()[:16]
+            headers['X-Trino-Prepared-Statement'] = f'{name}={quote(query)}'
+            statement = f"execute {name} using {', '.join(sql_literal(value) for value in params)}"
+
+        async def submit():
+            return await self._request('POST', self.url, content=statement.encode('utf-8'), headers=headers)
+
+        async def follow(next_uri):
+            return await self._request('GET', next_uri, headers=headers)
+
+        page = await self.submit_retry_policy.call_async(submit)
+        rows = []
+        columns = None
+        next_uri = None
+        try:
+            while True:
+                next_uri = page.get('nextUri')
+                if 'error' in page:
+                    raise self.TrinoQueryError(page['error'])
+                if columns is None and page.get('columns'):
+                    columns = [column['name'] for column in page['columns']]
+                rows.extend(page.get('data') or [])
+
+                if not next_uri:
+                    break
+                page = await self.retry_policy.call_async(follow, next_uri)
+        finally:
+            if next_uri:
+                await self._cancel(next_uri)
+
+        if debug:
+            print(f"async trino query execute time: {time.time() - start: .6f} seconds")
+            print(rows)
+        return rows, columns
+
+    async def exec_query(self, query, params=None, bypass_cache=False):
+        with measure_query(query, 'trino-async') as record:
+            result_from_query = None
+            if self.cache is not None:
+                key = (normalize_query(query), tuple(params or ()))
+                if not bypass_cache:
+                    record.cache_hit, result_from_query = self.cache.get(key)
+
+            if not record.cache_hit:
+                result_from_query = await self.execute_query(query, params)
+                if self.cache is not None:
+                    self.cache.put(key, result_from_query, self.cache.ttl_of(query))
+
+            record.rows = len(result_from_query[0])
+            record.bytes = estimate_size(result_from_query)
+        return result_from_query
+
+    async def ping(self):
+        try:
+            await self.execute_query('select 1')
+            return True
+        except Exception:
+            return False
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,65 @@
+"""
+Compares the latency of the like scans with the exact match lookups of DeviceIdResolver, on a sample of
+devices and interfaces taken from the CDP/LLDP table. Every query bypasses the query cache.
+
+    python -m tracer.routetrace.benchmark_device_ids [sample size]
+"""
+import statistics
+import sys
+import time
+from itertools import islice
+
+from tracer.routetrace import FromDatabase
+from tracer.routetrace.device_ids import DeviceIdResolver
+from tracer.routetrace.query_cache import UncachedDatalake
+
+LOOKUPS = {
+    'get_next_hop_ip_cdp': lambda datalake, id_, interface, resolver:
+        FromDatabase.get_next_hop_ip_cdp(datalake, id_, interface, resolver=resolver),
+    'is_destination': lambda datalake, id_, interface, resolver:
+        FromDatabase.is_destination(datalake, id_, interface, resolver=resolver),
+    'get_nihul_ip': lambda datalake, id_, interface, resolver:
+        FromDatabase.get_nihul_ip(datalake, id_, resolver=resolver),
+}
+
+
+def _timed(lookup, *args):
+    start = time.perf_counter()
+    try:
+        lookup(*args)
+    except FromDatabase.DataBaseError:
+        pass
+    return time.perf_counter() - start
+
+
+def _summary(timings):
+    timings = sorted(timings)
+    return {
+        'median': round(statistics.median(timings), 4),
+        'p95': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        'total': round(sum(timings), 4),
+    }
+
+
+def run(datalake, sample_size=20):
+    datalake = UncachedDatalake(datalake)
+    resolver = DeviceIdResolver(datalake)
+    resolver.refresh()
+    print({'option': 'title', 'message': f'resolver built in {resolver.build_time:.2f}s'})
+
+    samples = list(islice(resolver.known_interfaces('crawler-cdp-lldp'), sample_size))
+
+    results = {}
+    for name, lookup in LOOKUPS.items():
+        like_timings = [_timed(lookup, datalake, id_, interface, None) for id_, interface in samples]
+        exact_timings = [_timed(lookup, datalake, id_, interface, resolver) for id_, interface in samples]
+        results[name] = {'like': _summary(like_timings), 'exact': _summary(exact_timings)}
+
+    return results
+
+
+if __name__ == '__main__':
+    from pprint import pprint
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pprint(run(FromDatabase.create_connection_instance(), size))
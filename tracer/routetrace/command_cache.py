@@ -0,0 +1,175 @@
+"""
+Cache of device command outputs, in front of Session.execute_command.
+
+Concurrent traces through the same core and PE routers send the same show commands seconds apart.
+Outputs are cached per (host, user, normalized command) for a TTL depending on how fast the command
+class changes, and identical commands running at the same time share one execution (single flight).
+Only show commands are cached. Forced refresh traces run inside bypass_command_cache(), their
+commands always reach the device and refresh the cache.
+"""
+import contextvars
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# (command pattern, seconds). The first matching pattern gives the TTL of a command.
+COMMAND_TTLS = (
+    (re.compile(r'^sh(ow)? (arp|mac address-table)\b'), 30),
+    (re.compile(r'^sh(ow)? ip (cef|route)\b'), 60),
+    (re.compile(r'^sh(ow)? (cef|mpls|lisp)\b'), 60),
+    (re.compile(r'^sh(ow)? (cdp|lldp)\b'), 600),
+    (re.compile(r'^sh(ow)? (run|running-config)\b'), 600),
+    (re.compile(r'^sh(ow)? (ip int|int|interfaces?)\b'), 300),
+    (re.compile(r'^sh(ow)? vrf\b'), 900),
+)
+DEFAULT_COMMAND_TTL = 30
+
+show_pattern = re.compile(r'^sh(ow)?\s')
+
+_bypass = contextvars.ContextVar('bypass_command_cache', default=False)
+
+
+def normalize_command(command):
+    return ' '.join(command.split())
+
+
+def is_cacheable(command):
+    return bool(show_pattern.match(normalize_command(command)))
+
+
+def ttl_of(command):
+    command = normalize_command(command)
+    for pattern, ttl in COMMAND_TTLS:
+        if pattern.match(command):
+            return ttl
+    return DEFAULT_COMMAND_TTL
+
+
+@contextmanager
+def bypass_command_cache(bypass=True):
+    """
+    Commands run inside the block skip cached outputs, their fresh outputs still refresh the cache.
+    """
+    token = _bypass.set(bypass)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.output = None
+        self.error = None
+
+
+class CommandCache:
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (output, expires_at)
+        self._in_flight = {}  # key -> _InFlight
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    def __repr__(self):
+        return f"CommandCache object with {len(self._entries)} outputs"
+
+    @staticmethod
+    def key(hostname, username, command):
+        return hostname, username, normalize_command(command)
+
+    def get(self, key):
+        """
+        :return (hit, output)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            output, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, output
+
+    def cached(self, key):
+        """
+        Like get, but misses inside bypass_command_cache().
+        """
+        if _bypass.get():
+            with self._lock:
+                self.bypassed += 1
+            return False, None
+        return self.get(key)
+
+    def put(self, key, output):
+        if output is None:
+            return
+        with self._lock:
+            self._entries[key] = (output, time.monotonic() + ttl_of(key[2]))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_execute(self, key, execute):
+        """
+        :param execute: callable running the command on the device, None outputs (errors) aren't cached
+        """
+        hit, output = self.cached(key)
+        if hit:
+            return output
+
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.output
+
+        try:
+            in_flight.output = execute()
+            self.put(key, in_flight.output)
+            return in_flight.output
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'outputs': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'bypassed': self.bypassed,
+            }
+
+
+COMMAND_CACHE = CommandCache()
@@ -63,6 +63,17 @@ def get_vlan_from_ip_int_brief(ip_int_brief):
             return word
 
 
+def get_vlans_from_show_vlan(show_vlan):
+    vlans = []
+    for line in show_vlan.splitlines():
+        vlan = re.findall(pattern=r'^(\d+)\s+(\S+)\s+((?:act|sus)\S*)', string=line)
+        if vlan:
+            vlans.append(vlan[0])
+    if not vlans:  # Every switch has vlan 1, an empty table means the format wasn't recognized.
+        raise ValueError("No vlan found in the show vlan output.")
+    return vlans
+
+
 def get_vrf_from_run_int_vlan(run_int_vlan):
     for line in run_int_vlan.splitlines():
         if line.strip().startswith('ip vrf forwarding '):
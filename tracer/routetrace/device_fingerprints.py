@@ -0,0 +1,217 @@
+"""
+Persistent fingerprints of the devices traces went through, keyed by management IP.
+
+A fingerprint holds the platform of the device (ios, xe, xr, checkpoint), per user the credential
+set that logged in (the user's own, primary, or the shared fallback account) and the command dialects
+that answered, e.g. which of the MPLS next hop commands the device understands. Sessions of a user try
+the set that worked for that user first, so one user's failed login never sends the sessions of the
+others to the fallback account. The tracer goes straight to the firewall path for known Checkpoint
+devices, instead of paying failed SSH handshakes on every trace. Changes are written save_delay seconds
+after the first one, in a background timer and outside the lock, to a JSON file swapped in atomically.
+"""
+import json
+import os
+import threading
+import time
+
+# Runtime state, kept in the user's state directory instead of the source tree. The
+# DEVICE_FINGERPRINTS_PATH environment variable overrides it.
+STATE_DIRECTORY = os.path.join(os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'), 'routetrace')
+DEFAULT_FINGERPRINTS_PATH = os.environ.get('DEVICE_FINGERPRINTS_PATH',
+                                           os.path.join(STATE_DIRECTORY, 'device_fingerprints.json'))
+
+PLATFORMS = ('ios', 'xe', 'xr', 'checkpoint')
+CREDENTIAL_SETS = ('primary', 'fallback')
+
+# Fingerprints not confirmed for this many seconds are ignored, devices get replaced and upgraded.
+FINGERPRINT_MAX_AGE = 30 * 24 * 3600
+
+
+class FingerprintStore:
+    def __init__(self, path=DEFAULT_FINGERPRINTS_PATH, max_age=FINGERPRINT_MAX_AGE, save_delay=5):
+        """
+        :param path: JSON file the fingerprints are kept in, None keeps them in memory only
+        :param max_age: seconds after which an unconfirmed fingerprint is ignored
+        :param save_delay: seconds changes are gathered before they are written, 0 writes every change
+        """
+        self.path = path
+        self.max_age = max_age
+        self.save_delay = save_delay
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer of the file at a time
+        self._devices = self._load()
+        self._version = 0  # bumped on every change
+        self._saved_version = 0
+        self._timer = None
+
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+
+    def __repr__(self):
+        return f"FingerprintStore object for: {self.path}"
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Error loading device fingerprints from {self.path}: {e}")
+            return {}
+
+    def _changed(self):
+        # Called with the lock held.
+        self._version += 1
+        if not self.path or not self.save_delay or self._timer is not None:
+            return
+        self._timer = threading.Timer(self.save_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _save_if_immediate(self):
+        # Without a save delay the caller writes the change itself, once the lock is released.
+        if not self.save_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending changes now. The file is written outside the lock, to a temporary file that
+        replaces the previous one.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                self._timer = None
+                if self._version == self._saved_version:
+                    return
+                version = self._version
+                content = json.dumps(self._devices, indent=1, sort_keys=True)
+
+            temporary_path = f'{self.path}.tmp'
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(temporary_path, 'w') as file:
+                    file.write(content)
+                os.replace(temporary_path, self.path)
+            except OSError as e:
+                print(f"Error saving device fingerprints to {self.path}: {e}")
+                return
+
+            with self._lock:
+                self._saved_version = max(self._saved_version, version)
+                self.saves += 1
+
+    def get(self, ip):
+        """
+        :return dict with platform, credentials, dialects and updated of the device, or None
+        """
+        with self._lock:
+            fingerprint = self._devices.get(ip)
+            if fingerprint is not None and time.time() - fingerprint['updated'] >= self.max_age:
+                fingerprint = None
+            if fingerprint is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(fingerprint, dialects=dict(fingerprint['dialects']),
+                        credentials=self._credentials_of(fingerprint))
+
+    @staticmethod
+    def _credentials_of(fingerprint):
+        # Files written before credentials were kept per user hold a single set for every user, dropped.
+        credentials = fingerprint.get('credentials')
+        return dict(credentials) if isinstance(credentials, dict) else {}
+
+    def platform(self, ip):
+        fingerprint = self.get(ip)
+        return fingerprint['platform'] if fingerprint else None
+
+    def credentials(self, ip, username):
+        """
+        :return the credential set that logged username in to the device last time, or None
+        """
+        fingerprint = self.get(ip)
+        return fingerprint['credentials'].get(username) if fingerprint else None
+
+    def dialect(self, ip, family):
+        fingerprint = self.get(ip)
+        return fingerprint['dialects'].get(family) if fingerprint else None
+
+    def _update(self, ip, field, value, key=None):
+        """
+        Sets field of the fingerprint to value, or with key, the key entry of the field mapping.
+        """
+        with self._lock:
+            fingerprint = self._devices.setdefault(ip, {'platform': None, 'credentials': {}, 'dialects': {},
+                                                        'updated': 0})
+            values = fingerprint
+            if key is not None:
+                if not isinstance(fingerprint.get(field), dict):
+                    fingerprint[field] = {}
+                values = fingerprint[field]
+            else:
+                key = field
+            stale = time.time() - fingerprint['updated'] >= self.max_age / 2
+            if values.get(key) == value and not stale:
+                return
+            values[key] = value
+            fingerprint['updated'] = time.time()
+            self._changed()
+        self._save_if_immediate()
+
+    def record_platform(self, ip, platform):
+        if platform not in PLATFORMS:
+            raise ValueError(f"Unknown platform {platform}, expected one of {PLATFORMS}.")
+        self._update(ip, 'platform', platform)
+
+    def record_credentials(self, ip, username, credentials):
+        """
+        :param username: the user's own username, the one the session was opened for
+        :param credentials: the credential set that logged the session in
+        """
+        if credentials not in CREDENTIAL_SETS:
+            raise ValueError(f"Unknown credential set {credentials}, expected one of {CREDENTIAL_SETS}.")
+        self._update(ip, 'credentials', credentials, key=username)
+
+    def record_dialect(self, ip, family, variant):
+        """
+        :param family: group of equivalent commands, e.g. 'mpls_next_hop'
+        :param variant: name of the command of the family that answered on the device
+        """
+        self._update(ip, 'dialects', variant, key=family)
+
+    def forget(self, ip):
+        with self._lock:
+            if self._devices.pop(ip, None) is not None:
+                self._changed()
+        self._save_if_immediate()
+
+    def stats(self):
+        with self._lock:
+            platforms = {}
+            for fingerprint in self._devices.values():
+                platforms[fingerprint['platform']] = platforms.get(fingerprint['platform'], 0) + 1
+            return {
+                'devices': len(self._devices),
+                'platforms': {str(platform): count for platform, count in platforms.items()},
+                'fallback_credentials': sum(list(self._credentials_of(fingerprint).values()).count('fallback')
+                                            for fingerprint in self._devices.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'saves': self.saves,
+                'unsaved_changes': self._version - self._saved_version,
+            }
+
+    def close(self):
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+
+FINGERPRINTS = FingerprintStore()
@@ -0,0 +1,205 @@
+"""
+Canonical device ids and interface names, and the resolver mapping them back to the raw values
+stored in the crawler tables.
+
+The tables spell the same device and interface differently (`SW1.services.corp` / `sw1`,
+`Gi1/0/1` / `GigabitEthernet1/0/1`), which is why FromDatabase used to match them with
+`like '%...%'` and scan the whole table. DeviceIdResolver keeps, per table, canonical value -> raw
+values, so those lookups become `in (...)` exact matches trino can prune on.
+"""
+import re
+import sys
+import threading
+import time
+
+from tracer.routetrace import queries
+
+# Full interface type names, in the order abbreviations are resolved: `te` is TenGigabitEthernet,
+# `tw` TwoGigabitEthernet and `twe` TwentyFiveGigE, as on the devices themselves.
+INTERFACE_TYPES = (
+    'gigabitethernet',
+    'tengigabitethernet',
+    'fastethernet',
+    'fortygigabitethernet',
+    'hundredgige',
+    'twogigabitethernet',
+    'twentyfivegige',
+    'appgigabitethernet',
+    'ethernet',
+    'port-channel',
+    'vlan',
+    'loopback',
+    'tunnel',
+    'bundle-ether',
+    'management',
+)
+
+# Abbreviations that aren't a prefix of their full name.
+INTERFACE_ALIASES = {
+    'be': 'bundle-ether',
+    'mgmt': 'management',
+}
+
+interface_pattern = re.compile(r'^([a-z-]+)(\d.*)$')
+
+# Table -> device id column, interface column (None when the table has no interfaces)
+RESOLVED_TABLES = {
+    'crawler-cdp-lldp': ('local_device_id', 'local_int'),
+    'crawler-interface-config': ('device_id', 'interface'),
+    'crawler-device-portchannels': ('device_id', 'pointerface'),
+    'v_spectrum_network_devices': ('device_id', None),
+}
+
+
+def canonical_device_id(device_id):
+    """
+    Lowercase device id without the `.services` suffix and everything after it.
+    """
+    if not device_id:
+        return None
+
+    parts = device_id.strip().lower().split('.')
+    if 'services' in parts:
+        parts = parts[:parts.index('services')]
+
+    return sys.intern('.'.join(parts))
+
+
+def canonical_interface(interface):
+    """
+    Lowercase interface name with the type spelled out and no whitespace, e.g. `Gi 1/0/1` -> `gigabitethernet1/0/1`.
+    """
+    if not interface:
+        return None
+
+    interface = ''.join(interface.split()).lower()
+    match = interface_pattern.match(interface)
+    if not match:
+        return sys.intern(interface)
+
+    prefix, number = match.groups()
+    if prefix in INTERFACE_ALIASES:
+        return sys.intern(INTERFACE_ALIASES[prefix] + number)
+
+    for interface_type in INTERFACE_TYPES:
+        if interface_type.startswith(prefix):
+            return sys.intern(interface_type + number)
+
+    return sys.intern(interface)
+
+
+class DeviceIdResolver:
+    """
+    Per table mapping of canonical device ids and interfaces to the raw values stored in the table,
+    rebuilt periodically in the background. Lookups return None when the value is unknown, the caller
+    then falls back to the like query.
+    """
+
+    def __init__(self, datalake, refresh_interval=900, tables=None):
+        """
+        :param datalake: datalake the distinct values are loaded from
+        :param refresh_interval: seconds between two background rebuilds
+        """
+        self.datalake = datalake
+        self.refresh_interval = refresh_interval
+        self.tables = tables or RESOLVED_TABLES
+
+        self._device_ids = {}  # table -> canonical device id -> raw device ids
+        self._interfaces = {}  # table -> (canonical device id, canonical interface) -> raw interfaces
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.built_at = None
+        self.build_time = None
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"DeviceIdResolver object built at: {self.built_at}"
+
+    def refresh(self):
+        """
+        Loads the distinct device ids and interfaces of every table and swaps the new mappings in.
+        """
+        start = time.monotonic()
+        device_ids = {}
+        interfaces = {}
+
+        for table_name, (device_column, interface_column) in self.tables.items():
+            columns = [device_column] + ([interface_column] if interface_column else [])
+            table_device_ids = {}
+            table_interfaces = {}
+            with self.datalake.exec_query_stream(*queries.distinct_rows(table_name, columns)) as stream:
+                for row in stream:
+                    raw_device_id = row[0]
+                    device_key = canonical_device_id(raw_device_id)
+                    if device_key is None:
+                        continue
+                    table_device_ids.setdefault(device_key, set()).add(raw_device_id)
+
+                    if interface_column and row[1]:
+                        table_interfaces.setdefault((device_key, canonical_interface(row[1])), set()).add(row[1])
+
+            device_ids[table_name] = {key: sorted(values) for key, values in table_device_ids.items()}
+            interfaces[table_name] = {key: sorted(values) for key, values in table_interfaces.items()}
+
+        self._device_ids = device_ids
+        self._interfaces = interfaces
+        self.built_at = time.time()
+        self.build_time = time.monotonic() - start
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Device id resolver refresh failed: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='device-id-resolver', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _count(self, found):
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    def device_ids(self, table_name, device_id):
+        """
+        :return the raw device ids of table_name with the same canonical id as device_id, or None
+        """
+        return self._count(self._device_ids.get(table_name, {}).get(canonical_device_id(device_id)))
+
+    def interfaces(self, table_name, device_id, interface):
+        """
+        :return the raw interface names of the device in table_name with the same canonical name, or None
+        """
+        key = (canonical_device_id(device_id), canonical_interface(interface))
+        return self._count(self._interfaces.get(table_name, {}).get(key))
+
+    def known_interfaces(self, table_name):
+        """
+        :return generator of (raw device id, raw interface) pairs of table_name
+        """
+        device_ids = self._device_ids.get(table_name, {})
+        for (device_key, _), interfaces in self._interfaces.get(table_name, {}).items():
+            yield device_ids[device_key][0], interfaces[0]
+
+    def stats(self):
+        return {
+            'built_at': self.built_at,
+            'build_time': self.build_time,
+            'device_ids': {table_name: len(ids) for table_name, ids in self._device_ids.items()},
+            'interfaces': {table_name: len(ints) for table_name, ints in self._interfaces.items()},
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,232 @@
+"""
+Admission control for live device sessions.
+
+Every session to a device holds a slot from connect to close_connection. At most max_per_device
+slots are held per device, so concurrent traces through the same PE can't use up its VTY lines, and
+at most max_total over all devices. When a device is full, waiting sessions are served fairly across
+owners (the user a trace runs for, see device_owner): the owner granted a slot least recently goes
+first, FIFO between sessions of the same owner. Queue waits are recorded per device, so a hot device
+shows up as the bottleneck in /metrics/datalake.
+
+Idle transports the session pools keep logged in hold VTY lines too, whatever pool and credentials
+they belong to. The pools register with the scheduler, and trim closes the idle transports of a device
+that don't fit in max_per_device next to the sessions holding a slot. It runs whenever a slot is
+released and once a session has its transport.
+"""
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from tracer.routetrace.query_metrics import Histogram
+
+_current_owner = contextvars.ContextVar('device_owner', default=None)
+
+
+@contextmanager
+def device_owner(owner):
+    """
+    Device slots requested inside the block are queued for owner.
+    """
+    token = _current_owner.set(owner)
+    try:
+        yield
+    finally:
+        _current_owner.reset(token)
+
+
+class _Ticket:
+    __slots__ = ('device', 'owner', 'seq', 'enqueued', 'grant', 'granted')
+
+    def __init__(self, device, owner, seq, grant):
+        self.device = device
+        self.owner = owner
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.grant = grant
+        self.granted = False
+
+
+class _DeviceStats:
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.granted = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.evicted = 0
+        self.wait = Histogram()
+
+
+class DeviceScheduler:
+    class SchedulerTimeoutError(Exception):
+        def __init__(self, message="Timed out waiting for a free session slot on the device."):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(self, max_per_device=3, max_total=64, timeout=120):
+        """
+        :param max_per_device: sessions held at once to one device
+        :param max_total: sessions held at once to all devices
+        :param timeout: seconds a session waits for a slot before SchedulerTimeoutError
+        """
+        self.max_per_device = max_per_device
+        self.max_total = max_total
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._devices = {}  # device -> _DeviceStats
+        self._queue = []  # _Ticket, in arrival order
+        self._last_granted = {}  # owner -> grant sequence number
+        self._grants = itertools.count(1)
+        self._seq = itertools.count()
+        self._total = 0
+        self._pools = []
+
+    def __repr__(self):
+        return f"DeviceScheduler object with {self._total} sessions and {len(self._queue)} waiting"
+
+    def _device(self, device):
+        stats = self._devices.get(device)
+        if stats is None:
+            stats = self._devices[device] = _DeviceStats()
+        return stats
+
+    def _has_room(self, device):
+        return self._total < self.max_total and self._device(device).active < self.max_per_device
+
+    def _take(self, device, owner, waited):
+        # Called with the lock held.
+        stats = self._device(device)
+        stats.active += 1
+        stats.granted += 1
+        stats.wait.observe(waited)
+        self._total += 1
+        self._last_granted[owner] = next(self._grants)
+
+    def _dispatch(self):
+        # Called with the lock held. Grants free slots to the queued sessions, least recently served owner first.
+        while self._queue:
+            eligible = [ticket for ticket in self._queue if self._has_room(ticket.device)]
+            if not eligible:
+                return
+            ticket = min(eligible, key=lambda t: (self._last_granted.get(t.owner, 0), t.seq))
+            self._queue.remove(ticket)
+            self._device(ticket.device).waiting -= 1
+            self._take(ticket.device, ticket.owner, time.monotonic() - ticket.enqueued)
+            ticket.granted = True
+            ticket.grant()
+
+    def _enqueue(self, device, owner, grant):
+        """
+        :return None when the slot was granted right away, else the queued ticket
+        """
+        with self._lock:
+            if self._has_room(device) and not any(ticket.device == device for ticket in self._queue):
+                self._take(device, owner, 0.0)
+                return None
+            ticket = _Ticket(device, owner, next(self._seq), grant)
+            self._queue.append(ticket)
+            stats = self._device(device)
+            stats.waiting += 1
+            stats.queued += 1
+            return ticket
+
+    def _abandon(self, ticket):
+        """
+        :return True when the ticket left the queue, False when it was granted in the meantime
+        """
+        with self._lock:
+            if ticket.granted:
+                return False
+            self._queue.remove(ticket)
+            stats = self._device(ticket.device)
+            stats.waiting -= 1
+            stats.timeouts += 1
+            self._dispatch()
+            return True
+
+    def acquire(self, device, timeout=None):
+        """
+        Blocks until the current owner may open a session to device, release it with release(device).
+        """
+        granted = threading.Event()
+        ticket = self._enqueue(device, _current_owner.get(), granted.set)
+        if ticket is None:
+            return
+        if not granted.wait(timeout or self.timeout) and self._abandon(ticket):
+            raise self.SchedulerTimeoutError(f"Timed out waiting for a free session slot on {device}.")
+
+    def release(self, device):
+        with self._lock:
+            self._device(device).active -= 1
+            self._total -= 1
+            self._dispatch()
+        self.trim(device)
+
+    def register_pool(self, pool):
+        """
+        :param pool: pool keeping idle transports to devices logged in, with idle_count(device) and
+        evict_idle(device, count) -> number of transports closed
+        """
+        self._pools.append(pool)
+
+    def trim(self, device):
+        """
+        Closes idle pooled transports of device until they fit in max_per_device next to the sessions
+        holding a slot. Called without any pool lock held, the pools take their own.
+        :return number of transports closed
+        """
+        if not self._pools:
+            return 0
+        with self._lock:
+            active = self._device(device).active
+        excess = active + sum(pool.idle_count(device) for pool in self._pools) - self.max_per_device
+        closed = 0
+        for pool in self._pools:
+            if closed >= excess:
+                break
+            closed += pool.evict_idle(device, excess - closed)
+        if closed:
+            with self._lock:
+                self._device(device).evicted += closed
+        return closed
+
+    @contextmanager
+    def slot(self, device, timeout=None):
+        self.acquire(device, timeout)
+        try:
+            yield
+        finally:
+            self.release(device)
+
+    def stats(self, top=10):
+        """
+        :param top: number of devices listed, the ones sessions waited on the longest first
+        """
+        with self._lock:
+            devices = sorted(self._devices.items(), key=lambda item: item[1].wait.sum, reverse=True)[:top]
+            return {
+                'active': self._total,
+                'waiting': len(self._queue),
+                'granted': sum(stats.granted for stats in self._devices.values()),
+                'queued': sum(stats.queued for stats in self._devices.values()),
+                'timeouts': sum(stats.timeouts for stats in self._devices.values()),
+                'evicted': sum(stats.evicted for stats in self._devices.values()),
+                'devices': {
+                    device: {
+                        'active': stats.active,
+                        'waiting': stats.waiting,
+                        'granted': stats.granted,
+                        'queued': stats.queued,
+                        'timeouts': stats.timeouts,
+                        'evicted': stats.evicted,
+                        'wait': stats.wait.as_dict(),
+                    }
+                    for device, stats in devices
+                },
+            }
+
+
+DEVICE_SCHEDULER = DeviceScheduler()
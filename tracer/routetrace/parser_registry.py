@@ -0,0 +1,247 @@
+"""
+Registry of the device output parsers.
+
+Every kind of output has a local parser from command_result_parser, a validator of its result and
+optionally a fallback on the AI parser service. The local parser answers first. A None result (or no
+values at all) is the parser's "not found" answer and is returned as is. The AI service is only asked
+when the local parser raised or returned something that doesn't pass validation, and a failed AI call
+gives the local result back. Outputs with nothing to parse (empty, or the device rejected the command)
+are not sent to the AI service either. Control flow exceptions the local parsers raise on purpose
+(SDABorderSuspicion and co.) are answers, not failures, they propagate untouched. Calls and fallbacks
+are counted per parser, so the outputs the local parsers miss show up in /metrics/datalake.
+
+The hop lookups of the trace (CEF, route, MPLS, firewall, LISP) have no AI fallback: an output those
+parsers can't read is how the trace detects a firewall or a wrong device type, and a guessed answer
+would hide it. FromDevices calls command_result_parser directly for the same reason, the registry is
+the front for the callers that used the AI parser until now.
+
+The module level parsers below have the names and signatures of their command_result_parser twins:
+
+    from tracer.routetrace import parser_registry as parser
+    vlans = parser.get_vlans_from_show_vlan(output)
+"""
+import re
+import threading
+from functools import wraps
+
+from tracer.routetrace import ai_command_parser
+from tracer.routetrace import command_result_parser
+from tracer.routetrace.command_result_parser import SDABorderSuspicion, TrafficEngSuspicion, Suspicion8200
+from tracer.routetrace.regex_patterns import ip_pattern, mac_pattern, int_or_subint_pattern
+
+# Raised by local parsers to send the trace down another path.
+CONTROL_FLOW_EXCEPTIONS = (SDABorderSuspicion, TrafficEngSuspicion, Suspicion8200)
+
+# Start of the IOS/XE/XR answers to a command the device doesn't know, there is nothing to parse in them.
+REJECTED_COMMAND_MARKERS = ('% Invalid input', '% Incomplete command', '% Ambiguous command', '% Unknown command')
+
+
+def is_ip(value):
+    return isinstance(value, str) and re.fullmatch(ip_pattern, value.strip()) is not None
+
+
+def is_mac(value):
+    return isinstance(value, str) and re.fullmatch(mac_pattern, value.strip().lower()) is not None
+
+
+def is_interface(value):
+    return isinstance(value, str) and re.fullmatch(int_or_subint_pattern, value.strip()) is not None
+
+
+def is_text(value):
+    return isinstance(value, str) and bool(value.strip())
+
+
+def is_not_found(result):
+    """
+    :return whether result is a parser's "not found" answer: None, or only None values
+    """
+    if result is None:
+        return True
+    return isinstance(result, (list, tuple)) and all(item is None for item in result)
+
+
+def is_parseable(output):
+    """
+    :return whether output has anything the AI service could find data in
+    """
+    if not is_text(output):
+        return False
+    return not any(marker in output for marker in REJECTED_COMMAND_MARKERS)
+
+
+class _ParserStats:
+    def __init__(self):
+        self.calls = 0
+        self.local_answers = 0
+        self.local_errors = 0
+        self.not_found = 0
+        self.fallbacks = 0
+        self.unparseable = 0
+        self.ai_answers = 0
+        self.ai_failures = 0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'local_answers': self.local_answers,
+            'local_errors': self.local_errors,
+            'not_found': self.not_found,
+            'fallbacks': self.fallbacks,
+            'fallback_rate': round(self.fallbacks / self.calls, 4) if self.calls else 0.0,
+            'unparseable': self.unparseable,
+            'ai_answers': self.ai_answers,
+            'ai_failures': self.ai_failures,
+        }
+
+
+class ParserRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parsers = {}  # kind -> (local, validate, ai)
+        self._stats = {}  # kind -> _ParserStats
+
+    def __repr__(self):
+        return f"ParserRegistry object with {len(self._parsers)} parsers"
+
+    def register(self, local, validate, ai=None, kind=None):
+        """
+        :param local: parser of command_result_parser
+        :param validate: callable telling whether a result of the parser is usable
+        :param ai: parser asking the AI service for the same data, None to never fall back
+        :param kind: name of the parser in the stats, the name of local without get_ by default
+        :return callable parsing through the registry, with the signature of local
+        """
+        kind = kind or local.__name__.removeprefix('get_')
+        with self._lock:
+            self._parsers[kind] = (local, validate, ai)
+            self._stats[kind] = _ParserStats()
+
+        @wraps(local)
+        def parser(*args):
+            return self.parse(kind, *args)
+
+        return parser
+
+    def _count(self, kind, counter):
+        with self._lock:
+            stats = self._stats[kind]
+            setattr(stats, counter, getattr(stats, counter) + 1)
+
+    @staticmethod
+    def _valid(validate, result):
+        try:
+            return bool(validate(result))
+        except (TypeError, ValueError, IndexError, AttributeError):
+            return False
+
+    def parse(self, kind, *args):
+        local, validate, ai = self._parsers[kind]
+        self._count(kind, 'calls')
+
+        error = None
+        try:
+            result = local(*args)
+        except CONTROL_FLOW_EXCEPTIONS:
+            self._count(kind, 'local_answers')
+            raise
+        except Exception as e:
+            self._count(kind, 'local_errors')
+            result, error = None, e
+
+        if error is None and is_not_found(result):
+            self._count(kind, 'not_found')
+            return result
+        if error is None and self._valid(validate, result):
+            self._count(kind, 'local_answers')
+            return result
+        if ai is None or not is_parseable(args[0]):
+            if ai is not None:
+                self._count(kind, 'unparseable')
+            if error is not None:
+                raise error
+            return result
+
+        self._count(kind, 'fallbacks')
+        try:
+            ai_result = ai(*args)
+        except Exception as e:
+            print(f"AI parser failed on {kind}: {e}")
+            ai_result = None
+        if not self._valid(validate, ai_result):
+            self._count(kind, 'ai_failures')
+            if error is not None:
+                raise error
+            return result
+
+        self._count(kind, 'ai_answers')
+        return ai_result
+
+    def stats(self):
+        with self._lock:
+            return {kind: stats.as_dict() for kind, stats in self._stats.items()}
+
+
+PARSERS = ParserRegistry()
+
+
+get_vlan_from_ip_int_brief = PARSERS.register(
+    command_result_parser.get_vlan_from_ip_int_brief, is_interface,
+    ai_command_parser.get_vlan_from_ip_int_brief)
+get_mac_interface_from_arp = PARSERS.register(
+    command_result_parser.get_mac_interface_from_arp, lambda result: is_mac(result[0]) and is_interface(result[1]),
+    ai_command_parser.get_mac_interface_from_arp)
+get_next_hop_from_cdp = PARSERS.register(
+    command_result_parser.get_next_hop_from_cdp, lambda result: is_ip(result[0]) and is_text(result[1]),
+    ai_command_parser.get_next_hop_from_cdp)
+get_next_hop_int_from_mac_table = PARSERS.register(
+    command_result_parser.get_next_hop_int_from_mac_table, is_interface,
+    ai_command_parser.get_next_hop_int_from_mac_table)
+get_switchport_mode = PARSERS.register(
+    command_result_parser.get_switchport_mode, lambda result: result in ('trunk', 'access'),
+    ai_command_parser.get_switchport_mode)
+get_vrf_from_run_int_vlan = PARSERS.register(
+    command_result_parser.get_vrf_from_run_int_vlan, is_text,
+    ai_command_parser.get_vrf_from_run_int_vlan)
+get_last_int_in_port_channel = PARSERS.register(
+    command_result_parser.get_last_int_in_port_channel, is_interface,
+    ai_command_parser.get_last_int_in_port_channel)
+get_nihul_vlans_from_vrf = PARSERS.register(
+    command_result_parser.get_nihul_vlans_from_vrf, lambda result: bool(result) and all(map(is_text, result)),
+    ai_command_parser.get_nihul_vlans_from_vrf)
+get_ip_of_nihul_vlan = PARSERS.register(
+    command_result_parser.get_ip_of_nihul_vlan, is_ip,
+    ai_command_parser.get_ip_of_nihul_vlan)
+get_next_hop_id_from_cdp = PARSERS.register(
+    command_result_parser.get_next_hop_id_from_cdp, is_text,
+    ai_command_parser.get_next_hop_id_from_cdp)
+get_next_hop_ip_and_protocol_from_cef = PARSERS.register(
+    command_result_parser.get_next_hop_ip_and_protocol_from_cef,
+    lambda result: (is_ip(result[0]) or result[0] == 'end') and (result[1] is None or str(result[1]).isdigit()))
+get_next_hop_ip_and_protocol_from_route = PARSERS.register(
+    command_result_parser.get_next_hop_ip_and_protocol_from_route,
+    lambda result: is_text(result) or bool(result[1]))
+get_next_hop_ip_from_mpls_ldp = PARSERS.register(
+    command_result_parser.get_next_hop_ip_from_mpls_ldp, lambda result: is_ip(result[0]))
+get_next_hop_ip_from_mpls_forwarding = PARSERS.register(
+    command_result_parser.get_next_hop_ip_from_mpls_forwarding, lambda result: is_ip(result[0]))
+get_lib_entry_from_mpls_ldp_bindings = PARSERS.register(
+    command_result_parser.get_lib_entry_from_mpls_ldp_bindings, is_ip)
+get_next_hop_ip_from_firewall = PARSERS.register(
+    command_result_parser.get_next_hop_ip_from_firewall, is_ip)
+get_next_int_of_int_ip_via_int_br = PARSERS.register(
+    command_result_parser.get_next_int_of_int_ip_via_int_br, is_interface,
+    ai_command_parser.get_next_int_of_int_ip_via_int_br)
+get_vrf_from_run_int = PARSERS.register(
+    command_result_parser.get_vrf_from_run_int, is_text,
+    ai_command_parser.get_vrf_from_run_int)
+get_fe_ip_from_lisp_eid_table = PARSERS.register(
+    command_result_parser.get_fe_ip_from_lisp_eid_table, is_ip)
+get_affinity_tag = PARSERS.register(
+    command_result_parser.get_affinity_tag, is_text)
+get_nexthop_and_label_from_mpls_forwarding = PARSERS.register(
+    command_result_parser.get_nexthop_and_label_from_mpls_forwarding, lambda result: is_text(result[0]))
+get_vlans_from_show_vlan = PARSERS.register(
+    command_result_parser.get_vlans_from_show_vlan,
+    lambda result: bool(result) and all(len(vlan) == 3 and str(vlan[0]).isdigit() for vlan in result),
+    ai_command_parser.get_vlans_from_show_vlan)
@@ -0,0 +1,124 @@
+"""
+Background logins to the devices a trace is about to visit.
+
+Connecting to a hop used to start only once the previous hop was parsed and resolved, putting every
+SSH handshake on the critical path of the trace. The tracer now hands predicted hops to a
+SessionPrefetcher as soon as they are known: default gateways once resolved, the CDP neighbour of a
+mac trace hop from the topology index, the next hop earlier traces took from the same router
+towards the same destination (learned from their CEF results), and the next hop the current hop's
+route lookup just returned. A worker logs in and returns the session to the pool, where the hop's
+own session picks it up. A wrong prediction costs one handshake, in the background. Logins are
+tracked per device and user, a trace never waits on a login made with credentials it can't use.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from tracer.routetrace import FromDevices
+
+
+class SessionPrefetcher:
+    def __init__(self, warm_up=FromDevices.warm_up, max_workers=4, route_ttl=900, max_routes=10000):
+        """
+        :param warm_up: callable(ip, username, password) logging in to the device and giving the session back
+        to its pool
+        :param route_ttl: seconds a learned next hop is used for predictions
+        :param max_routes: learned next hops kept, the least recently used are dropped
+        """
+        self.warm_up = warm_up
+        self.route_ttl = route_ttl
+        self.max_routes = max_routes
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._in_flight = {}  # (ip, username) -> Future
+        self._routes = OrderedDict()  # (ip, vrf, destination_network) -> (next hop ip, expires_at)
+
+        self._stats = {
+            'requested': 0,
+            'started': 0,
+            'deduplicated': 0,
+            'failed': 0,
+            'waited': 0,
+            'route_predictions': 0,
+        }
+
+    def __repr__(self):
+        return f"SessionPrefetcher object with {len(self._in_flight)} logins running"
+
+    def _run(self, ip, username, password):
+        try:
+            self.warm_up(ip, username, password)
+        except Exception as e:
+            with self._lock:
+                self._stats['failed'] += 1
+            print(f"Prefetching a session to {ip} failed: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.pop((ip, username), None)
+
+    def prefetch(self, ip, username, password):
+        """
+        Starts logging in to ip in the background, unless a login to it as username is already running.
+        The worker runs in a copy of the caller's context, so it is scheduled for the same owner.
+        """
+        if not ip:
+            return
+        with self._lock:
+            self._stats['requested'] += 1
+            if (ip, username) in self._in_flight:
+                self._stats['deduplicated'] += 1
+                return
+            self._stats['started'] += 1
+            context = contextvars.copy_context()
+            try:
+                self._in_flight[ip, username] = self._executor.submit(context.run, self._run, ip, username, password)
+            except RuntimeError:
+                # Shut down.
+                self._stats['started'] -= 1
+
+    def wait(self, ip, username, timeout=30):
+        """
+        Waits for a running login to ip as username, so the caller takes that session instead of handshaking
+        alongside it.
+        """
+        with self._lock:
+            future = self._in_flight.get((ip, username))
+            if future is None:
+                return
+            self._stats['waited'] += 1
+        try:
+            future.result(timeout)
+        except Exception:
+            pass
+
+    def learn_route(self, ip, vrf, destination_network, next_hop_ip):
+        with self._lock:
+            key = (ip, vrf, destination_network)
+            self._routes[key] = (next_hop_ip, time.monotonic() + self.route_ttl)
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.max_routes:
+                self._routes.popitem(last=False)
+
+    def prefetch_route(self, ip, vrf, destination_network, username, password):
+        """
+        Prefetches the next hop an earlier trace took from ip towards destination_network.
+        """
+        with self._lock:
+            entry = self._routes.get((ip, vrf, destination_network))
+            if entry is None or time.monotonic() >= entry[1]:
+                return
+            self._stats['route_predictions'] += 1
+        self.prefetch(entry[0], username, password)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._in_flight)
+            stats['routes'] = len(self._routes)
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
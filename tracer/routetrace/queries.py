@@ -0,0 +1,123 @@
+"""
+Builders for the "newest row per key" queries FromDatabase runs against the crawler tables.
+
+Every builder returns (sql, params), with `?` placeholders bound by the trino client instead of values
+interpolated into the sql text, so identical lookups share one statement and trino can reuse its plan.
+Conditions are (column, operator, value) tuples; the `in` operator takes a list of values.
+"""
+
+SCHEMA = 'network'
+OPERATORS = ('=', '!=', '<', '>', '<=', '>=', 'like', 'in')
+
+
+def table(name):
+    return f'{SCHEMA}."{name}"'
+
+
+def sql_literal(value):
+    """
+    Formats a bound value as a trino literal, for clients that send parameters as `EXECUTE ... USING`.
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def where_clause(conditions):
+    """
+    :param conditions: list of (column, operator, value)
+    :return (sql fragment without the `where` keyword, params)
+    """
+    parts = []
+    params = []
+
+    for column, operator, value in conditions:
+        operator = operator.lower()
+        if operator not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {operator}")
+
+        if operator == 'in':
+            values = list(value)
+            if not values:
+                parts.append('1 = 0')
+                continue
+            parts.append(f"{column} in ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        else:
+            parts.append(f'{column} {operator} ?')
+            params.append(value)
+
+    return ' and '.join(parts) or '1 = 1', params
+
+
+def latest_row(table_name, columns, conditions, order_column='timestamp', limit=1):
+    """
+    Newest `limit` rows matching the conditions. Trino turns order by + limit into a TopN,
+    so only the newest row leaves the workers instead of the whole history of the key.
+    """
+    where, params = where_clause(conditions)
+    sql = (f"select {', '.join(columns)} "
+           f"from {table(table_name)} "
+           f"where {where} "
+           f"order by {order_column} desc "
+           f"limit {int(limit)}")
+
+    return sql, params
+
+
+def distinct_rows(table_name, columns, conditions=()):
+    """
+    Distinct combinations of columns, for the lookup tables built in process.
+    """
+    where, params = where_clause(conditions)
+    sql = (f"select distinct {', '.join(columns)} "
+           f"from {table(table_name)} "
+           f"where {where}")
+
+    return sql, params
+
+
+def latest_rows_per_key(table_name, columns, key_columns, conditions, order_column='timestamp'):
+    """
+    Newest row of every key among the rows matching the conditions, for batch lookups.
+    The rows keep the order of `columns`.
+    """
+    where, params = where_clause(conditions)
+    sql = (f"select {', '.join(columns)} from ("
+           f"select {', '.join(columns)}, "
+           f"row_number() over (partition by {', '.join(key_columns)} order by {order_column} desc) as row_rank "
+           f"from {table(table_name)} "
+           f"where {where}"
+           f") where row_rank = 1")
+
+    return sql, params
+
+
+def first_ranked_row(candidates, order_column='timestamp'):
+    """
+    Answers a fallback cascade in one round trip. Every candidate is (table_name, columns, conditions),
+    all candidates select the same number of columns, and the newest row of the first candidate that
+    has any rows wins.
+    """
+    selects = []
+    params = []
+
+    for priority, (table_name, columns, conditions) in enumerate(candidates):
+        where, candidate_params = where_clause(conditions)
+        aliased = ', '.join(f'{column} as c{index}' for index, column in enumerate(columns))
+        selects.append(f"select {aliased}, {priority} as priority, {order_column} as row_timestamp "
+                       f"from {table(table_name)} "
+                       f"where {where}")
+        params.extend(candidate_params)
+
+    width = len(candidates[0][1])
+    sql = (f"select {', '.join(f'c{index}' for index in range(width))} from ("
+           f"{' union all '.join(selects)}"
+           f") order by priority, row_timestamp desc "
+           f"limit 1")
+
+    return sql, params
@@ -0,0 +1,157 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a cached result stays valid, by the datalake table it was read from.
+# Queries touching several tables use the shortest TTL among them.
+TABLE_TTLS = {
+    'crawler-arp-table': 300,
+    'crawler-mac-table': 120,
+    'crawler-cdp-lldp': 3600,
+    'crawler-device-interface-inventory': 3600,
+    'crawler-device-portchannels': 3600,
+    'crawler-interface-config': 1800,
+    'crawler-route-table': 300,
+    'crawler-devices': 3600,
+    'spectrum-devices': 3600,
+    'static-device-tags': 3600,
+    'v_spectrum_network_devices': 3600,
+    'v_site_arps_from_up_access_interfaces': 300,
+    'v_network_device_interfaces_neighbors': 3600,
+}
+DEFAULT_TTL = 300
+
+table_pattern = re.compile(r'network\."([^"]+)"')
+
+
+def normalize_query(query):
+    """
+    Collapses whitespace so the same query written with different indentation shares a cache entry.
+    """
+    return ' '.join(query.split())
+
+
+def tables_of_query(query):
+    return set(table_pattern.findall(query))
+
+
+def estimate_size(value):
+    """
+    Rough deep size in bytes of a query result (nested lists/tuples of scalars).
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache of datalake query results, bounded by an estimated memory budget,
+    with a per-table time to live.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, table_ttls=None, default_ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.table_ttls = table_ttls if table_ttls is not None else TABLE_TTLS
+        self.default_ttl = default_ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (result, expires_at, size)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __repr__(self):
+        return f"QueryCache object with {len(self._entries)} entries"
+
+    def ttl_of(self, query):
+        tables = tables_of_query(query)
+        if not tables:
+            return self.default_ttl
+        return min(self.table_ttls.get(table, self.default_ttl) for table in tables)
+
+    def get(self, key):
+        """
+        :return (True, result) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            result, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, result
+
+    def put(self, key, result, ttl):
+        if ttl <= 0:
+            return
+        size = estimate_size(result) + estimate_size(key)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (result, time.monotonic() + ttl, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class UncachedDatalake:
+    """
+    Wraps a datalake so every query skips the result cache, used by forced refresh traces.
+    Works for AsyncTrinoDatalake too, exec_query then returns the coroutine to await.
+    """
+
+    def __init__(self, datalake):
+        self.datalake = datalake
+
+    def __repr__(self):
+        return f"UncachedDatalake object for: {self.datalake}"
+
+    def __getattr__(self, item):
+        return getattr(self.datalake, item)
+
+    def exec_query(self, query, params=None, bypass_cache=True):
+        return self.datalake.exec_query(query, params, bypass_cache=True)
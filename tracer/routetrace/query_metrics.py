@@ -0,0 +1,327 @@
+"""
+Per query instrumentation of the datalake clients.
+
+Every exec_query and exec_query_stream records the FromDatabase function that issued it, the tables
+it read, elapsed time, rows, bytes, retries and whether the cache answered. Streams are measured from
+execution until they are closed. Records go to the process wide QUERY_METRICS, aggregated per calling
+function into latency histograms, and to the collector of the current trace when one is open (see
+trace_queries), so a slow trace shows which lookups it spent its time on.
+"""
+import bisect
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from tracer.routetrace.query_cache import tables_of_query
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket is unbounded.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds of the queries per trace histogram buckets.
+TRACE_QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Modules whose functions are plumbing, the caller of a query is the first frame outside of them.
+DATALAKE_MODULES = (
+    'tracer.routetrace.trino_connect',
+    'tracer.routetrace.trino_pool',
+    'tracer.routetrace.async_trino',
+    'tracer.routetrace.query_cache',
+    'tracer.routetrace.query_metrics',
+    'tracer.routetrace.snapshot',
+    'tracer.routetrace.result_stream',
+    'tracer.routetrace.retry_policy',
+    'contextlib',
+)
+
+_current_query = contextvars.ContextVar('current_query', default=None)
+_current_trace = contextvars.ContextVar('current_trace_queries', default=None)
+
+
+def calling_function():
+    """
+    :return 'module.function' of the innermost FromDatabase lookup that issued the query, or of the
+    first function outside the datalake modules
+    """
+    frame = sys._getframe(1)
+    lookup = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        name = frame.f_code.co_name
+        if module.endswith(('.FromDatabase', '.FromDatabaseAsync')):
+            if lookup is None and name != 'wrapper':
+                lookup = f"{module.rsplit('.', 1)[-1]}.{name}"
+        elif module not in DATALAKE_MODULES:
+            return lookup or f"{module.rsplit('.', 1)[-1]}.{name}"
+        frame = frame.f_back
+    return lookup or 'unknown'
+
+
+class QueryRecord:
+    __slots__ = ('caller', 'tables', 'backend', 'started', 'elapsed', 'rows', 'bytes', 'retries', 'cache_hit',
+                 'error')
+
+    def __init__(self, caller, tables, backend):
+        self.caller = caller
+        self.tables = tables
+        self.backend = backend
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+        self.cache_hit = False
+        self.error = None
+
+    def __repr__(self):
+        return f"QueryRecord object for: {self.caller} {self.elapsed}"
+
+    def as_dict(self):
+        return {
+            'caller': self.caller,
+            'tables': sorted(self.tables),
+            'backend': self.backend,
+            'elapsed': self.elapsed,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'retries': self.retries,
+            'cache_hit': self.cache_hit,
+            'error': self.error,
+        }
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        :return upper bound of the bucket holding the q quantile, max for the unbounded bucket
+        """
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ('inf',), self.counts)},
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+
+class _CallerStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.queries = 0
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.tables = set()
+
+    def add(self, record):
+        self.queries += 1
+        self.rows += record.rows
+        self.bytes += record.bytes
+        self.retries += record.retries
+        self.cache_hits += record.cache_hit
+        self.errors += record.error is not None
+        self.tables |= record.tables
+        if not record.cache_hit:
+            self.latency.observe(record.elapsed)
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'retries': self.retries,
+            'cache_hits': self.cache_hits,
+            'errors': self.errors,
+            'tables': sorted(self.tables),
+            'latency': self.latency.as_dict(),
+        }
+
+
+class QueryMetrics:
+    """
+    Process wide aggregation of query records, per calling function, plus histograms of the datalake
+    time and query count of whole traces.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callers = {}
+        self.trace_time = Histogram()
+        self.trace_queries = Histogram(buckets=TRACE_QUERY_BUCKETS)
+
+    def record(self, record):
+        with self._lock:
+            stats = self._callers.get(record.caller)
+            if stats is None:
+                stats = self._callers[record.caller] = _CallerStats()
+            stats.add(record)
+
+    def record_trace(self, collector):
+        with self._lock:
+            self.trace_time.observe(collector.datalake_time())
+            self.trace_queries.observe(len(collector.records))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'callers': {caller: stats.as_dict() for caller, stats in self._callers.items()},
+                'trace_datalake_time': self.trace_time.as_dict(),
+                'trace_queries': self.trace_queries.as_dict(),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._callers = {}
+            self.trace_time = Histogram()
+            self.trace_queries = Histogram(buckets=TRACE_QUERY_BUCKETS)
+
+
+QUERY_METRICS = QueryMetrics()
+
+
+class TraceQueries:
+    """
+    Records of the queries one trace ran.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def __repr__(self):
+        return f"TraceQueries object with {len(self.records)} queries"
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def datalake_time(self):
+        return sum(record.elapsed for record in self.records if record.elapsed is not None)
+
+    def summary(self):
+        """
+        :return dict of calling function -> queries, cache hits, retries, rows and total time, slowest first
+        """
+        callers = {}
+        for record in list(self.records):
+            caller = callers.setdefault(record.caller, {'queries': 0, 'cache_hits': 0, 'retries': 0, 'rows': 0,
+                                                        'time': 0.0})
+            caller['queries'] += 1
+            caller['cache_hits'] += record.cache_hit
+            caller['retries'] += record.retries
+            caller['rows'] += record.rows
+            caller['time'] += record.elapsed or 0.0
+
+        return dict(sorted(callers.items(), key=lambda item: item[1]['time'], reverse=True))
+
+
+def current_trace_queries():
+    """
+    :return the TraceQueries collector of the current trace, or None outside of a trace
+    """
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_queries():
+    """
+    Collects the queries of the current trace. Nested scopes share the outer collector, which is
+    added to QUERY_METRICS once the outermost scope ends.
+    """
+    current = _current_trace.get()
+    if current is not None:
+        yield current
+        return
+
+    collector = TraceQueries()
+    token = _current_trace.set(collector)
+    try:
+        yield collector
+    finally:
+        _current_trace.reset(token)
+        QUERY_METRICS.record_trace(collector)
+
+
+def _complete(record, collector):
+    record.elapsed = time.monotonic() - record.started
+    QUERY_METRICS.record(record)
+    if collector is not None:
+        collector.add(record)
+
+
+@contextmanager
+def measure_query(query, backend):
+    """
+    Wraps one exec_query. The body fills rows, bytes and cache_hit on the yielded record, retries are
+    counted by note_retry from inside the retry loop.
+    """
+    record = QueryRecord(calling_function(), tables_of_query(query), backend)
+    token = _current_query.set(record)
+    try:
+        yield record
+    except Exception as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        _current_query.reset(token)
+        _complete(record, _current_trace.get())
+
+
+@contextmanager
+def measure_stream(query, backend):
+    """
+    Wraps executing a streamed query. Unlike measure_query the record stays open after the block, the
+    yielded finish(rows, error=None) completes it once the stream is closed (ResultStream's on_finish),
+    so elapsed covers reading the whole stream. A failure inside the block completes it right away.
+    Bytes aren't estimated for streams, sizing every batch would cost more than the streaming saves.
+    """
+    record = QueryRecord(calling_function(), tables_of_query(query), backend)
+    collector = _current_trace.get()
+    token = _current_query.set(record)
+
+    def finish(rows, error=None):
+        record.rows = rows
+        record.error = error
+        _complete(record, collector)
+
+    try:
+        yield finish
+    except Exception as e:
+        record.error = type(e).__name__
+        _complete(record, collector)
+        raise
+    finally:
+        _current_query.reset(token)
+
+
+def note_retry():
+    record = _current_query.get()
+    if record is not None:
+        record.retries += 1
@@ -0,0 +1,107 @@
+class ResultStream:
+    """
+    Rows of a running query, fetched from the cursor batch_size rows at a time instead of all at once.
+    Iterating yields rows, batches() yields lists of rows or column tuples. Closing the stream before
+    the last row, or leaving its with block, cancels the rest of the query.
+    """
+
+    def __init__(self, cursor, columns, first_batch=None, batch_size=1000, on_close=None, on_finish=None):
+        """
+        :param cursor: dbapi cursor the query was executed on
+        :param columns: column names of the result
+        :param first_batch: rows already fetched while executing the query
+        :param on_close: called once the stream is closed with the exception that failed fetching or
+        cancelling it, None when it didn't fail
+        :param on_finish: called with (rows fetched, error name or None) once the stream is closed, the
+        finish callable of measure_stream
+        """
+        self.cursor = cursor
+        self.columns = columns
+        self.batch_size = batch_size
+        self.on_close = on_close
+        self.on_finish = on_finish
+
+        self._pending = first_batch
+        self.rows_fetched = 0
+        self.exhausted = False
+        self.failed = False
+        self.error = None
+        self.exception = None
+        self.closed = False
+
+    def __repr__(self):
+        return f"ResultStream object with {self.rows_fetched} rows fetched"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self.rows()
+
+    def _fetch(self):
+        if self._pending is not None:
+            batch, self._pending = self._pending, None
+        else:
+            try:
+                batch = self.cursor.fetchmany(self.batch_size)
+            except Exception as e:
+                self.failed = True
+                self.exception = e
+                self.error = type(e).__name__
+                raise
+        if not batch:
+            self.exhausted = True
+        self.rows_fetched += len(batch)
+        return batch
+
+    def batches(self, columnar=False):
+        """
+        :param columnar: yield every batch as one tuple per column instead of a list of rows
+        """
+        try:
+            while not self.closed:
+                batch = self._fetch()
+                if not batch:
+                    break
+                yield list(zip(*batch)) if columnar else batch
+        finally:
+            self.close()
+
+    def rows(self):
+        for batch in self.batches():
+            yield from batch
+
+    def first(self):
+        """
+        :return the first row, or None if there are none. The rest of the query is cancelled.
+        """
+        try:
+            batch = self._fetch()
+            return batch[0] if batch else None
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        if not self.exhausted and not self.failed:
+            cancel = getattr(self.cursor, 'cancel', None)
+            if cancel is not None:
+                try:
+                    cancel()
+                except Exception as e:
+                    print(f"Error cancelling query: {e}")
+                    self.failed = True
+                    self.exception = e
+
+        try:
+            if self.on_close is not None:
+                self.on_close(self.exception)
+        finally:
+            if self.on_finish is not None:
+                self.on_finish(self.rows_fetched, self.error)
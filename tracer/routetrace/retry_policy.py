@@ -0,0 +1,261 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from tracer.routetrace.query_metrics import note_retry
+
+_trace_deadline = contextvars.ContextVar('trace_deadline', default=None)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, message="The datalake is marked unhealthy, failing fast until the circuit breaker resets."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, message="The trace ran out of time budget for datalake retries."):
+        self.message = message
+        super().__init__(self.message)
+
+
+@contextmanager
+def trace_deadline(seconds):
+    """
+    Sets the time budget of the current trace. Nested scopes can only shorten the budget.
+    asyncio.to_thread copies the context, so the budget follows a trace into its worker thread.
+    """
+    if seconds is None:
+        yield
+        return
+
+    deadline = time.monotonic() + seconds
+    current = _trace_deadline.get()
+    if current is not None and current < deadline:
+        deadline = current
+
+    token = _trace_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _trace_deadline.reset(token)
+
+
+def remaining_time():
+    """
+    :return seconds left for the current trace, or None when no deadline is set
+    """
+    deadline = _trace_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        :param failure_threshold: consecutive failed attempts that open the circuit
+        :param reset_timeout: seconds the circuit stays open before a single trial call is let through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    def __repr__(self):
+        return f"CircuitBreaker object in state: {self.state}"
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+
+class RetryPolicy:
+    """
+    Retries transient failures with exponential backoff and jitter, within the budget of the current
+    trace, and fails fast through the circuit breaker while the backend is unhealthy.
+    """
+
+    def __init__(self, retry_on=(Exception,), max_attempts=4, base_delay=0.5, max_delay=8, jitter=0.5, breaker=None):
+        """
+        :param retry_on: exception types considered transient, anything else is raised immediately
+        :param max_attempts: attempts per call, including the first one
+        :param base_delay: delay before the first retry, doubled on every further retry
+        :param max_delay: upper bound of a single delay
+        :param jitter: fraction of the delay that is randomized, spreading out retries of concurrent traces
+        :param breaker: CircuitBreaker shared by every call of this policy
+        """
+        self.retry_on = retry_on
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.breaker = breaker
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'failures': 0,
+            'retries': 0,
+            'sleep_time': 0.0,
+            'deadline_exceeded': 0,
+            'rejected': 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def delay(self, retry):
+        delay = min(self.max_delay, self.base_delay * (2 ** retry))
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, func, *args, on_retry=None, **kwargs):
+        """
+        Calls func until it succeeds, raises a non transient error, or runs out of attempts or time.
+        :param on_retry: called with (error, retry_number) before every retry
+        """
+        self._count('calls')
+        if self.breaker and not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError()
+
+        retry = 0
+        while True:
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded()
+
+            try:
+                result = func(*args, **kwargs)
+            except self.retry_on as e:
+                if self.breaker:
+                    self.breaker.record_failure()
+
+                delay = self.delay(retry)
+                remaining = remaining_time()
+                out_of_time = remaining is not None and remaining < delay
+                breaker_open = self.breaker is not None and self.breaker.state == CircuitBreaker.OPEN
+
+                if retry + 1 >= self.max_attempts or out_of_time or breaker_open:
+                    self._count('failures')
+                    if out_of_time:
+                        self._count('deadline_exceeded')
+                        raise DeadlineExceeded() from e
+                    raise
+
+                if on_retry:
+                    on_retry(e, retry + 1)
+                self._count('retries')
+                note_retry()
+                self._count('sleep_time', delay)
+                time.sleep(delay)
+                retry += 1
+                continue
+            except Exception:
+                # Non transient errors mean the backend answered, so they don't count against its health.
+                if self.breaker:
+                    self.breaker.record_success()
+                self._count('failures')
+                raise
+
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+
+    async def call_async(self, func, *args, on_retry=None, **kwargs):
+        """
+        Awaitable counterpart of call, for coroutine functions. Delays don't block the event loop.
+        """
+        self._count('calls')
+        if self.breaker and not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError()
+
+        retry = 0
+        while True:
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded()
+
+            try:
+                result = await func(*args, **kwargs)
+            except self.retry_on as e:
+                if self.breaker:
+                    self.breaker.record_failure()
+
+                delay = self.delay(retry)
+                remaining = remaining_time()
+                out_of_time = remaining is not None and remaining < delay
+                breaker_open = self.breaker is not None and self.breaker.state == CircuitBreaker.OPEN
+
+                if retry + 1 >= self.max_attempts or out_of_time or breaker_open:
+                    self._count('failures')
+                    if out_of_time:
+                        self._count('deadline_exceeded')
+                        raise DeadlineExceeded() from e
+                    raise
+
+                if on_retry:
+                    on_retry(e, retry + 1)
+                self._count('retries')
+                note_retry()
+                self._count('sleep_time', delay)
+                await asyncio.sleep(delay)
+                retry += 1
+                continue
+            except Exception:
+                if self.breaker:
+                    self.breaker.record_success()
+                self._count('failures')
+                raise
+
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        if self.breaker:
+            stats['breaker_state'] = self.breaker.state
+            stats['breaker_opened'] = self.breaker.times_opened
+        return stats
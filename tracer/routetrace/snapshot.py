@@ -0,0 +1,233 @@
+"""
+Local snapshot of the slowly changing crawler tables, stored in a DuckDB file.
+
+export_snapshot pulls the newest row of every key of SNAPSHOT_TABLES out of trino into a columnar
+DuckDB file, under the same `network."<table>"` names. SnapshotDatalake then answers the exact same
+FromDatabase queries from that memory-mapped file, so hop lookups stay local and traces keep working
+while trino is unavailable.
+
+    python -m tracer.routetrace.snapshot [path]
+"""
+import os
+import sys
+import threading
+from datetime import datetime, date
+
+import duckdb
+
+from tracer.routetrace import queries
+from tracer.routetrace.query_cache import tables_of_query, estimate_size
+from tracer.routetrace.query_metrics import measure_query, measure_stream
+from tracer.routetrace.result_stream import ResultStream
+
+DEFAULT_SNAPSHOT_PATH = 'datalake_snapshot.duckdb'
+
+# Table -> columns identifying one entity, only the newest row of every entity is exported.
+SNAPSHOT_TABLES = {
+    'crawler-arp-table': ['device_ip', 'ip', 'vrf'],
+    'crawler-cdp-lldp': ['local_device_id', 'local_int'],
+    'crawler-device-interface-inventory': ['device_id', 'int_ip'],
+    'crawler-device-portchannels': ['device_id', 'pointerface', 'phyinterface'],
+    'crawler-interface-config': ['device_id', 'interface'],
+    'crawler-devices': ['device_id'],
+}
+
+# Table -> column sets FromDatabase filters on, each one gets an index in the snapshot.
+SNAPSHOT_INDEXES = {
+    'crawler-arp-table': [['ip'], ['device_ip', 'ip']],
+    'crawler-cdp-lldp': [['local_device_id']],
+    'crawler-device-interface-inventory': [['int_ip']],
+    'crawler-device-portchannels': [['device_id']],
+    'crawler-interface-config': [['device_id']],
+    'crawler-devices': [['ipv4'], ['device_id']],
+}
+
+INSERT_BATCH_SIZE = 10000
+
+
+def _column_type(values):
+    """
+    DuckDB type of a column, inferred from the python values the trino client returned.
+    """
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return 'BOOLEAN'
+        if isinstance(value, int):
+            return 'BIGINT'
+        if isinstance(value, float):
+            return 'DOUBLE'
+        if isinstance(value, datetime):
+            return 'TIMESTAMPTZ' if value.tzinfo else 'TIMESTAMP'
+        if isinstance(value, date):
+            return 'DATE'
+        return 'VARCHAR'
+    return 'VARCHAR'
+
+
+def _create_table(connection, table_name, columns, rows):
+    # Types are inferred from the first batch only, later batches are cast to them by duckdb.
+    types = [_column_type(row[index] for row in rows) for index in range(len(columns))]
+    definition = ', '.join(f'"{column}" {column_type}' for column, column_type in zip(columns, types))
+    connection.execute(f'create table {queries.table(table_name)} ({definition})')
+
+
+def _export_table(connection, datalake, table_name, key_columns):
+    exported = 0
+    created = False
+
+    with datalake.exec_query_stream(*queries.latest_rows_per_key(table_name, ['*'], key_columns, []),
+                                    batch_size=INSERT_BATCH_SIZE) as stream:
+        rank_index = stream.columns.index('row_rank')
+        columns = stream.columns[:rank_index] + stream.columns[rank_index + 1:]
+        placeholders = ', '.join('?' for _ in columns)
+
+        for batch in stream.batches():
+            rows = [row[:rank_index] + row[rank_index + 1:] for row in batch]
+            if not created:
+                _create_table(connection, table_name, columns, rows)
+                created = True
+            connection.executemany(f'insert into {queries.table(table_name)} values ({placeholders})', rows)
+            exported += len(rows)
+
+    if not created:
+        _create_table(connection, table_name, columns, [])
+
+    for index_columns in SNAPSHOT_INDEXES.get(table_name, []):
+        if all(column in columns for column in index_columns):
+            name = f"idx_{table_name}_{'_'.join(index_columns)}".replace('-', '_')
+            connection.execute(f'create index {name} on {queries.table(table_name)} '
+                               f"({', '.join(index_columns)})")
+
+    return exported
+
+
+def export_snapshot(datalake, path=DEFAULT_SNAPSHOT_PATH, tables=None):
+    """
+    Writes a new snapshot next to path and swaps it in atomically, so readers never see a partial file.
+    :param datalake: trino backed datalake to export from
+    :return dict of table -> exported rows
+    """
+    tables = tables or SNAPSHOT_TABLES
+    temporary_path = f'{path}.tmp'
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    exported = {}
+    connection = duckdb.connect(temporary_path)
+    try:
+        connection.execute(f'create schema {queries.SCHEMA}')
+        connection.execute('create table snapshot_meta (table_name VARCHAR, row_count BIGINT, exported_at TIMESTAMP)')
+        for table_name, key_columns in tables.items():
+            print({'option': 'title', 'message': f'exporting {table_name}...'})
+            exported[table_name] = _export_table(connection, datalake, table_name, key_columns)
+            connection.execute('insert into snapshot_meta values (?, ?, ?)',
+                               [table_name, exported[table_name], datetime.now()])
+        connection.execute('checkpoint')
+    finally:
+        connection.close()
+
+    os.replace(temporary_path, path)
+    return exported
+
+
+class SnapshotDatalake:
+    """
+    Drop-in datalake answering FromDatabase queries from a snapshot file, e.g. Tracer(datalake=SnapshotDatalake()).
+    Queries reading tables the snapshot doesn't hold, and forced refresh queries, go to the fallback datalake.
+    """
+
+    class SnapshotMissError(Exception):
+        def __init__(self, message="The requested table isn't part of the datalake snapshot."):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, fallback=None):
+        self.path = path
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._open()
+
+    def __repr__(self):
+        return f"SnapshotDatalake object for: {self.path}"
+
+    def _open(self):
+        connection = duckdb.connect(self.path, read_only=True)
+        tables = {name for (name,) in connection.execute(
+            'select table_name from information_schema.tables where table_schema = ?', [queries.SCHEMA]).fetchall()}
+
+        with self._lock:
+            self._connection = connection
+            self._local = threading.local()
+            self.tables = tables
+
+    def _cursor(self):
+        # DuckDB connections aren't shared between threads, every thread gets its own cursor.
+        local = self._local
+        if getattr(local, 'cursor', None) is None:
+            with self._lock:
+                local.cursor = self._connection.cursor()
+        return local.cursor
+
+    def execute_query(self, query, params=None):
+        cursor = self._cursor()
+        cursor.execute(query, params or [])
+        rows = [list(row) for row in cursor.fetchall()]
+        return rows, [column[0] for column in cursor.description]
+
+    def exec_query(self, query, params=None, bypass_cache=False):
+        missing = tables_of_query(query) - self.tables
+        if missing or (bypass_cache and self.fallback is not None):
+            if self.fallback is None:
+                raise self.SnapshotMissError(f"Tables missing from the snapshot: {', '.join(sorted(missing))}")
+            return self.fallback.exec_query(query, params, bypass_cache=bypass_cache)
+
+        with measure_query(query, 'snapshot') as record:
+            result = self.execute_query(query, params)
+            record.rows = len(result[0])
+            record.bytes = estimate_size(result)
+        return result
+
+    def exec_query_stream(self, query, params=None, batch_size=1000):
+        missing = tables_of_query(query) - self.tables
+        if missing:
+            if self.fallback is None:
+                raise self.SnapshotMissError(f"Tables missing from the snapshot: {', '.join(sorted(missing))}")
+            return self.fallback.exec_query_stream(query, params, batch_size=batch_size)
+
+        # A cursor of its own, the thread's cursor stays free for lookups while the stream is read.
+        with self._lock:
+            cursor = self._connection.cursor()
+        try:
+            with measure_stream(query, 'snapshot') as finish:
+                cursor.execute(query, params or [])
+        except Exception:
+            cursor.close()
+            raise
+        return ResultStream(cursor, [column[0] for column in cursor.description], batch_size=batch_size,
+                            on_close=lambda error: cursor.close(), on_finish=finish)
+
+    def exec_query_first(self, query, params=None):
+        return self.exec_query_stream(query, params, batch_size=1).first()
+
+    def exported_at(self):
+        rows, _ = self.execute_query('select table_name, row_count, exported_at from snapshot_meta')
+        return {table_name: (row_count, exported_at) for table_name, row_count, exported_at in rows}
+
+    def reload(self):
+        """
+        Opens the newest snapshot file, after export_snapshot replaced it. The previous connection
+        isn't closed here, queries still running on it finish and it is released with its last cursor.
+        """
+        self._open()
+
+    def close(self):
+        self._connection.close()
+
+
+if __name__ == '__main__':
+    from tracer.routetrace.FromDatabase import create_connection_instance
+
+    snapshot_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SNAPSHOT_PATH
+    print(export_snapshot(create_connection_instance(), snapshot_path))
@@ -0,0 +1,212 @@
+import hashlib
+import threading
+import time
+
+
+class SSHTransportPool:
+    """
+    Process wide pool of authenticated SSH clients, keyed by (host, port, user, password hash), so consecutive
+    hops and concurrent traces going through the same routers reuse a transport instead of handshaking again.
+
+    A checked-out client is used by one Session at a time. Idle clients get SSH keepalives and are closed
+    after idle_timeout seconds, at most max_per_host clients are open for one key. Over all keys of a
+    device, the DeviceScheduler the pool is registered with evicts idle clients over its per device cap.
+    """
+
+    class PoolTimeoutError(Exception):
+        def __init__(self, message="Timed out waiting for a free SSH session to the device."):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(self, max_per_host=3, idle_timeout=300, keepalive_interval=30, checkout_timeout=60):
+        """
+        :param max_per_host: upper limit of open clients for one key
+        :param idle_timeout: seconds an idle client is kept open
+        :param keepalive_interval: seconds between two SSH keepalives on a transport
+        :param checkout_timeout: seconds to wait for a client when max_per_host are in use
+        """
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.checkout_timeout = checkout_timeout
+
+        self._lock = threading.Condition()
+        self._idle = {}  # key -> [(client, last_used)]
+        self._open = {}  # key -> open clients, idle and checked out
+        self._keys = {}  # id(client) -> key
+
+        self._stats = {
+            'checkouts': 0,
+            'reused': 0,
+            'created': 0,
+            'discarded': 0,
+            'expired': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'evicted': 0,
+        }
+
+    def __repr__(self):
+        return f"SSHTransportPool object with {sum(self._open.values())} open sessions"
+
+    @staticmethod
+    def key(hostname, port, username, password):
+        return hostname, port, username, hashlib.sha256((password or '').encode()).hexdigest()
+
+    @staticmethod
+    def _is_alive(client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _keep_alive(self, client):
+        transport = client.get_transport()
+        if transport is not None:
+            transport.set_keepalive(self.keepalive_interval)
+
+    def _close(self, client):
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Error closing SSH session: {e}")
+
+    def _expired_clients(self):
+        # Called with the lock held, returns the clients to close once it is released.
+        now = time.monotonic()
+        expired = []
+        for key, idle in self._idle.items():
+            keep = []
+            for client, last_used in idle:
+                if now - last_used >= self.idle_timeout:
+                    expired.append(client)
+                    self._forget(key, client)
+                    self._stats['expired'] += 1
+                else:
+                    keep.append((client, last_used))
+            idle[:] = keep
+        return expired
+
+    def _forget(self, key, client):
+        self._open[key] -= 1
+        self._keys.pop(id(client), None)
+        self._lock.notify_all()
+
+    def checkout(self, key, connect):
+        """
+        :param key: SSHTransportPool.key of the device and credentials
+        :param connect: callable returning a new connected client, called outside the lock
+        :return paramiko.SSHClient reserved for the caller until checkin
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+
+        while True:
+            with self._lock:
+                to_close = self._expired_clients()
+                candidate = None
+                create = False
+
+                idle = self._idle.get(key)
+                if idle:
+                    candidate = idle.pop()[0]
+                elif self._open.get(key, 0) < self.max_per_host:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise self.PoolTimeoutError()
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._lock.wait(remaining)
+
+            for client in to_close:
+                self._close(client)
+
+            if candidate is not None:
+                if self._is_alive(candidate):
+                    with self._lock:
+                        self._stats['checkouts'] += 1
+                        self._stats['reused'] += 1
+                    return candidate
+                self.discard(candidate)
+                continue
+
+            if create:
+                try:
+                    client = connect()
+                except Exception:
+                    with self._lock:
+                        self._open[key] -= 1
+                        self._lock.notify_all()
+                    raise
+                self._keep_alive(client)
+                with self._lock:
+                    self._keys[id(client)] = key
+                    self._stats['checkouts'] += 1
+                    self._stats['created'] += 1
+                return client
+
+    def checkin(self, client, broken=False):
+        """
+        Returns a client to the pool, broken or dead clients are closed instead.
+        """
+        with self._lock:
+            key = self._keys.get(id(client))
+        if key is None:
+            self._close(client)
+            return
+        if broken or not self._is_alive(client):
+            self.discard(client)
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append((client, time.monotonic()))
+            self._lock.notify_all()
+
+    def discard(self, client):
+        with self._lock:
+            key = self._keys.get(id(client))
+            if key is not None:
+                self._forget(key, client)
+                self._stats['discarded'] += 1
+        self._close(client)
+
+    def idle_count(self, hostname):
+        with self._lock:
+            return sum(len(idle) for key, idle in self._idle.items() if key[0] == hostname)
+
+    def evict_idle(self, hostname, count):
+        """
+        Closes up to count idle clients to hostname, whatever their credentials, least recently used first.
+        :return number of clients closed
+        """
+        with self._lock:
+            candidates = sorted(((last_used, key, client) for key, idle in self._idle.items() if key[0] == hostname
+                                 for client, last_used in idle), key=lambda candidate: candidate[0])[:count]
+            for _, key, client in candidates:
+                self._idle[key] = [(idle_client, last_used) for idle_client, last_used in self._idle[key]
+                                   if idle_client is not client]
+                self._forget(key, client)
+                self._stats['evicted'] += 1
+        for _, _, client in candidates:
+            self._close(client)
+        return len(candidates)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = sum(self._open.values())
+            stats['idle'] = sum(len(idle) for idle in self._idle.values())
+            stats['hosts'] = len([key for key, count in self._open.items() if count])
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle = [client for clients in self._idle.values() for client, _ in clients]
+            self._idle = {}
+        for client in idle:
+            self.discard(client)
+
+
+SSH_POOL = SSHTransportPool()
@@ -0,0 +1,201 @@
+import ipaddress
+import sys
+import threading
+import time
+
+from tracer.routetrace import queries
+from tracer.routetrace.device_ids import canonical_device_id, canonical_interface
+
+
+def _ip_to_int(ip):
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except (ipaddress.AddressValueError, ValueError, TypeError):
+        return None
+
+
+def _int_to_ip(value):
+    return str(ipaddress.IPv4Address(value)) if value is not None else None
+
+
+class _Topology:
+    """
+    One immutable build of the topology. Device ids are interned into a list and referenced by index,
+    IPs are stored as integers, so the index stays compact for the whole network.
+    """
+
+    def __init__(self):
+        self.device_names = []  # index -> device_id as found in the crawler tables
+        self.device_indexes = {}  # canonical device id -> index
+        self.adjacency = {}  # (device index, canonical interface) -> (remote ipv4 int, remote device index)
+        self.interface_ips = {}  # interface ip int -> (management ipv4 int, device index)
+        self.port_channels = {}  # (device index, canonical interface) -> first physical member
+
+    def device_index(self, device_id):
+        key = canonical_device_id(device_id)
+        if key is None:
+            return None
+        index = self.device_indexes.get(key)
+        if index is None:
+            index = len(self.device_names)
+            self.device_names.append(sys.intern(device_id))
+            self.device_indexes[key] = index
+        return index
+
+    def device_name(self, index):
+        return self.device_names[index] if index is not None else None
+
+
+class TopologyIndex:
+    """
+    In-memory index of the network topology, built from the CDP/LLDP, interface inventory and
+    port-channel crawler tables, and rebuilt periodically in the background.
+    Lookups return None on a miss, the tracer then falls back to trino or the device.
+    """
+
+    def __init__(self, datalake, refresh_interval=900):
+        """
+        :param datalake: datalake the tables are loaded from
+        :param refresh_interval: seconds between two background rebuilds
+        """
+        self.datalake = datalake
+        self.refresh_interval = refresh_interval
+
+        self._topology = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.built_at = None
+        self.build_time = None
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"TopologyIndex object built at: {self.built_at}"
+
+    def _load(self, table_name, columns, key_columns):
+        # Streamed, so the rows are indexed batch by batch instead of the whole table sitting in memory.
+        query, params = queries.latest_rows_per_key(table_name, columns, key_columns, [])
+        with self.datalake.exec_query_stream(query, params) as stream:
+            yield from stream
+
+    def refresh(self):
+        """
+        Builds a new topology from the datalake and swaps it in, lookups keep using the previous one meanwhile.
+        """
+        start = time.monotonic()
+        topology = _Topology()
+
+        for local_device_id, local_int, remote_ipv4, remote_device_id in self._load(
+                'crawler-cdp-lldp', ['local_device_id', 'local_int', 'remote_ipv4', 'remote_device_id'],
+                ['local_device_id', 'local_int']):
+            local_index = topology.device_index(local_device_id)
+            if local_index is None or not local_int:
+                continue
+            topology.adjacency[(local_index, canonical_interface(local_int))] = (
+                _ip_to_int(remote_ipv4), topology.device_index(remote_device_id))
+
+        for int_ip, ipv4, device_id in self._load(
+                'crawler-device-interface-inventory', ['int_ip', 'ipv4', 'device_id'], ['int_ip']):
+            int_ip = _ip_to_int(int_ip)
+            if int_ip is None:
+                continue
+            topology.interface_ips[int_ip] = (_ip_to_int(ipv4), topology.device_index(device_id))
+
+        for device_id, pointerface, phyinterface in self._load(
+                'crawler-device-portchannels', ['device_id', 'pointerface', 'phyinterface'],
+                ['device_id', 'pointerface']):
+            device_index = topology.device_index(device_id)
+            if device_index is None or not pointerface:
+                continue
+            topology.port_channels[(device_index, canonical_interface(pointerface))] = sys.intern(phyinterface)
+
+        self._topology = topology
+        self.built_at = time.time()
+        self.build_time = time.monotonic() - start
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Topology index refresh failed: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """
+        Builds the index in a background thread and keeps rebuilding it every refresh_interval seconds.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='topology-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _count(self, found):
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    def next_hop_cdp(self, device_id, interface):
+        """
+        :return (remote_ipv4, remote_device_id) of the CDP/LLDP neighbor on the interface, or None
+        """
+        topology = self._topology
+        if topology is None:
+            return self._count(None)
+
+        device_index = topology.device_indexes.get(canonical_device_id(device_id))
+        neighbor = topology.adjacency.get((device_index, canonical_interface(interface)))
+        if neighbor is None or neighbor[0] is None:
+            return self._count(None)
+
+        remote_ipv4, remote_device_index = neighbor
+        return self._count((_int_to_ip(remote_ipv4), topology.device_name(remote_device_index)))
+
+    def nihul_ip_by_int_ip(self, int_ip):
+        """
+        :return (management ipv4, device_id) of the device owning the interface ip, or None
+        """
+        topology = self._topology
+        if topology is None:
+            return self._count(None)
+
+        device = topology.interface_ips.get(_ip_to_int(int_ip))
+        if device is None or device[0] is None:
+            return self._count(None)
+
+        ipv4, device_index = device
+        return self._count((_int_to_ip(ipv4), topology.device_name(device_index)))
+
+    def first_int_in_port_channel(self, device_id, interface):
+        """
+        :return the physical interface of a port-channel, the interface itself if it isn't one, or None
+        """
+        if not interface.lower().startswith('po'):
+            return interface
+
+        topology = self._topology
+        if topology is None:
+            return self._count(None)
+
+        device_index = topology.device_indexes.get(canonical_device_id(device_id))
+        return self._count(topology.port_channels.get((device_index, canonical_interface(interface))))
+
+    def stats(self):
+        topology = self._topology
+        return {
+            'built_at': self.built_at,
+            'build_time': self.build_time,
+            'devices': len(topology.device_names) if topology else 0,
+            'adjacencies': len(topology.adjacency) if topology else 0,
+            'interface_ips': len(topology.interface_ips) if topology else 0,
+            'port_channels': len(topology.port_channels) if topology else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -1,28 +1,143 @@
+from functools import wraps
+
 from Tufin.Tufin import SecureTrackAPI
 from tracer.routetrace.command_result_parser import TrafficEngSuspicion
 from tracer.routetrace.models import MacTraceHop, RouteTraceHop
 from tracer.routetrace import FromDatabase
 from tracer.routetrace import FromDevices
 from tracer.routetrace import converter
+from tracer.routetrace.query_cache import UncachedDatalake
+from tracer.routetrace.retry_policy import trace_deadline
+from tracer.routetrace.query_metrics import trace_queries, current_trace_queries
+from tracer.routetrace.command_cache import bypass_command_cache
+from tracer.routetrace.device_fingerprints import FINGERPRINTS
+from tracer.routetrace.device_scheduler import device_owner
+
+TRACE_DEADLINE = 300
+
+
+def trace_scope(method):
+    """
+    Runs a Tracer entry point inside the time budget of the trace, and collects the datalake queries it runs.
+    Forced refresh traces skip cached device outputs, device sessions are queued for the user of the trace.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        outermost = current_trace_queries() is None
+        with trace_deadline(self.deadline), trace_queries() as queries, bypass_command_cache(self.refresh), \
+                device_owner(self.username):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if outermost:
+                    self.query_summary = queries.summary()
+                    self.log(f"Datalake: {len(queries.records)} queries in {queries.datalake_time():.2f}s")
+
+    return wrapper
 
 
 class Tracer:
-    def __init__(self, log, username, password, datalake=None, tufin=None):
+    def __init__(self, log, username, password, datalake=None, tufin=None, refresh=False, deadline=TRACE_DEADLINE, topology=None, endpoint_index=None, device_ids=None, prefetcher=None):
         self.log = log
         self.username = username
         self.password = password
+        self.refresh = refresh
+        self.deadline = deadline
         self.datalake = datalake or FromDatabase.create_connection_instance()
+        if refresh and not isinstance(self.datalake, UncachedDatalake):
+            self.datalake = UncachedDatalake(self.datalake)
         self.tufin = tufin or SecureTrackAPI()
-
+        self.topology = topology
+        self.endpoint_index = endpoint_index
+        self.device_ids = device_ids
+        self.prefetcher = prefetcher
+        self.query_summary = {}
+
+    def prefetch(self, ip):
+        """
+        Starts logging in to a device the trace is about to visit, in the background.
+        """
+        if self.prefetcher:
+            with device_owner(self.username):
+                self.prefetcher.prefetch(ip, self.username, self.password)
+
+    def wait_for_prefetch(self, ip):
+        if self.prefetcher:
+            self.prefetcher.wait(ip, self.username)
+
+    def prefetch_learned_next_hop(self, ip, vrf, destination_network):
+        if self.prefetcher:
+            with device_owner(self.username):
+                self.prefetcher.prefetch_route(ip, vrf, destination_network, self.username, self.password)
+
+    def prefetch_route_next_hop(self, nexthop_int_ip):
+        """
+        Prefetches the next hop the route lookup of the current hop returned, while the hop's session is
+        still being closed and the next hop resolved. Resolved from the topology index only, the datalake
+        resolution runs right after anyway.
+        """
+        if not self.prefetcher or not self.topology or not nexthop_int_ip or nexthop_int_ip == 'end':
+            return
+        nexthop = self.topology.nihul_ip_by_int_ip(nexthop_int_ip)
+        if nexthop:
+            self.prefetch(nexthop[0])
+
+    def prefetch_cdp_neighbor(self, id_, interface):
+        # Predicted from the topology index only, a datalake lookup would cost more than it saves.
+        if not self.prefetcher or not self.topology or not interface:
+            return
+        neighbor = self.topology.next_hop_cdp(id_, interface)
+        nexthop = self.topology.nihul_ip_by_int_ip(neighbor[0]) if neighbor else None
+        if nexthop:
+            self.prefetch(nexthop[0])
+
+    def get_default_gateway(self, endpoint_ip):
+        if self.endpoint_index:
+            default_gateway = self.endpoint_index.get_default_gateway(endpoint_ip)
+            if default_gateway:
+                return default_gateway
+        return FromDatabase.get_default_gateway(self.datalake, endpoint_ip)
+
+    def get_next_hop_id_mac_by_arp_ip(self, from_ip, endpoint_ip):
+        if self.endpoint_index:
+            arp_entry = self.endpoint_index.get_next_hop_id_mac_by_arp_ip(from_ip, endpoint_ip)
+            if arp_entry:
+                return arp_entry
+        return FromDatabase.get_next_hop_id_mac_by_arp_ip(self.datalake, from_ip, endpoint_ip)
+
+    def get_nihul_ip_by_int_ip(self, nexthop_int_ip):
+        if self.topology:
+            nexthop = self.topology.nihul_ip_by_int_ip(nexthop_int_ip)
+            if nexthop:
+                return nexthop
+        return FromDatabase.get_nihul_ip_by_int_ip(self.datalake, nexthop_int_ip)
+
+    def get_first_int_if_portchannel(self, id_, interface):
+        if self.topology:
+            physical_interface = self.topology.first_int_in_port_channel(id_, interface)
+            if physical_interface:
+                return physical_interface
+        return FromDatabase.get_first_int_if_portchannel(self.datalake, id_, interface)
+
+    def get_next_hop_ip_cdp(self, device, id_, next_hop_interface):
+        if self.topology:
+            neighbor = self.topology.next_hop_cdp(id_, next_hop_interface)
+            if neighbor:
+                return neighbor
+        return FromDevices.get_next_hop_ip_cdp(device, next_hop_interface)
+
+    @trace_scope
     def find_route(self, source_ip, destination_ip):
         FromDevices.dev_user = self.username
         FromDevices.dev_pass = self.password
 
-        source_dg_ip, hostname = FromDatabase.get_default_gateway(self.datalake, endpoint_ip=source_ip)
-        destination_dg_ip, hostname = FromDatabase.get_default_gateway(self.datalake, endpoint_ip=destination_ip)
+        source_dg_ip, hostname = self.get_default_gateway(endpoint_ip=source_ip)
+        destination_dg_ip, hostname = self.get_default_gateway(endpoint_ip=destination_ip)
 
         if not source_dg_ip:
             return []
+        self.prefetch(source_dg_ip)
+        self.prefetch(destination_dg_ip)
 
         if not destination_dg_ip:
             destination_dg_ip = ".".join(destination_ip.split('.')[:-1])
@@ -40,11 +155,12 @@ class Tracer:
 
         return final_route
 
+    @trace_scope
     def find_route_wan_to_lan(self, source_ip, source_vrf, destination_ip):
         FromDevices.dev_user = self.username
         FromDevices.dev_pass = self.password
 
-        destination_dg_ip, hostname = FromDatabase.get_default_gateway(self.datalake, endpoint_ip=destination_ip)
+        destination_dg_ip, hostname = self.get_default_gateway(endpoint_ip=destination_ip)
         dg_to_dg_trace = self.find_wan_route_dg_to_dg(source_ip, destination_ip, source_vrf, destination_dg_ip, hostname)
         dg_to_destination_trace, dest_vrf = self.find_lan_route_to_endpoint(destination_ip, destination_dg_ip)
 
@@ -62,6 +178,7 @@ class Tracer:
 
         return cleaned_route
 
+    @trace_scope
     def find_wan_route_dg_to_dg(self, source_ip, source_dg, destination_network, vrf, destination_dg_ip, hostname):
         FromDevices.dev_user = self.username
         FromDevices.dev_pass = self.password
@@ -91,38 +208,48 @@ class Tracer:
             if len(route) > 3 and ip == route[-3].ip and ip == route[-5]:
                 return True
 
-            hop = FromDevices.create_device(ip, connect=False)
-
             passed_firewall = False
-            try:
+            hop_vrf = vrf
+            self.prefetch_learned_next_hop(ip, vrf, destination_network)
+            self.wait_for_prefetch(ip)
+            # Leaving the block hands the transport back to the SSH pool, before recursing to the next hop.
+            with FromDevices.create_device(ip, connect=False) as hop:
+                known_firewall = FINGERPRINTS.platform(ip) == 'checkpoint'
                 try:
+                    if known_firewall:
+                        raise FromDevices.WrongDeviceTypeSuspicion
+                    try:
+                        hop.connect()
+                    except Exception as e:
+                        raise FromDevices.WrongDeviceTypeSuspicion
+
+                    if mpls_label:
+                        nexthop_int_ip, mpls_label = FromDevices.get_mpls_next_hop_ip(hop, mpls_label)
+                    else:
+                        nexthop_int_ip, mpls_label = FromDevices.get_route_information(hop, vrf, source_ip, destination_network)
+                except FromDevices.WrongDeviceTypeSuspicion:
+                    try:
+                        nexthop_int_ip = FromDevices.get_route_and_new_vrf_from_firewall(hop, destination_network)
+                        passed_firewall = True
+                        route[-1].type = 'firewall'
+                    except Exception as e:
+                        print(str(e))
+                        if known_firewall:
+                            # Probe the device again on the next trace.
+                            FINGERPRINTS.forget(ip)
+                        return True
+                except FromDevices.SDABorderSuspicion:
                     hop.connect()
-                except Exception as e:
-                    raise FromDevices.WrongDeviceTypeSuspicion
-
-                if mpls_label:
-                    nexthop_int_ip, mpls_label = FromDevices.get_mpls_next_hop_ip(hop, mpls_label)
-                else:
-                    nexthop_int_ip, mpls_label = FromDevices.get_route_information_cef(hop, vrf, destination_network)
-            except FromDevices.WrongDeviceTypeSuspicion:
-                try:
-                    nexthop_int_ip = FromDevices.get_route_and_new_vrf_from_firewall(hop, destination_network)
-                    passed_firewall = True
-                    route[-1].type = 'firewall'
-                except Exception as e:
-                    print(str(e))
-                    return True
-            except FromDevices.SDABorderSuspicion:
-                hop.connect()
-                nexthop_int_ip = FromDevices.get_fe_ip_from_lisp_eid_table(hop, destination_network)
-            except TrafficEngSuspicion:
-                nexthop_int_ip, mpls_label = FromDevices.get_route_information_traffic_eng(hop, vrf, source_ip, destination_network)
+                    nexthop_int_ip = FromDevices.get_fe_ip_from_lisp_eid_table(hop, destination_network)
+                except TrafficEngSuspicion:
+                    nexthop_int_ip, mpls_label = FromDevices.get_route_information_traffic_eng(hop, vrf, source_ip, destination_network)
+                self.prefetch_route_next_hop(nexthop_int_ip)
 
             if nexthop_int_ip == 'end':
                 return True
 
             try:
-                nexthop_ip, nexthop_hostname = FromDatabase.get_nihul_ip_by_int_ip(self.datalake, nexthop_int_ip)
+                nexthop_ip, nexthop_hostname = self.get_nihul_ip_by_int_ip(nexthop_int_ip)
             except FromDatabase.DataBaseError:
                 firewall = self.tufin.get_firewall_with_interface_ip(nexthop_int_ip)
                 if firewall:
@@ -131,9 +258,15 @@ class Tracer:
                 else:
                     nexthop_ip = nexthop_int_ip
 
+            if self.prefetcher:
+                self.prefetch(nexthop_ip)
+                self.prefetcher.learn_route(ip, hop_vrf, destination_network, nexthop_ip)
+
             if passed_firewall or vrf == 'default':
                 try:
-                    vrf = FromDevices.get_int_vrf_by_int_ip(FromDevices.create_device(nexthop_ip), nexthop_int_ip)
+                    self.wait_for_prefetch(nexthop_ip)
+                    with FromDevices.create_device(nexthop_ip) as device:
+                        vrf = FromDevices.get_int_vrf_by_int_ip(device, nexthop_int_ip)
                 except Exception as e:
                     self.log(str(e))
                     return True
@@ -143,11 +276,13 @@ class Tracer:
             self.log(str(e))
             return True
 
+    @trace_scope
     def find_lan_route_to_endpoint(self, endpoint_ip, dg_ip):
         FromDevices.dev_user = self.username
         FromDevices.dev_pass = self.password
+        self.prefetch(dg_ip)
         try:
-            gateway_device_id, endpoint_mac, interface, vrf = FromDatabase.get_next_hop_id_mac_by_arp_ip(self.datalake, dg_ip, endpoint_ip)
+            gateway_device_id, endpoint_mac, interface, vrf = self.get_next_hop_id_mac_by_arp_ip(dg_ip, endpoint_ip)
             next_hop_interface = converter.get_int_from_subint_if_subint(interface)
 
             mac_route = []
@@ -159,20 +294,21 @@ class Tracer:
 
     def mac_trace(self, mac_route, ip, id_, mac, next_hop_interface, next_hop_int_ip=None):
         try:
-            device = FromDevices.create_device(ip)
-
-            if not next_hop_interface:
-                next_hop_interface = FromDevices.get_next_hop_int_mac_address_table(device, mac)
-                next_hop_interface = FromDatabase.get_first_int_if_portchannel(self.datalake, id_, next_hop_interface) or FromDevices.last_int_in_port_channel(device, next_hop_interface)
+            self.wait_for_prefetch(ip)
+            with FromDevices.create_device(ip) as device:
+                if not next_hop_interface:
+                    next_hop_interface = FromDevices.get_next_hop_int_mac_address_table(device, mac)
+                    next_hop_interface = self.get_first_int_if_portchannel(id_, next_hop_interface) or FromDevices.last_int_in_port_channel(device, next_hop_interface)
+                self.prefetch_cdp_neighbor(id_, next_hop_interface)
 
-            mac_route.append(MacTraceHop(ip, id_, mac, next_hop_int_ip, next_hop_interface))
-            self.log(f"Mac: {mac_route[-1]}")
+                mac_route.append(MacTraceHop(ip, id_, mac, next_hop_int_ip, next_hop_interface))
+                self.log(f"Mac: {mac_route[-1]}")
 
-            if FromDatabase.is_destination(self.datalake, id_, next_hop_interface):
-                return True
+                if FromDatabase.is_destination(self.datalake, id_, next_hop_interface, resolver=self.device_ids):
+                    return True
 
-            next_hop_int_ip, next_hop_id = FromDevices.get_next_hop_ip_cdp(device, next_hop_interface)
-            next_hop_ip = FromDatabase.get_nihul_ip_by_int_ip(self.datalake, next_hop_int_ip)[0]
+                next_hop_int_ip, next_hop_id = self.get_next_hop_ip_cdp(device, id_, next_hop_interface)
+            next_hop_ip = self.get_nihul_ip_by_int_ip(next_hop_int_ip)[0]
 
             next_hop_interface = None
             return self.mac_trace(mac_route, next_hop_ip, next_hop_id, mac, next_hop_interface, next_hop_int_ip)
@@ -3,48 +3,78 @@ from pprint import pprint
 import psycopg2
 from typing import Union
 import trino
+import trino.exceptions
 from trino.exceptions import HttpError
 from trino.auth import BasicAuthentication
 import requests
 import urllib3
 
+from tracer.routetrace.query_cache import normalize_query, estimate_size
+from tracer.routetrace.query_metrics import measure_query, measure_stream
+from tracer.routetrace.result_stream import ResultStream
+from tracer.routetrace.retry_policy import RetryPolicy, CircuitBreaker
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+TRINO_HOST = '{host-sensitive}'
+TRINO_PORT = 443
+TRINO_USER = '{srv-sensitive}'
+TRINO_PASSWORD = '{password-sensitive}'
+TRINO_CATALOG = 'cockroachdb-devnet'
+TRINO_SCHEMA = 'network'
+
+TRANSIENT_ERRORS = (
+    HttpError,
+    trino.exceptions.OperationalError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    psycopg2.OperationalError,
+    psycopg2.InternalError,
+)
+
+DATALAKE_RETRY_POLICY = RetryPolicy(retry_on=TRANSIENT_ERRORS, breaker=CircuitBreaker())
+
+
 class TrinoDatalake:
-    def __init__(self):
+    def __init__(self, cache=None, retry_policy=None):
         self.cursor = self.connect_to_trino()
+        self.cache = cache
+        self.retry_policy = retry_policy or DATALAKE_RETRY_POLICY
 
     class TrinoConnectionError(Exception):
         pass
 
-    def execute_query(self, cursor: Union[psycopg2.extensions.cursor, trino.dbapi.Cursor], query: str, debug: bool = False):
+    def execute_query(self, cursor: Union[psycopg2.extensions.cursor, trino.dbapi.Cursor], query: str, params: list = None, debug: bool = False):
         """
-        function execute a sql script
-        :param [cursor: cursor type, query: string of sql script]
+        function execute a sql script, retrying transient errors according to self.retry_policy
+        :param [cursor: cursor type, query: string of sql script, params: values bound to the `?` placeholders]
         :return the output of the execute
         """
         cursor_type = "trino"
         if debug:
             start = time.time()
-            print(query)
-        result = None
-        result_columns = None
-        retry_counter = 0
-        error = None
+            print(query, params)
+
         connection = cursor.connection
-        while retry_counter < 5 and result is None:
-            try:
-                cursor.execute(query)
-                result = cursor.fetchall()
-                result_columns = [i[0] for i in cursor.description]
-            except (psycopg2.OperationalError, psycopg2.InternalError, psycopg2.errors.InFailedSqlTransaction, Exception) as e:
-                if debug:
-                    print(f"Execute error: {e}, Retry: {retry_counter}")
-                retry_counter = retry_counter + 1
-                error = e
-                cursor = connection.cursor()
-        if error and result is None:
-            raise error
+        cursors = [cursor]
+
+        def attempt():
+            current = cursors[-1]
+            if params:
+                current.execute(query, params)
+            else:
+                current.execute(query)
+            return current.fetchall(), [i[0] for i in current.description]
+
+        def on_retry(e, retry_counter):
+            if debug:
+                print(f"Execute error: {e}, Retry: {retry_counter}")
+            cursors.append(connection.cursor())
+
+        result, result_columns = self.retry_policy.call(attempt, on_retry=on_retry)
+
+        if cursor is self.cursor and len(cursors) > 1:
+            self.cursor = cursors[-1]
         if debug:
             end = time.time()
             print(f"{cursor_type} query execute time: {end - start: .6f} seconds")
@@ -54,13 +84,13 @@ class TrinoDatalake:
     def connect_to_trino(self):
         print({'option': 'super_title', 'message': 'connecting to trino...'})
         try:
-            auth = BasicAuthentication('{srv-sensitive}', '{password-sensitive}')
+            auth = BasicAuthentication(TRINO_USER, TRINO_PASSWORD)
             connection = trino.dbapi.connect(
-                host='{host-sensitive}',
-                port=443,
+                host=TRINO_HOST,
+                port=TRINO_PORT,
                 auth=auth,
-                catalog='cockroachdb-devnet',
-                schema='network',
+                catalog=TRINO_CATALOG,
+                schema=TRINO_SCHEMA,
                 http_scheme='https',
                 verify=False
             )
@@ -70,8 +100,80 @@ class TrinoDatalake:
         except Exception as e:
             print(f"Can't Connect To Trino, {e}")
 
-    def exec_query(self, query):
-        cursor = self.cursor
-        site_query = query
-        result_from_query = self.execute_query(cursor, site_query)
+    def exec_query(self, query, params=None, bypass_cache=False):
+        """
+        Executes a query, answering from the result cache when one is attached.
+        :param params: values bound to the `?` placeholders of the query
+        :param bypass_cache: skip the cache lookup (the fresh result still refreshes the cache)
+        """
+        with measure_query(query, 'trino') as record:
+            result_from_query = None
+            if self.cache is not None:
+                key = (normalize_query(query), tuple(params or ()))
+                if not bypass_cache:
+                    record.cache_hit, result_from_query = self.cache.get(key)
+
+            if not record.cache_hit:
+                result_from_query = self.execute_query(self.cursor, query, params)
+                if self.cache is not None:
+                    self.cache.put(key, result_from_query, self.cache.ttl_of(query))
+
+            record.rows = len(result_from_query[0])
+            record.bytes = estimate_size(result_from_query)
         return result_from_query
+
+    def exec_query_stream(self, query, params=None, batch_size=1000, on_close=None):
+        """
+        Executes a query on its own cursor and returns its rows as a ResultStream, fetched batch_size
+        rows at a time. Only executing the query and fetching the first batch are retried, streams
+        are never cached. The query is measured until the stream is closed.
+        :return ResultStream, close it (or use it in a with block) when not reading it to the end
+        """
+        connection = self.cursor.connection
+        cursors = [connection.cursor()]
+
+        def attempt():
+            current = cursors[-1]
+            if params:
+                current.execute(query, params)
+            else:
+                current.execute(query)
+            first_batch = current.fetchmany(batch_size)
+            return first_batch, [i[0] for i in current.description]
+
+        def on_retry(e, retry_counter):
+            cursors.append(connection.cursor())
+
+        with measure_stream(query, 'trino') as finish:
+            first_batch, columns = self.retry_policy.call(attempt, on_retry=on_retry)
+        return ResultStream(cursors[-1], columns, first_batch, batch_size=batch_size, on_close=on_close,
+                            on_finish=finish)
+
+    def exec_query_first(self, query, params=None):
+        """
+        :return the first row of the query or None, the rest of the query is cancelled
+        """
+        return self.exec_query_stream(query, params, batch_size=1).first()
+
+    def ping(self):
+        """
+        Runs a trivial query on the underlying connection, without retries.
+        :return True if trino answered, False otherwise
+        """
+        if self.cursor is None:
+            return False
+        try:
+            self.cursor.execute('select 1')
+            self.cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        if self.cursor is None:
+            return
+        try:
+            self.cursor.connection.close()
+        except Exception as e:
+            print(f"Error closing trino connection: {e}")
+        self.cursor = None
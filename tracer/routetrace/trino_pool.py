@@ -0,0 +1,220 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from tracer.routetrace.trino_connect import TrinoDatalake, TRANSIENT_ERRORS
+
+
+def is_connection_error(error):
+    """
+    :return True when error means the connection itself failed, so it shouldn't go back to the pool.
+    User, syntax and missing table errors come from a healthy connection. DeadlineExceeded raised while
+    retrying a transient error counts as that error.
+    """
+    return isinstance(error, TRANSIENT_ERRORS) or isinstance(error.__cause__, TRANSIENT_ERRORS)
+
+
+class TrinoConnectionPool:
+    """
+    Thread-safe pool of TrinoDatalake connections, meant to live for the whole lifetime of the app.
+
+    Every TrinoDatalake owns its own HTTPS connection and cursor, so a checked-out datalake is never
+    shared between threads. The pool itself exposes exec_query, which makes it a drop-in datalake for
+    Tracer and the FromDatabase functions: each query checks a connection out and returns it afterwards.
+    """
+
+    class PoolTimeoutError(Exception):
+        def __init__(self, message="Timed out waiting for a free trino connection."):
+            self.message = message
+            super().__init__(self.message)
+
+    class PoolClosedError(Exception):
+        def __init__(self, message="The trino connection pool is closed."):
+            self.message = message
+            super().__init__(self.message)
+
+    def __init__(self, min_size=1, max_size=8, checkout_timeout=30, health_check_interval=60, factory=None, cache=None):
+        """
+        :param min_size: connections opened up front
+        :param max_size: upper limit of open connections
+        :param checkout_timeout: seconds to wait for a free connection before raising PoolTimeoutError
+        :param health_check_interval: idle seconds after which a connection is pinged before being handed out
+        :param factory: callable creating a new TrinoDatalake
+        :param cache: QueryCache shared by every connection of the pool
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.cache = cache
+        self.factory = factory or (lambda: TrinoDatalake(cache=cache))
+
+        self._lock = threading.Condition()
+        self._idle = []  # (datalake, last_used)
+        self._size = 0
+        self._closed = False
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'failed_health_checks': 0,
+        }
+
+        for _ in range(min_size):
+            with self._lock:
+                self._size += 1
+            datalake = self._create()
+            with self._lock:
+                self._idle.append((datalake, time.monotonic()))
+
+    def __repr__(self):
+        return f"TrinoConnectionPool object with {self._size}/{self.max_size} connections"
+
+    def _create(self):
+        # The caller has already reserved a slot by incrementing _size.
+        try:
+            datalake = self.factory()
+            if datalake.cursor is None:
+                raise TrinoDatalake.TrinoConnectionError("Can't connect to trino.")
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._stats['created'] += 1
+        return datalake
+
+    def _discard(self, datalake):
+        datalake.close()
+        with self._lock:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._lock.notify()
+
+    def _is_healthy(self, datalake, last_used):
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        with self._lock:
+            self._stats['health_checks'] += 1
+        if datalake.ping():
+            return True
+        with self._lock:
+            self._stats['failed_health_checks'] += 1
+        return False
+
+    def checkout(self):
+        """
+        Takes a connection out of the pool, opening a new one if the pool is below max_size.
+        Blocks up to checkout_timeout seconds when every connection is in use.
+        :return TrinoDatalake
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        wait_start = time.monotonic()
+
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise self.PoolClosedError()
+
+                candidate = None
+                create = False
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise self.PoolTimeoutError()
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._lock.wait(remaining)
+                    continue
+
+            if create:
+                datalake = self._create()
+            else:
+                datalake, last_used = candidate
+                if not self._is_healthy(datalake, last_used):
+                    self._discard(datalake)
+                    continue
+
+            with self._lock:
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['wait_time'] += time.monotonic() - wait_start
+            return datalake
+
+    def checkin(self, datalake, broken=False):
+        """
+        Returns a connection to the pool. Broken connections are closed instead of being reused.
+        """
+        if broken or self._closed:
+            self._discard(datalake)
+            return
+        with self._lock:
+            self._idle.append((datalake, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        datalake = self.checkout()
+        broken = False
+        try:
+            yield datalake
+        except Exception as e:
+            broken = is_connection_error(e)
+            raise
+        finally:
+            self.checkin(datalake, broken=broken)
+
+    def exec_query(self, query, params=None, bypass_cache=False):
+        with self.connection() as datalake:
+            return datalake.exec_query(query, params, bypass_cache=bypass_cache)
+
+    def exec_query_stream(self, query, params=None, batch_size=1000):
+        """
+        The connection stays checked out until the returned stream is closed or read to the end. A fetch
+        that fails later on only discards it for a connection error, like connection() does.
+        """
+        datalake = self.checkout()
+
+        def on_close(error):
+            self.checkin(datalake, broken=error is not None and is_connection_error(error))
+
+        try:
+            return datalake.exec_query_stream(query, params, batch_size=batch_size, on_close=on_close)
+        except Exception as e:
+            self.checkin(datalake, broken=is_connection_error(e))
+            raise
+
+    def exec_query_first(self, query, params=None):
+        return self.exec_query_stream(query, params, batch_size=1).first()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max_size'] = self.max_size
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._lock.notify_all()
+        for datalake, _ in idle:
+            self._discard(datalake)